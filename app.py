@@ -1,16 +1,25 @@
 from flask import Flask, request, jsonify, send_from_directory, send_file, render_template, url_for, redirect, flash, Blueprint
 from flask_cors import CORS
-from mistralai import Mistral
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import joinedload, selectinload, contains_eager
 from models import (
     User, ROLES, Document, Page, PrescriptionAnalysis, 
     Medication, DocumentSummary, SummaryExtraction, 
-    Patient, PasswordResetToken, db
+    Patient, PasswordResetToken, ProcessingJob, ReanalysisJob, ImagePurge, db
 )
 from datetime import datetime, timedelta
 import os
 from dotenv import load_dotenv
-from modules.document_processor import process_pdf_document
+from modules.document_processor import process_pdf_document, process_pdf_file, ocr_cache
+from modules.job_queue import JobWorkerPool
+from modules.reanalysis_queue import ReanalysisWorker
+from modules.image_store import ImagePurger
+from modules.persistence import delete_documents
+from modules.http_cache import cached_json
+from modules.rate_limiter import mistral_limiter
+from modules.ocr_scheduler import ocr_scheduler
+from modules.llm_cache import llm_cache
+from modules.mistral_client import create_mistral_client
 from modules.prescription_processor import PrescriptionAgent, process_prescription_analysis
 from modules.summarizer_processor import process_document_summary
 import json
@@ -37,6 +46,7 @@ from routes.document_routes import init_document_routes
 from routes.prescription_routes import init_prescription_routes
 from routes.summary_routes import init_summary_routes
 from routes.auth_routes import init_auth_routes
+from routes.metrics_routes import init_metrics_routes
 
 # Load environment variables from .env file
 load_dotenv()
@@ -71,15 +81,33 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key')
 
+# Dossier des PDF en attente de traitement par les workers
+app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', os.path.join(basedir, 'uploads'))
+
 # Initialize database
 db.init_app(app)
 
-# Initialize Mistral client
-mistral_client = Mistral(api_key=os.getenv('MISTRAL_API_KEY'))
+# Initialize Mistral client (MISTRAL_BACKEND=mock for the offline stand-in)
+mistral_client = create_mistral_client()
 
 # Initialize prescription agent
 prescription_agent = PrescriptionAgent(mistral_client)
 
+# Background workers for PDF processing jobs (started on first use)
+job_workers = JobWorkerPool(app, db, ProcessingJob, Document, Page, process_pdf_file, mistral_client)
+
+# Background re-analysis of the pages corrected through the API (started on first use)
+reanalysis_worker = ReanalysisWorker(app, db, ReanalysisJob, Document, Medication, SummaryExtraction,
+                                     prescription_agent, mistral_client)
+
+# Background removal of the page images of deleted documents (started on the first request,
+# which also resumes the removals queued before a restart)
+image_purger = ImagePurger(app, db, Page, ImagePurge)
+
+@app.before_request
+def start_image_purger():
+    image_purger.start()
+
 # User loader for Flask-Login
 @login_manager.user_loader
 def load_user(user_id):
@@ -104,10 +132,11 @@ def role_required(*roles):
     return decorator
 
 # Initialize routes
-init_document_routes(app, db, Document, Page, process_pdf_document, mistral_client)
+init_document_routes(app, db, Document, Page, ProcessingJob, job_workers, ReanalysisJob, reanalysis_worker)
 init_prescription_routes(app, db, Document, PrescriptionAnalysis, Medication, prescription_agent, process_prescription_analysis, mistral_client)
 init_summary_routes(app, db, Document, DocumentSummary, SummaryExtraction, process_document_summary, mistral_client)
 init_auth_routes(app)
+init_metrics_routes(app, ocr_cache, llm_cache, mistral_limiter, ocr_scheduler, job_workers)
 
 @app.route('/')
 def index():
@@ -382,7 +411,7 @@ def create_prescription():
         except Exception as analysis_error:
             print(f"Prescription analysis error: {str(analysis_error)}")
             # Clean up if analysis fails
-            db.session.delete(document)
+            delete_documents(db, [document.id])
             db.session.commit()
             return jsonify({'error': f'Failed to analyze prescription: {str(analysis_error)}'}), 500
 
@@ -425,7 +454,7 @@ def update_prescription(id):
                     old_document = prescription.document
                     prescription.document_id = result.get('document_id')
                     # Delete old document
-                    db.session.delete(old_document)
+                    delete_documents(db, [old_document.id])
         
         db.session.commit()
         return jsonify({
@@ -438,6 +467,29 @@ def update_prescription(id):
         print(f"Error updating prescription: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+# Requêtes des pages patient : les relations utilisées par les vues sont chargées d'avance
+# (une requête par relation au lieu d'une par document ou par prescription)
+def patient_documents(user_id):
+    """Documents of a patient, newest first, with their prescription analysis loaded"""
+    return (
+        Document.query
+        .filter_by(user_id=user_id)
+        .options(joinedload(Document.prescription))
+        .order_by(Document.upload_date.desc())
+        .all()
+    )
+
+def patient_prescriptions(user_id):
+    """Prescription analyses of a patient, newest first, with their document and medications loaded"""
+    return (
+        PrescriptionAnalysis.query
+        .join(Document)
+        .filter(Document.user_id == user_id)
+        .options(contains_eager(PrescriptionAnalysis.document), selectinload(PrescriptionAnalysis.medications))
+        .order_by(PrescriptionAnalysis.analysis_date.desc())
+        .all()
+    )
+
 # Routes pour les patients
 @app.route('/patient/prescriptions')
 @login_required
@@ -452,18 +504,10 @@ def my_prescriptions():
                                  documents=[])
 
         # Récupérer les documents
-        documents = Document.query.filter_by(user_id=current_user.id)\
-                                .order_by(Document.upload_date.desc())\
-                                .all()
+        documents = patient_documents(current_user.id)
 
         # Récupérer les prescriptions
-        prescriptions = (
-            PrescriptionAnalysis.query
-            .join(Document)
-            .filter(Document.user_id == current_user.id)
-            .order_by(PrescriptionAnalysis.analysis_date.desc())
-            .all()
-        )
+        prescriptions = patient_prescriptions(current_user.id)
 
         medications_data = []
         for prescription in prescriptions:
@@ -746,16 +790,10 @@ def get_patient_data(patient_id):
             return jsonify({'error': 'Patient not found'}), 404
 
         # Récupérer les documents du patient
-        documents = Document.query.filter_by(user_id=patient_record.user_id)\
-            .order_by(Document.upload_date.desc())\
-            .all()
+        documents = patient_documents(patient_record.user_id)
         
         # Récupérer les prescriptions actives
-        prescriptions = PrescriptionAnalysis.query\
-            .join(Document)\
-            .filter(Document.user_id == patient_record.user_id)\
-            .order_by(PrescriptionAnalysis.analysis_date.desc())\
-            .all()
+        prescriptions = patient_prescriptions(patient_record.user_id)
 
         # Formatter les données
         patient_data = {
@@ -763,7 +801,7 @@ def get_patient_data(patient_id):
                 'id': doc.id,
                 'filename': doc.filename,
                 'upload_date': doc.upload_date.strftime('%Y-%m-%d'),
-                'status': 'Analyzed' if hasattr(doc, 'prescription') and doc.prescription else 'Pending'
+                'status': 'Analyzed' if doc.prescription else 'Pending'
             } for doc in documents] if documents else [],
             
             'prescriptions': [{
@@ -818,7 +856,7 @@ def analyze_summary(doc_id):
             ))
         else:
             if document.summary:
-                return jsonify({
+                return cached_json({
                     'extractions': [{
                         'category': ext.category,
                         'field': ext.field,
@@ -851,49 +889,9 @@ def delete_document_with_analyses(doc_id):
         elif current_user.role == 'patient' and document.user_id != current_user.id:
             return jsonify({'error': 'Access denied'}), 403
 
-        print(f"Starting deletion process for document {doc_id}")
-        
-        # First, get all related records
-        prescription = PrescriptionAnalysis.query.filter_by(document_id=doc_id).first()
-        summary = DocumentSummary.query.filter_by(document_id=doc_id).first()
-        
-        # Delete medications if they exist
-        if prescription:
-            print(f"Deleting medications for prescription {prescription.id}")
-            Medication.query.filter_by(prescription_id=prescription.id).delete()
-            db.session.flush()
-        
-        # Delete prescription analysis
-        if prescription:
-            print(f"Deleting prescription analysis {prescription.id}")
-            db.session.delete(prescription)
-            db.session.flush()
-        
-        # Delete summary extractions
-        if summary:
-            print(f"Deleting summary extractions for summary {summary.id}")
-            SummaryExtraction.query.filter_by(summary_id=summary.id).delete()
-            db.session.flush()
-        
-        # Delete summary
-        if summary:
-            print(f"Deleting summary {summary.id}")
-            db.session.delete(summary)
-            db.session.flush()
-        
-        # Delete pages
-        print(f"Deleting pages for document {doc_id}")
-        Page.query.filter_by(document_id=doc_id).delete()
-        db.session.flush()
-        
-        # Refresh the document from the database
-        db.session.refresh(document)
-        
-        # Delete the document
-        print(f"Deleting document {doc_id}")
-        db.session.delete(document)
-        
-        # Final commit
+        # Pages, analyses and the document are removed with set-based DELETEs, page
+        # images are purged in the background
+        delete_documents(db, [doc_id])
         db.session.commit()
         print(f"Successfully deleted document {doc_id} and all related records")
         
@@ -905,7 +903,10 @@ def delete_document_with_analyses(doc_id):
         print(f"Error deleting document {doc_id}: {error_msg}")
         return jsonify({'error': error_msg}), 500
 
-if __name__ == '__main__':
+def run():
     with app.app_context():
         db.create_all()
     app.run(debug=True, port=8080, host='0.0.0.0')
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,98 @@
+"""Check that the analysis paths never fetch page images from the database.
+
+Stores a document whose pages carry legacy base64 images in `page.image_data` (as
+before the image store), then runs the prescription and summary analyses, a page
+correction (waiting for the re-analysis it queues) and the document view on the mock Mistral
+backend with no latency, recording every SQL statement. Exits with status 1 if a
+statement fetches `page.image_data` (testing it for NULL is fine), for CI, and reports
+the time of each request.
+
+Usage:
+    python benchmarks/analysis_io.py [--pages 200] [--image-kb 500]
+"""
+import sys
+import io
+import re
+import time
+import argparse
+import contextlib
+from bench_environment import throwaway_environment, import_app
+
+IMAGE_COLUMN = re.compile(r'\bpage\.image_data\b(?!\s+IS\b)', re.IGNORECASE)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--image-kb', type=int, default=500, help='Size of each legacy page image (KB of base64)')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    with throwaway_environment('analysis-io'):
+        run(args)
+
+def run(args):
+    application, models = import_app()
+    from modules.persistence import bulk_insert
+    from sqlalchemy import event
+
+    flask_app = application.app
+    db = models.db
+    statements = []
+    with flask_app.app_context():
+        db.create_all()
+        user = models.User(email='bench@example.com', role=models.ROLES['PATIENT'])
+        user.set_password('bench')
+        db.session.add(user)
+        db.session.flush()
+        document = models.Document(filename='legacy.pdf', total_pages=args.pages, user_id=user.id)
+        db.session.add(document)
+        db.session.flush()
+        image_data = 'data:image/png;base64,' + 'A' * (args.image_kb * 1024)
+        bulk_insert(db, models.Page, [{
+            'document_id': document.id,
+            'page_number': page_number,
+            'content': f"Page {page_number}: Doliprane 1g, 3 fois par jour pendant 5 jours. " * 20,
+            'image_data': image_data
+        } for page_number in range(1, args.pages + 1)])
+        db.session.commit()
+        document_id = document.id
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *rest: statements.append(statement))
+
+    client = flask_app.test_client()
+    requests = [
+        ('analyze prescription', 'post', f'/api/analyze-prescription/{document_id}', None),
+        ('analyze summary', 'post', f'/api/analyze-summary/{document_id}', None),
+        ('correct a page', 'put', f'/api/documents/{document_id}/pages/3', {'content': 'Amoxicilline 1g, 2 fois par jour'}),
+        ('view document', 'get', f'/api/documents/{document_id}', None),
+    ]
+    failures = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        client.post('/login', data={'email': 'bench@example.com', 'password': 'bench'})
+    print(f"{args.pages} pages with {args.image_kb} KB legacy images")
+    for name, method, url, body in requests:
+        del statements[:]
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = getattr(client, method)(url, json=body)
+            reanalysis = response.get_json().get('reanalysis') if response.status_code == 200 else None
+            while reanalysis and reanalysis['status'] not in ('completed', 'failed'):
+                time.sleep(0.05)
+                reanalysis = client.get(f"/api/reanalysis/{reanalysis['reanalysis_id']}").get_json()
+        elapsed = time.perf_counter() - start
+        if response.status_code != 200:
+            sys.exit(f"{method.upper()} {url} failed with status {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        if reanalysis and reanalysis['status'] == 'failed':
+            sys.exit(f"Re-analysis after {method.upper()} {url} failed: {reanalysis['error']}")
+        image_reads = [statement for statement in statements if IMAGE_COLUMN.search(statement)]
+        print(f"{name:>22}: {elapsed * 1000:8.1f} ms, {len(statements):3} queries, {len(image_reads)} reading page images")
+        if image_reads:
+            failures.append(name)
+
+    if failures:
+        print(f"Page images fetched by: {', '.join(failures)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
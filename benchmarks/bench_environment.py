@@ -0,0 +1,53 @@
+"""Throwaway environment shared by the benchmarks that run the app.
+
+The app reads its configuration from the environment when it is imported, so the
+benchmarks enter `throwaway_environment` first, then call `import_app`:
+
+    with throwaway_environment('queries') as workdir:
+        application, models = import_app()
+        ...
+
+The database, uploads, page images and caches all live in a temporary work directory,
+removed on exit even if the benchmark fails.
+"""
+import os
+import io
+import sys
+import shutil
+import tempfile
+import contextlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@contextlib.contextmanager
+def throwaway_environment(name, **variables):
+    """Point the app at the mock backend and a temporary work directory, and yield the directory.
+
+    `variables` override or add environment variables (e.g. DATABASE_URL to benchmark an
+    existing database, which is left in place).
+    """
+    workdir = tempfile.mkdtemp(prefix=f"medicalxtractor-{name}-")
+    try:
+        os.environ.update({
+            'MISTRAL_BACKEND': 'mock',
+            'MOCK_MISTRAL_LATENCY': '0',
+            'LLM_CACHE_ENABLED': 'false',
+            'DATABASE_URL': f"sqlite:///{os.path.join(workdir, f'{name}.db')}",
+            'UPLOAD_FOLDER': os.path.join(workdir, 'uploads'),
+            'IMAGE_STORE_DIR': os.path.join(workdir, 'page_images'),
+            'CACHE_DIR': os.path.join(workdir, 'cache'),
+            **{key: str(value) for key, value in variables.items() if value is not None}
+        })
+        if ROOT not in sys.path:
+            sys.path.insert(0, ROOT)
+        os.chdir(ROOT)
+        yield workdir
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def import_app(verbose=False):
+    """Import and return the `app` and `models` modules, silencing their startup logs unless `verbose`"""
+    with contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO()):
+        import app
+        import models
+    return app, models
@@ -0,0 +1,165 @@
+"""Check that the main list/detail queries use indexes on a large database.
+
+Fills a throwaway database (or an empty one given with --database-url) with --pages
+pages spread over documents, users and analyses, then runs EXPLAIN on the queries the
+app issues on every list or detail view: a full table scan in any plan is reported and
+makes the script exit with status 1 (for CI).
+
+Usage:
+    python benchmarks/explain_indexes.py [--pages 1000000] [--pages-per-document 50]
+                                         [--database-url postgresql://...]
+
+SQLite plans come from EXPLAIN QUERY PLAN, PostgreSQL plans from EXPLAIN; the tables
+are ANALYZEd first so the planner sees the real row counts.
+"""
+import sys
+import time
+import argparse
+from datetime import datetime, timedelta
+from bench_environment import throwaway_environment, import_app
+
+INSERT_BATCH = 20000
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=1000000, help='Pages in the database')
+    parser.add_argument('--pages-per-document', type=int, default=50)
+    parser.add_argument('--documents-per-patient', type=int, default=10)
+    parser.add_argument('--database-url', help='Empty database to fill (default: a temporary SQLite file)')
+    return parser.parse_args()
+
+def insert_rows(conn, table, rows):
+    """Insert rows (an iterable of dicts) with executemany, in batches"""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == INSERT_BATCH:
+            conn.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        conn.execute(table.insert(), batch)
+
+def seed(db, models, pages, pages_per_document, documents_per_patient):
+    """Fill the tables; ids are assigned explicitly so rows can reference each other"""
+    documents = max(pages // pages_per_document, 1)
+    patients = max(documents // documents_per_patient, 1)
+    doctors = max(patients // 20, 1)
+    start = datetime(2015, 1, 1)
+
+    with db.engine.begin() as conn:
+        # Users: doctors first, then patients
+        insert_rows(conn, models.User.__table__, (
+            {'id': i, 'email': f"user{i}@example.com", 'password_hash': 'x',
+             'role': models.ROLES['MEDECIN'] if i <= doctors else models.ROLES['PATIENT']}
+            for i in range(1, doctors + patients + 1)
+        ))
+        insert_rows(conn, models.Patient.__table__, (
+            {'id': i, 'doctor_id': (i % doctors) + 1, 'user_id': doctors + i}
+            for i in range(1, patients + 1)
+        ))
+        insert_rows(conn, models.Document.__table__, (
+            {'id': i, 'filename': f"record-{i}.pdf", 'total_pages': pages_per_document,
+             'user_id': doctors + (i % patients) + 1, 'upload_date': start + timedelta(hours=i)}
+            for i in range(1, documents + 1)
+        ))
+        insert_rows(conn, models.Page.__table__, (
+            {'id': i, 'document_id': (i - 1) // pages_per_document + 1, 'page_number': (i - 1) % pages_per_document + 1,
+             'content': 'Compte rendu de consultation', 'image_ref': f"{i:064x}.png", 'content_source': 'native'}
+            for i in range(1, documents * pages_per_document + 1)
+        ))
+        insert_rows(conn, models.PrescriptionAnalysis.__table__, (
+            {'id': i, 'document_id': i, 'analysis_date': start} for i in range(1, documents + 1)
+        ))
+        insert_rows(conn, models.Medication.__table__, (
+            {'id': i, 'prescription_id': (i - 1) // 3 + 1, 'name': 'Doliprane', 'page_number': 1}
+            for i in range(1, documents * 3 + 1)
+        ))
+        insert_rows(conn, models.DocumentSummary.__table__, (
+            {'id': i, 'document_id': i, 'analysis_date': start} for i in range(1, documents + 1)
+        ))
+        insert_rows(conn, models.SummaryExtraction.__table__, (
+            {'id': i, 'summary_id': (i - 1) // 5 + 1, 'category': 'Identity', 'field': 'Full Name',
+             'value': 'Jean Dupont', 'extraction_date': start}
+            for i in range(1, documents * 5 + 1)
+        ))
+        insert_rows(conn, models.PasswordResetToken.__table__, (
+            {'id': i, 'user_id': i, 'token': f"token-{i}", 'expiration': start} for i in range(1, patients + 1)
+        ))
+    return {'documents': documents, 'patients': patients, 'doctors': doctors}
+
+def main_queries(models, counts):
+    """The statements behind the main list and detail views, for a patient in the middle of the data"""
+    from sqlalchemy import select
+
+    Document, Page = models.Document, models.Page
+    doctor_id = 1
+    patient_user_id = counts['doctors'] + counts['patients'] // 2
+    document_id = counts['documents'] // 2
+    return {
+        'documents of a user': select(Document).where(Document.user_id == patient_user_id)
+                                               .order_by(Document.upload_date.desc()),
+        'page of a document': select(Page).where(Page.document_id == document_id, Page.page_number == 3),
+        'pages of a document': select(Page).where(Page.document_id == document_id).order_by(Page.page_number),
+        'prescription of a document': select(models.PrescriptionAnalysis)
+                                      .where(models.PrescriptionAnalysis.document_id == document_id),
+        'medications of prescriptions': select(models.Medication)
+                                        .where(models.Medication.prescription_id.in_([document_id, document_id + 1])),
+        'summary of a document': select(models.DocumentSummary).where(models.DocumentSummary.document_id == document_id),
+        'extractions of a summary': select(models.SummaryExtraction)
+                                    .where(models.SummaryExtraction.summary_id == document_id),
+        'patients of a doctor': select(models.Patient).where(models.Patient.doctor_id == doctor_id),
+        'patient record of a user': select(models.Patient).where(models.Patient.user_id == patient_user_id),
+        'users of a role': select(models.User).where(models.User.role == models.ROLES['ADMIN']),
+        'password reset token': select(models.PasswordResetToken).where(models.PasswordResetToken.token == 'token-7'),
+    }
+
+def explain(conn, statement):
+    """Return (plan lines, full scans) for a statement"""
+    from sqlalchemy import text
+
+    sql = str(statement.compile(conn, compile_kwargs={'literal_binds': True}))
+    if conn.dialect.name == 'sqlite':
+        lines = [row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+        # "SCAN page" is a full scan; "SEARCH ... USING INDEX" and "SCAN ... USING INDEX" are not
+        scans = [line for line in lines if line.startswith('SCAN') and 'INDEX' not in line]
+    else:
+        lines = [row[0] for row in conn.execute(text(f"EXPLAIN {sql}"))]
+        scans = [line for line in lines if 'Seq Scan' in line]
+    return lines, scans
+
+def main():
+    args = parse_args()
+    with throwaway_environment('explain', DATABASE_URL=args.database_url):
+        run(args)
+
+def run(args):
+    application, models = import_app()
+
+    from sqlalchemy import text
+
+    db = models.db
+    with application.app.app_context():
+        db.create_all()
+        start = time.time()
+        counts = seed(db, models, args.pages, args.pages_per_document, args.documents_per_patient)
+        print(f"Seeded {args.pages} pages, {counts['documents']} documents and {counts['patients']} patients "
+              f"in {time.time() - start:.1f}s")
+
+        failures = []
+        with db.engine.begin() as conn:
+            conn.execute(text('ANALYZE'))
+            for name, statement in main_queries(models, counts).items():
+                lines, scans = explain(conn, statement)
+                print(f"\n{name}:")
+                for line in lines:
+                    print(f"    {line}")
+                if scans:
+                    failures.append(name)
+
+    if failures:
+        print(f"\nFull table scans in: {', '.join(failures)}")
+        sys.exit(1)
+    print("\nAll queries use indexes")
+
+if __name__ == '__main__':
+    main()
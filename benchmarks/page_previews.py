@@ -0,0 +1,112 @@
+"""Compare the bytes served for page previews at each image size.
+
+Uploads a synthetic scanned PDF (every page is a noisy full-page image, like a
+scan) to /api/process-pdf on the mock Mistral backend, then fetches every page image
+at size=thumb, screen and full through the URLs returned by /api/documents/<id>, and
+reports the average size and serving time per page. Exits with status 1 if a preview
+is missing (the full image is served instead) or if thumbnails average more than
+--max-thumb-kb, for CI.
+
+Usage:
+    python benchmarks/page_previews.py [--pages 20] [--max-thumb-kb 30]
+"""
+import sys
+import io
+import time
+import argparse
+import contextlib
+from bench_environment import throwaway_environment, import_app
+
+SIZE_FIELDS = {'thumb': 'thumb_url', 'screen': 'screen_url', 'full': 'image_url'}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--max-thumb-kb', type=float, default=30)
+    return parser.parse_args()
+
+def make_scanned_pdf(pages):
+    """PDF whose pages are grainy full-page images with no text layer"""
+    import fitz  # PyMuPDF
+    from PIL import Image, ImageDraw
+
+    pdf_document = fitz.open()
+    for page_number in range(1, pages + 1):
+        page = pdf_document.new_page()
+        scan = Image.effect_noise((850, 1100), 24).point(lambda value: min(255, value + 96)).convert('RGB')
+        draw = ImageDraw.Draw(scan)
+        for line in range(40):
+            draw.text((60, 80 + line * 24), f"Page {page_number} - compte rendu de consultation, ligne {line}", fill='black')
+        buffer = io.BytesIO()
+        scan.save(buffer, format='PNG')
+        page.insert_image(page.rect, stream=buffer.getvalue())
+    data = pdf_document.tobytes()
+    pdf_document.close()
+    return data
+
+def main():
+    args = parse_args()
+    with throwaway_environment('previews'):
+        run(args)
+
+def run(args):
+    application, models = import_app()
+
+    flask_app = application.app
+    with flask_app.app_context():
+        models.db.create_all()
+        user = models.User(email='bench@example.com', role=models.ROLES['PATIENT'])
+        user.set_password('bench')
+        models.db.session.add(user)
+        models.db.session.commit()
+
+    client = flask_app.test_client()
+    with contextlib.redirect_stdout(io.StringIO()):
+        client.post('/login', data={'email': 'bench@example.com', 'password': 'bench'})
+        start = time.perf_counter()
+        response = client.post('/api/process-pdf', data={'file': (io.BytesIO(make_scanned_pdf(args.pages)), 'scan.pdf')},
+                               content_type='multipart/form-data')
+        if response.status_code != 202:
+            sys.exit(f"Upload failed: {response.get_data(as_text=True)[:200]}")
+        job_id = response.get_json()['job_id']
+        while True:
+            job = client.get(f'/api/jobs/{job_id}').get_json()
+            if job['status'] in ('completed', 'failed'):
+                break
+            time.sleep(0.05)
+    ingest_time = time.perf_counter() - start
+    if job['status'] != 'completed':
+        sys.exit(f"Processing failed: {job.get('error')}")
+
+    document = client.get(f"/api/documents/{job['document_id']}?limit=200&fields=page_number,image_url,screen_url,thumb_url").get_json()
+    served = {size: [] for size in SIZE_FIELDS}
+    timings = {size: 0.0 for size in SIZE_FIELDS}
+    for page in document['pages']:
+        for size, field in SIZE_FIELDS.items():
+            start = time.perf_counter()
+            response = client.get(page[field])
+            timings[size] += time.perf_counter() - start
+            if response.status_code != 200:
+                sys.exit(f"GET {page[field]} failed with status {response.status_code}")
+            served[size].append(response.get_data())
+
+    pages = len(document['pages'])
+    print(f"{pages} scanned pages, ingested in {ingest_time:.1f} s")
+    for size, images in served.items():
+        average_kb = sum(len(image) for image in images) / len(images) / 1024
+        print(f"{size:>8}: {average_kb:8.1f} KB/page, {timings[size] / pages * 1000:6.2f} ms/page")
+
+    failures = []
+    for size in ('thumb', 'screen'):
+        missing = sum(1 for preview, full in zip(served[size], served['full']) if preview == full)
+        if missing:
+            failures.append(f"{missing} pages served the full image for size={size}")
+    thumb_kb = sum(len(image) for image in served['thumb']) / pages / 1024
+    if thumb_kb > args.max_thumb_kb:
+        failures.append(f"thumbnails average {thumb_kb:.1f} KB (limit {args.max_thumb_kb} KB)")
+    if failures:
+        print('\n'.join(failures))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
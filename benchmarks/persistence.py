@@ -0,0 +1,130 @@
+"""Measure the database time of storing a processed document.
+
+Writes the pages of a --pages document with the job progress updates that go with
+them, the way process_pdf_file did before batching (one add + commit per page and one
+progress commit per page) and with the BatchWriter of modules/persistence.py, then
+stores --extractions summary extractions row by row and with one bulk insert. No OCR
+or API call is involved: only the database work is timed.
+
+Usage:
+    python benchmarks/persistence.py [--pages 500] [--extractions 500] [--runs 3]
+                                     [--database-url postgresql://...]
+
+Without --database-url, a temporary SQLite file is used (with its default, durable
+synchronous mode, so every commit is an fsync).
+"""
+import os
+import time
+import argparse
+from datetime import datetime
+from bench_environment import throwaway_environment, import_app
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=500)
+    parser.add_argument('--extractions', type=int, default=500)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--database-url', help='Database to write to (default: a temporary SQLite file)')
+    return parser.parse_args()
+
+def page_rows(document_id, pages):
+    content = "Compte rendu de consultation, traitement en cours. " * 40  # ~2 KB, a typical OCRed page
+    return [{
+        'page_number': page_number,
+        'content': content,
+        'image_ref': f"{document_id:032x}{page_number:032x}.png",
+        'content_source': 'vision',
+        'document_id': document_id
+    } for page_number in range(1, pages + 1)]
+
+def extraction_rows(summary_id, extractions):
+    return [{
+        'summary_id': summary_id,
+        'category': 'Medical History',
+        'field': f"Finding {number}",
+        'value': 'Hypertension artérielle traitée depuis 2015',
+        'page_number': number % 50 + 1
+    } for number in range(extractions)]
+
+def new_job(db, models, user_id):
+    document = models.Document(filename='bench.pdf', user_id=user_id)
+    job = models.ProcessingJob(filename='bench.pdf', file_path='/dev/null', user_id=user_id,
+                               requested_by_id=user_id, status='running', pages_done=0, pages_failed=0)
+    db.session.add_all([document, job])
+    db.session.commit()
+    return document, job
+
+def store_pages_per_page(db, models, document, job, pages):
+    """Previous behaviour: each page is added and committed, then the job progress is committed"""
+    for row in page_rows(document.id, pages):
+        db.session.add(models.Page(**row))
+        db.session.commit()
+        job.pages_done += 1
+        job.heartbeat_at = datetime.utcnow()
+        db.session.commit()
+
+def store_pages_batched(db, models, document, job, pages):
+    """Current behaviour: pages go through a BatchWriter, progress is committed once per batch"""
+    from modules.persistence import BatchWriter
+
+    def on_flushed(saved, failed):
+        job.pages_done += len(saved)
+        job.heartbeat_at = datetime.utcnow()
+        db.session.commit()
+
+    writer = BatchWriter(db, models.Page, on_flushed=on_flushed)
+    for row in page_rows(document.id, pages):
+        writer.add(row)
+    writer.flush()
+
+def store_extractions_per_row(db, models, summary, extractions):
+    for row in extraction_rows(summary.id, extractions):
+        db.session.add(models.SummaryExtraction(**row))
+    db.session.commit()
+
+def store_extractions_bulk(db, models, summary, extractions):
+    from modules.persistence import bulk_insert
+
+    bulk_insert(db, models.SummaryExtraction, extraction_rows(summary.id, extractions))
+    db.session.commit()
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+def main():
+    args = parse_args()
+    with throwaway_environment('persistence', DATABASE_URL=args.database_url):
+        run(args)
+
+def run(args):
+    application, models = import_app()
+
+    db = models.db
+    timings = {'pages per page': [], 'pages batched': [], 'extractions per row': [], 'extractions bulk': []}
+    with application.app.app_context():
+        db.create_all()
+        user = models.User(email=f"bench-{os.getpid()}@example.com", password_hash='x', role=models.ROLES['PATIENT'])
+        db.session.add(user)
+        db.session.commit()
+
+        for _ in range(args.runs):
+            for name, store in (('pages per page', store_pages_per_page), ('pages batched', store_pages_batched)):
+                document, job = new_job(db, models, user.id)
+                timings[name].append(timed(store, db, models, document, job, args.pages))
+            for name, store in (('extractions per row', store_extractions_per_row), ('extractions bulk', store_extractions_bulk)):
+                document, _ = new_job(db, models, user.id)
+                summary = models.DocumentSummary(document_id=document.id)
+                db.session.add(summary)
+                db.session.commit()
+                timings[name].append(timed(store, db, models, summary, args.extractions))
+
+    print(f"{args.pages} pages, {args.extractions} extractions, best of {args.runs} runs "
+          f"({os.environ['DATABASE_URL'].split(':', 1)[0]})")
+    for name, values in timings.items():
+        print(f"{name:>22}: {min(values) * 1000:9.1f} ms")
+    print(f"{'pages speedup':>22}: {min(timings['pages per page']) / min(timings['pages batched']):9.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Report the size of the analysis prompts sent for a document.
+
+Builds the prescription and summary prompts (without calling Mistral) and compares
+their size with the previous encoding, which sent the concatenated text plus a
+`pages_info` list repeating every page's content. Documents are not split into page
+windows here, so both encodings are compared on whole-document prompts.
+
+Usage:
+    python benchmarks/prompt_size.py record.pdf notes.txt [--document-id 12 ...] [--json results.json]
+
+PDF files are read from their text layer; text files may separate pages with form feeds.
+--document-id reads the pages of an uploaded document from DATABASE_URL.
+"""
+import os
+import sys
+import json
+import argparse
+import contextlib
+import io
+import threading
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The replies are canned: never read them from, or write them to, the app's LLM cache
+os.environ['LLM_CACHE_ENABLED'] = 'false'
+
+from dotenv import load_dotenv
+from benchmarks.summary_modes import load_pages
+from modules.prescription_processor import PrescriptionAgent
+from modules.summarizer_processor import SummarizerAgent, SUMMARY_MODES
+from modules.prompt_utils import format_pages_for_prompt
+
+class RecordingChat:
+    """Stand-in for client.chat that records prompts and returns an empty result"""
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.prompts = []
+        self._lock = threading.Lock()
+
+    def complete(self, **kwargs):
+        chars = sum(len(m['content']) for m in kwargs.get('messages', []) if isinstance(m.get('content'), str))
+        with self._lock:
+            self.prompts.append(chars)
+        message = SimpleNamespace(content=self.reply)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+class RecordingClient:
+    def __init__(self, reply):
+        self.chat = RecordingChat(reply)
+
+def load_db_pages(document_ids):
+    """Return {label: pages} for documents stored in the database"""
+    from flask import Flask
+    from models import db, Page
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("DATABASE_URL")
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+
+    documents = {}
+    with app.app_context():
+        for document_id in document_ids:
+            rows = (db.session.query(Page.page_number, Page.content)
+                    .filter(Page.document_id == document_id)
+                    .order_by(Page.page_number)
+                    .all())
+            documents[f"document {document_id}"] = [
+                {'page_number': row.page_number, 'content': row.content or ''} for row in rows
+            ]
+    return documents
+
+def legacy_payload_chars(pages, summary):
+    """Size of the document payload of a prompt with the previous encoding"""
+    pages_info = [{'page_number': page['page_number'], 'content': page['content']} for page in pages]
+    if summary:
+        return len(format_pages_for_prompt(pages)) + len(json.dumps(pages_info, indent=2))
+    return len("\n".join([page['content'] for page in pages])) + len(str(pages_info))
+
+def measure(pages):
+    """Prompt sizes (chars) per analysis, before and after the page-tagged encoding"""
+    payload_after = len(format_pages_for_prompt(pages))
+    results = {}
+
+    with contextlib.redirect_stdout(io.StringIO()):  # The agents are very verbose
+        client = RecordingClient('{"medications": []}')
+        PrescriptionAgent(client, chunk_token_budget=sys.maxsize).analyze_prescription(pages)
+        prescription_prompts = client.chat.prompts
+
+        summary_prompts = {}
+        for mode in SUMMARY_MODES:
+            client = RecordingClient('[]')
+            SummarizerAgent(client, mode=mode, chunk_token_budget=sys.maxsize).analyze_document(pages)
+            summary_prompts[mode] = client.chat.prompts
+
+    analyses = [('prescription', prescription_prompts, False)]
+    analyses += [(f"summary ({mode})", prompts, True) for mode, prompts in summary_prompts.items()]
+    for name, prompts, summary in analyses:
+        after = sum(prompts)
+        before = after + len(prompts) * (legacy_payload_chars(pages, summary) - payload_after)
+        results[name] = {
+            'requests': len(prompts),
+            'chars_before': before,
+            'chars_after': after,
+            'tokens_before_est': before // 4,
+            'tokens_after_est': after // 4,
+            'reduction': round(1 - after / before, 3) if before else None
+        }
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('documents', nargs='*', help='PDF or text files')
+    parser.add_argument('--document-id', type=int, action='append', default=[], help='Document stored in the database')
+    parser.add_argument('--json', help='Write the full results to this file')
+    args = parser.parse_args()
+    if not args.documents and not args.document_id:
+        parser.error('give at least one file or --document-id')
+
+    load_dotenv()
+    documents = {path: load_pages(path) for path in args.documents}
+    if args.document_id:
+        documents.update(load_db_pages(args.document_id))
+
+    results = []
+    for label, pages in documents.items():
+        sizes = measure(pages)
+        results.append({'document': label, 'pages': len(pages), 'analyses': sizes})
+
+        print(f"\n{label} ({len(pages)} pages)")
+        print(f"{'analysis':<24}{'requests':>10}{'tokens before':>15}{'tokens after':>14}{'reduction':>11}")
+        for name, size in sizes.items():
+            reduction = f"{size['reduction']:.0%}" if size['reduction'] is not None else '-'
+            print(f"{name:<24}{size['requests']:>10}{size['tokens_before_est']:>15}{size['tokens_after_est']:>14}{reduction:>11}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Count the SQL queries issued by the patient history pages.
+
+Creates a doctor and a patient with N analyzed documents (each with a prescription of
+a few medications) in a throwaway database, then requests /patient/prescriptions (as
+the patient) and /api/patient/<id>/data (as the doctor) and counts the statements sent
+to the database. Apart from the IN batches of selectinload (500 rows per query), the
+count must not grow with the number of documents: the script exits with status 1 if
+it exceeds --max-queries on any size (for CI).
+
+Usage:
+    python benchmarks/query_count.py [--documents 10 1000] [--medications 3] [--max-queries 10]
+"""
+import sys
+import io
+import argparse
+import contextlib
+from datetime import datetime, timedelta
+from bench_environment import throwaway_environment, import_app
+
+ENDPOINTS = ('/patient/prescriptions', '/api/patient/{patient_id}/data')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, nargs='+', default=[10, 1000], help='Documents per patient')
+    parser.add_argument('--medications', type=int, default=3, help='Medications per prescription')
+    parser.add_argument('--max-queries', type=int, default=10, help='Allowed queries per request')
+    return parser.parse_args()
+
+class QueryCounter:
+    """Counts the statements executed on an engine while active"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.count = 0
+        self.active = False
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        if self.active:
+            self.count += 1
+
+    @contextlib.contextmanager
+    def counting(self):
+        self.count = 0
+        self.active = True
+        try:
+            yield self
+        finally:
+            self.active = False
+
+def seed_patient(db, models, index, documents, medications):
+    """Create a patient (and their doctor) with `documents` analyzed documents"""
+    doctor = models.User(email=f"doctor{index}@example.com", role=models.ROLES['MEDECIN'])
+    patient_user = models.User(email=f"patient{index}@example.com", role=models.ROLES['PATIENT'])
+    for user in (doctor, patient_user):
+        user.set_password('bench')
+    db.session.add_all([doctor, patient_user])
+    db.session.flush()
+    patient = models.Patient(doctor_id=doctor.id, user_id=patient_user.id)
+    db.session.add(patient)
+
+    start = datetime(2020, 1, 1)
+    for number in range(documents):
+        document = models.Document(filename=f"record-{number}.pdf", total_pages=2, user_id=patient_user.id,
+                                   upload_date=start + timedelta(days=number))
+        analysis = models.PrescriptionAnalysis(document=document)
+        for med in range(medications):
+            analysis.medications.append(models.Medication(
+                name=f"Medication {med}", dosage='1g', frequency='3 fois par jour',
+                start_date=document.upload_date, page_number=1
+            ))
+        db.session.add(document)
+    db.session.commit()
+    return doctor.email, patient_user.email, patient.id
+
+def main():
+    args = parse_args()
+    with throwaway_environment('queries'):
+        run(args)
+
+def run(args):
+    application, models = import_app()
+
+    flask_app = application.app
+    db = models.db
+    counts = {}
+    with flask_app.app_context():
+        db.create_all()
+        counter = QueryCounter(db.engine)
+
+        for index, documents in enumerate(args.documents):
+            doctor_email, patient_email, patient_id = seed_patient(db, models, index, documents, args.medications)
+            counts[documents] = {}
+            for email, endpoint in zip((patient_email, doctor_email), ENDPOINTS):
+                url = endpoint.format(patient_id=patient_id)
+                client = flask_app.test_client()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    client.post('/login', data={'email': email, 'password': 'bench'})
+                    with counter.counting():
+                        response = client.get(url)
+                if response.status_code != 200:
+                    sys.exit(f"GET {url} failed with status {response.status_code}")
+                counts[documents][endpoint] = counter.count
+
+    print(f"{'documents':>10}" + ''.join(f"{endpoint:>34}" for endpoint in ENDPOINTS))
+    for documents, by_endpoint in counts.items():
+        print(f"{documents:>10}" + ''.join(f"{by_endpoint[endpoint]:>34}" for endpoint in ENDPOINTS))
+
+    failures = [
+        f"{name}: {count} queries for {documents} documents (max {args.max_queries})"
+        for documents, by_endpoint in counts.items()
+        for name, count in by_endpoint.items()
+        if count > args.max_queries
+    ]
+    for failure in failures:
+        print(failure)
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Compare the per-category and packed summary extraction modes.
+
+Runs SummarizerAgent in both modes on the given documents and reports, for each mode,
+latency, number of requests and input size, and for the packed mode its field recall
+against the per-category mode (taken as the reference).
+
+Usage:
+    python benchmarks/summary_modes.py record.pdf notes.txt [--json results.json]
+
+PDF files are read from their text layer; text files may separate pages with form feeds.
+Requires MISTRAL_API_KEY.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+import io
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Measure real requests: no reply is read from, or written to, the app's LLM cache
+os.environ['LLM_CACHE_ENABLED'] = 'false'
+
+import fitz  # PyMuPDF
+from dotenv import load_dotenv
+from mistralai import Mistral
+from modules.summarizer_processor import process_document_summary, SUMMARY_MODES
+
+class CountingChat:
+    """Wrap client.chat to count requests and prompt size"""
+
+    def __init__(self, chat):
+        self._chat = chat
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.input_chars = 0
+
+    def complete(self, **kwargs):
+        chars = sum(len(m['content']) for m in kwargs.get('messages', []) if isinstance(m.get('content'), str))
+        with self._lock:
+            self.requests += 1
+            self.input_chars += chars
+        return self._chat.complete(**kwargs)
+
+class CountingClient:
+    def __init__(self, client):
+        self.chat = CountingChat(client.chat)
+
+def load_pages(path):
+    """Return the document as a list of {'page_number', 'content'}"""
+    if path.lower().endswith('.pdf'):
+        with fitz.open(path) as pdf_document:
+            texts = [page.get_text("text") for page in pdf_document]
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            texts = f.read().split('\f')
+    return [{'page_number': i, 'content': text} for i, text in enumerate(texts, start=1)]
+
+def run_mode(pages, client, mode):
+    counting_client = CountingClient(client)
+    start = time.time()
+    with contextlib.redirect_stdout(io.StringIO()):  # The agent is very verbose
+        result = process_document_summary(pages, counting_client, mode=mode)
+    latency = time.time() - start
+    if 'error' in result:
+        raise RuntimeError(result['error'])
+    return {
+        'latency_s': round(latency, 2),
+        'requests': counting_client.chat.requests,
+        'input_chars': counting_client.chat.input_chars,
+        'input_tokens_est': counting_client.chat.input_chars // 4,
+        'extractions': result['extractions']
+    }
+
+def compare(reference, candidate):
+    """Field recall and value agreement of `candidate` against `reference` extractions"""
+    def normalize(value):
+        return ' '.join(str(value).lower().split())
+
+    reference_fields = {(e['category'], e['field']) for e in reference}
+    candidate_fields = {(e['category'], e['field']) for e in candidate}
+    reference_values = {(e['category'], e['field'], normalize(e['value'])) for e in reference}
+    candidate_values = {(e['category'], e['field'], normalize(e['value'])) for e in candidate}
+    return {
+        'field_recall': round(len(reference_fields & candidate_fields) / len(reference_fields), 3) if reference_fields else None,
+        'value_recall': round(len(reference_values & candidate_values) / len(reference_values), 3) if reference_values else None,
+        'extra_fields': len(candidate_fields - reference_fields)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('documents', nargs='+', help='PDF or text files')
+    parser.add_argument('--json', help='Write the full results to this file')
+    args = parser.parse_args()
+
+    load_dotenv()
+    client = Mistral(api_key=os.getenv('MISTRAL_API_KEY'))
+
+    results = []
+    for path in args.documents:
+        pages = load_pages(path)
+        runs = {mode: run_mode(pages, client, mode) for mode in SUMMARY_MODES}
+        comparison = compare(runs['per_category']['extractions'], runs['packed']['extractions'])
+        results.append({'document': path, 'pages': len(pages), 'runs': runs, 'packed_vs_per_category': comparison})
+
+        print(f"\n{path} ({len(pages)} pages)")
+        print(f"{'mode':<14}{'latency (s)':>12}{'requests':>10}{'input tokens':>14}{'fields':>8}")
+        for mode, run in runs.items():
+            print(f"{mode:<14}{run['latency_s']:>12}{run['requests']:>10}{run['input_tokens_est']:>14}{len(run['extractions']):>8}")
+        print(f"packed field recall: {comparison['field_recall']}, value recall: {comparison['value_recall']}, "
+              f"extra fields: {comparison['extra_fields']}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""End-to-end throughput benchmark on the mock Mistral backend.
+
+Drives the Flask app (test client) with synthetic PDFs: uploads each one to
+/api/process-pdf, waits for its processing job, then runs /api/analyze-prescription
+and /api/analyze-summary. Reports pages/sec, p50/p95 latency of each phase, API calls
+per kind and peak RSS of the app and of its render worker processes. No API key is
+needed; the database, uploads, image store and caches live in a temporary directory.
+
+Usage:
+    python benchmarks/throughput.py [--pages 1 10 100 500] [--runs 3] [--native-text]
+                                    [--latency 0.5] [--rate-limit-rate 0.02]
+                                    [--json results.json] [--baseline baseline.json --tolerance 0.2]
+
+With --baseline, exits with status 1 if pages/sec of any size dropped by more than
+--tolerance compared to a previous --json output (for CI).
+"""
+import sys
+import io
+import json
+import time
+import argparse
+import resource
+import contextlib
+from bench_environment import throwaway_environment, import_app
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, nargs='+', default=[1, 10, 100], help='Document sizes (pages)')
+    parser.add_argument('--runs', type=int, default=3, help='Documents processed per size')
+    parser.add_argument('--native-text', action='store_true', help='Pages with a text layer (no vision OCR)')
+    parser.add_argument('--latency', type=float, default=0.5, help='Mock API latency (seconds)')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Fraction of mock calls answered with a 429')
+    parser.add_argument('--json', help='Write the results to this file')
+    parser.add_argument('--baseline', help='Previous --json output to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed pages/sec regression (fraction)')
+    parser.add_argument('--verbose', action='store_true', help="Show the app's logs")
+    return parser.parse_args()
+
+def make_pdf(pages, native_text, seed):
+    """Synthetic PDF; every page differs so the OCR cache never hits"""
+    import fitz  # PyMuPDF
+
+    pdf_document = fitz.open()
+    for page_number in range(1, pages + 1):
+        page = pdf_document.new_page()
+        label = f"Document {seed} - page {page_number}"
+        if native_text:
+            page.insert_text((72, 72), f"{label}\n" + "Compte rendu de consultation, traitement en cours. " * 3)
+        else:
+            # Drawn content only: no text layer, so the page goes through vision OCR
+            page.draw_rect(fitz.Rect(50, 50, 50 + page_number % 400, 200), color=(0, 0, 0), fill=(0.8, 0.8, 0.8))
+            page.insert_image(fitz.Rect(72, 300, 300, 340), stream=_label_image(label))
+    data = pdf_document.tobytes()
+    pdf_document.close()
+    return data
+
+def _label_image(label):
+    from PIL import Image, ImageDraw
+
+    image = Image.new('RGB', (400, 40), 'white')
+    ImageDraw.Draw(image).text((5, 10), label, fill='black')
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(int(round(fraction * (len(values) - 1))), len(values) - 1)
+    return round(values[index], 3)
+
+def peak_rss_mb():
+    """Peak resident set size of this process and its children (Linux reports KB)"""
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def render_workers_peak_rss_mb():
+    """Sum of the peak RSS of the live render worker processes (Linux only)"""
+    from modules import document_processor
+
+    pool = document_processor._render_pool
+    total_kb = 0
+    for process in (getattr(pool, '_processes', None) or {}).values():
+        try:
+            with open(f"/proc/{process.pid}/status") as f:
+                total_kb += next(int(line.split()[1]) for line in f if line.startswith('VmHWM:'))
+        except (OSError, StopIteration, ValueError):
+            pass
+    return round(total_kb / 1024, 1)
+
+class Harness:
+    def __init__(self, verbose):
+        self.quiet = (lambda: contextlib.nullcontext()) if verbose else (lambda: contextlib.redirect_stdout(io.StringIO()))
+        application, models = import_app(verbose)
+        self.app = application.app
+        self.chat = application.mistral_client.chat
+        with self.app.app_context():
+            models.db.create_all()
+            user = models.User(email='bench@example.com', role=models.ROLES['PATIENT'])
+            user.set_password('bench')
+            models.db.session.add(user)
+            models.db.session.commit()
+        with self.quiet():
+            self.client = self.app.test_client()
+            self.client.post('/login', data={'email': 'bench@example.com', 'password': 'bench'})
+
+    def process(self, pdf_bytes, name):
+        """Upload a PDF and wait for its job; return (seconds, job)"""
+        start = time.time()
+        with self.quiet():
+            response = self.client.post('/api/process-pdf', data={'file': (io.BytesIO(pdf_bytes), name)},
+                                        content_type='multipart/form-data')
+            if response.status_code != 202:
+                raise RuntimeError(f"Upload failed: {response.get_json()}")
+            job_id = response.get_json()['job_id']
+            while True:
+                job = self.client.get(f'/api/jobs/{job_id}').get_json()
+                if job['status'] in ('completed', 'failed'):
+                    break
+                time.sleep(0.05)
+        if job['status'] != 'completed':
+            raise RuntimeError(f"Job {job_id} failed: {job.get('error')}")
+        return time.time() - start, job
+
+    def timed_post(self, url):
+        start = time.time()
+        with self.quiet():
+            response = self.client.post(url)
+        if response.status_code != 200:
+            raise RuntimeError(f"POST {url} failed: {response.get_json()}")
+        return time.time() - start
+
+    def run_size(self, pages, runs, native_text):
+        self.chat.reset_stats()
+        timings = {'process': [], 'prescription': [], 'summary': []}
+        total_pages = 0
+        start = time.time()
+        for run in range(runs):
+            elapsed, job = self.process(make_pdf(pages, native_text, seed=f"{pages}-{run}"), f"bench-{pages}-{run}.pdf")
+            timings['process'].append(elapsed)
+            total_pages += job['pages_done']
+            document_id = job['document_id']
+            timings['prescription'].append(self.timed_post(f'/api/analyze-prescription/{document_id}'))
+            timings['summary'].append(self.timed_post(f'/api/analyze-summary/{document_id}'))
+        wall = time.time() - start
+
+        return {
+            'pages': pages,
+            'runs': runs,
+            'pages_per_sec': round(total_pages / sum(timings['process']), 2),
+            'end_to_end_pages_per_sec': round(total_pages / wall, 2),
+            'latency_s': {
+                phase: {'p50': percentile(values, 0.5), 'p95': percentile(values, 0.95)}
+                for phase, values in timings.items()
+            },
+            'api_calls': dict(self.chat.calls),
+            'api_rate_limited': self.chat.rate_limited,
+            'api_latency_s': {'p50': percentile(self.chat.latencies, 0.5), 'p95': percentile(self.chat.latencies, 0.95)},
+            'peak_rss_mb': peak_rss_mb(),
+            'render_workers_peak_rss_mb': render_workers_peak_rss_mb()
+        }
+
+def check_baseline(results, baseline_path, tolerance):
+    """Return the sizes whose pages/sec regressed by more than `tolerance`"""
+    with open(baseline_path, 'r') as f:
+        baseline = {result['pages']: result for result in json.load(f)['results']}
+    regressions = []
+    for result in results:
+        reference = baseline.get(result['pages'])
+        if reference and result['pages_per_sec'] < reference['pages_per_sec'] * (1 - tolerance):
+            regressions.append((result['pages'], reference['pages_per_sec'], result['pages_per_sec']))
+    return regressions
+
+def main():
+    args = parse_args()
+    with throwaway_environment('bench', MOCK_MISTRAL_LATENCY=args.latency, MOCK_MISTRAL_RATE_LIMIT_RATE=args.rate_limit_rate,
+                               MOCK_MISTRAL_RETRY_AFTER=0.5):
+        run(args)
+
+def run(args):
+    harness = Harness(args.verbose)
+
+    results = []
+    print(f"{'pages':>6}{'pages/s':>10}{'process p50/p95 (s)':>22}{'prescr. p50 (s)':>17}{'summary p50 (s)':>17}"
+          f"{'API calls':>11}{'429s':>6}{'peak RSS (MB)':>15}{'workers RSS (MB)':>18}")
+    for pages in args.pages:
+        result = harness.run_size(pages, args.runs, args.native_text)
+        results.append(result)
+        latency = result['latency_s']
+        print(f"{pages:>6}{result['pages_per_sec']:>10}"
+              f"{str(latency['process']['p50']) + ' / ' + str(latency['process']['p95']):>22}"
+              f"{latency['prescription']['p50']:>17}{latency['summary']['p50']:>17}"
+              f"{sum(result['api_calls'].values()):>11}{result['api_rate_limited']:>6}{result['peak_rss_mb']:>15}"
+              f"{result['render_workers_peak_rss_mb']:>18}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'settings': vars(args), 'results': results}, f, indent=2)
+
+    if args.baseline:
+        regressions = check_baseline(results, args.baseline, args.tolerance)
+        for pages, before, after in regressions:
+            print(f"Regression on {pages} pages: {before} -> {after} pages/sec")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+from flask import Flask
+from models import db, Page
+from modules.image_store import store_image, image_path
+from modules.page_previews import encode_previews, PREVIEW_SIZES, PREVIEW_FORMAT
+from PIL import Image
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import undefer
+import base64
+import os
+import sys
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Create Flask app
+app = Flask(__name__)
+
+# Configure database
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("DATABASE_URL")
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# Initialize SQLAlchemy with app
+db.init_app(app)
+
+BATCH_SIZE = 100
+
+def add_column_if_missing(table, column, definition):
+    """Add a column to an existing table (no-op if it already exists)"""
+    columns = {c['name'] for c in inspect(db.engine).get_columns(table)}
+    if column in columns:
+        return
+    print(f"Adding column {table}.{column}...")
+    with db.engine.begin() as conn:
+        conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {column} {definition}'))
+
+# Colonnes ajoutées à page depuis sa création. Elles sont toutes ajoutées en premier :
+# les migrations suivantes chargent des Page par l'ORM, qui sélectionne toutes les colonnes
+PAGE_COLUMNS = [
+    ('image_ref', 'VARCHAR(80)'),
+    ('content_source', 'VARCHAR(20)'),
+] + [(f'{size}_ref', 'VARCHAR(80)') for size in PREVIEW_SIZES]
+
+def add_page_columns():
+    """Add the page columns introduced since the table was created"""
+    for column, definition in PAGE_COLUMNS:
+        add_column_if_missing('page', column, definition)
+
+def migrate_page_images():
+    """Move base64 page images from page.image_data to the image store"""
+    migrated = 0
+    last_id = 0
+    while True:
+        pages = (Page.query
+                 .options(undefer(Page.image_data))
+                 .filter(Page.id > last_id, Page.image_ref.is_(None), Page.image_data.isnot(None))
+                 .order_by(Page.id)
+                 .limit(BATCH_SIZE)
+                 .all())
+        if not pages:
+            break
+
+        for page in pages:
+            last_id = page.id
+            try:
+                image_data = page.image_data
+                if ',' in image_data:
+                    image_data = image_data.split(',', 1)[1]
+                page.image_ref = store_image(base64.b64decode(image_data), 'png')
+                page.image_data = None
+                migrated += 1
+            except Exception as e:
+                print(f"Error migrating image of page {page.id}: {str(e)}")
+
+        db.session.commit()
+        db.session.expunge_all()
+        print(f"Migrated {migrated} page images")
+
+    print(f"Page images migration completed ({migrated} pages)")
+
+def make_page_previews():
+    """Make the screen and thumbnail previews of page images stored before they existed"""
+    generated = 0
+    last_id = 0
+    while True:
+        pages = (Page.query
+                 .filter(Page.id > last_id, Page.image_ref.isnot(None), Page.thumb_ref.is_(None))
+                 .order_by(Page.id)
+                 .limit(BATCH_SIZE)
+                 .all())
+        if not pages:
+            break
+
+        previews = {}  # Pages sharing an image share its previews
+        for page in pages:
+            last_id = page.id
+            try:
+                if page.image_ref not in previews:
+                    with Image.open(image_path(page.image_ref)) as image:
+                        previews[page.image_ref] = {
+                            size: store_image(preview, PREVIEW_FORMAT)
+                            for size, preview in encode_previews(image).items()
+                        }
+                for size, ref in previews[page.image_ref].items():
+                    setattr(page, f'{size}_ref', ref)
+                generated += 1
+            except Exception as e:
+                print(f"Error making previews of page {page.id}: {str(e)}")
+
+        db.session.commit()
+        db.session.expunge_all()
+        print(f"Made previews of {generated} pages")
+
+    print(f"Page previews completed ({generated} pages)")
+
+def add_extraction_source_pages():
+    """Track the page window each medication and summary value was extracted from"""
+    for table in ('medication', 'summary_extraction'):
+        add_column_if_missing(table, 'source_page_start', 'INTEGER')
+        add_column_if_missing(table, 'source_page_end', 'INTEGER')
+
+def add_job_batch_id():
+    """Group the processing jobs of a batch upload"""
+    add_column_if_missing('processing_job', 'batch_id', 'VARCHAR(32)')
+    with db.engine.begin() as conn:
+        conn.execute(text('CREATE INDEX IF NOT EXISTS ix_processing_job_batch_id ON processing_job (batch_id)'))
+
+# Index des clés étrangères et colonnes filtrées (mêmes noms que dans models.py)
+INDEXES = [
+    ('ix_user_role', 'user', ['role']),
+    ('ix_document_user_id_upload_date', 'document', ['user_id', 'upload_date']),
+    ('ix_prescription_analysis_document_id', 'prescription_analysis', ['document_id']),
+    ('ix_medication_prescription_id', 'medication', ['prescription_id']),
+    ('ix_document_summary_document_id', 'document_summary', ['document_id']),
+    ('ix_summary_extraction_summary_id', 'summary_extraction', ['summary_id']),
+    ('ix_patient_doctor_id', 'patient', ['doctor_id']),
+    ('ix_patient_user_id', 'patient', ['user_id']),
+    ('ix_processing_job_status', 'processing_job', ['status']),
+]
+
+def add_indexes():
+    """Index the foreign keys and filter columns, and make (document_id, page_number) unique on pages"""
+    with db.engine.begin() as conn:
+        for name, table, columns in INDEXES:
+            print(f"Creating index {name}...")
+            conn.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON "{table}" ({", ".join(columns)})'))
+
+        duplicates = conn.execute(text(
+            'SELECT document_id, page_number, COUNT(*) FROM page '
+            'GROUP BY document_id, page_number HAVING COUNT(*) > 1'
+        )).fetchall()
+        if duplicates:
+            # Pas de suppression automatique : les doublons peuvent porter des corrections différentes
+            listed = ', '.join(f"document {document_id} page {page_number}" for document_id, page_number, _ in duplicates[:20])
+            raise RuntimeError(f"{len(duplicates)} duplicated pages must be removed before adding the unique index: {listed}")
+        print("Creating index uq_page_document_id_page_number...")
+        conn.execute(text('CREATE UNIQUE INDEX IF NOT EXISTS uq_page_document_id_page_number ON page (document_id, page_number)'))
+
+# Clés étrangères supprimées en cascade avec le document (table, colonne, table référencée)
+CASCADE_FOREIGN_KEYS = [
+    ('page', 'document_id', 'document'),
+    ('prescription_analysis', 'document_id', 'document'),
+    ('medication', 'prescription_id', 'prescription_analysis'),
+    ('document_summary', 'document_id', 'document'),
+    ('summary_extraction', 'summary_id', 'document_summary'),
+]
+
+def add_cascade_foreign_keys():
+    """Recreate the foreign keys of a document's rows with ON DELETE CASCADE"""
+    if db.engine.dialect.name == 'sqlite':
+        # Deletes don't depend on it (see delete_documents in modules/persistence.py)
+        print("SQLite can't alter foreign keys, skipped")
+        return
+
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table, column, referred_table in CASCADE_FOREIGN_KEYS:
+            for fk in inspector.get_foreign_keys(table):
+                if fk['constrained_columns'] != [column] or fk['referred_table'] != referred_table:
+                    continue
+                if (fk.get('options') or {}).get('ondelete', '').upper() == 'CASCADE':
+                    continue
+                print(f"Adding ON DELETE CASCADE to {table}.{column}...")
+                conn.execute(text(f'ALTER TABLE "{table}" DROP CONSTRAINT "{fk["name"]}"'))
+                conn.execute(text(
+                    f'ALTER TABLE "{table}" ADD CONSTRAINT "{fk["name"]}" FOREIGN KEY ({column}) '
+                    f'REFERENCES "{referred_table}" (id) ON DELETE CASCADE'
+                ))
+
+# Migrations à appliquer dans l'ordre ; chacune doit pouvoir être relancée sans effet
+MIGRATIONS = [
+    add_page_columns,
+    migrate_page_images,
+    add_extraction_source_pages,
+    add_job_batch_id,
+    add_indexes,
+    add_cascade_foreign_keys,
+    make_page_previews,
+]
+
+def migrate_db():
+    with app.app_context():
+        print("Creating missing tables...")
+        db.create_all()
+
+        for migration in MIGRATIONS:
+            print(f"Running {migration.__name__}...")
+            migration()
+
+        print("Database migration completed")
+
+if __name__ == "__main__":
+    try:
+        migrate_db()
+        print("Database migration successful")
+    except Exception as e:
+        print(f"Error during database migration: {str(e)}")
+        sys.exit(1)
@@ -10,7 +10,7 @@ class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(256), nullable=False)
-    role = db.Column(db.String(50), nullable=False)
+    role = db.Column(db.String(50), nullable=False, index=True)
     # Champs supplémentaires selon le rôle
     nom = db.Column(db.String(100))
     prenom = db.Column(db.String(100))
@@ -44,6 +44,9 @@ ROLES = {
 }
 
 class Document(db.Model):
+    # Liste des documents d'un utilisateur, du plus récent au plus ancien
+    __table_args__ = (db.Index('ix_document_user_id_upload_date', 'user_id', 'upload_date'),)
+
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
     upload_date = db.Column(db.DateTime, default=datetime.utcnow)
@@ -54,26 +57,82 @@ class Document(db.Model):
     # Relations
     user = db.relationship('User', foreign_keys=[user_id], backref='documents')
     
-    pages = db.relationship('Page', backref='document', cascade='all, delete-orphan')
+    # passive_deletes : les pages (et leurs images) ne sont pas chargées pour être supprimées,
+    # voir delete_documents dans modules/persistence.py
+    pages = db.relationship('Page', backref='document', cascade='all, delete-orphan', order_by='Page.page_number', passive_deletes=True)
     prescription = db.relationship('PrescriptionAnalysis', backref='document', uselist=False, cascade='all, delete-orphan')
     summary = db.relationship('DocumentSummary', backref='document', uselist=False, cascade='all, delete-orphan')
 
 class Page(db.Model):
+    # Une seule page par numéro : sert aussi aux accès page par page (image, correction)
+    __table_args__ = (db.Index('uq_page_document_id_page_number', 'document_id', 'page_number', unique=True),)
+
     id = db.Column(db.Integer, primary_key=True)
     page_number = db.Column(db.Integer, nullable=False)
-    content = db.Column(db.Text, nullable=False)
-    image_data = db.Column(db.Text)  # Store base64 encoded image
-    document_id = db.Column(db.Integer, db.ForeignKey('document.id'), nullable=False)
+    # Colonnes lourdes non chargées avec la page : les requêtes qui en ont besoin les demandent
+    # explicitement (undefer, ou une requête sur les colonnes), sinon l'accès lève une erreur
+    content = db.deferred(db.Column(db.Text, nullable=False), raiseload=True)
+    image_data = db.deferred(db.Column(db.Text), raiseload=True)  # Ancien stockage base64, remplacé par image_ref (voir migrate_db.py)
+    image_ref = db.Column(db.String(80))  # Référence de l'image dans le stockage (modules/image_store.py)
+    # Aperçus réduits de l'image (modules/page_previews.py), servis par ?size=screen|thumb
+    screen_ref = db.Column(db.String(80))
+    thumb_ref = db.Column(db.String(80))
+    content_source = db.Column(db.String(20))  # 'native' (couche texte du PDF) ou 'vision' (OCR Pixtral)
+    document_id = db.Column(db.Integer, db.ForeignKey('document.id', ondelete='CASCADE'), nullable=False)
+
+class ImagePurge(db.Model):
+    # Images des documents supprimés, retirées du stockage après le délai de grâce si plus
+    # aucune page ne les utilise (modules/image_store.py). Une ligne par suppression : une
+    # même référence peut apparaître plusieurs fois
+    id = db.Column(db.Integer, primary_key=True)
+    ref = db.Column(db.String(80), nullable=False, index=True)
+    queued_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+class ProcessingJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(255), nullable=False)
+    file_path = db.Column(db.String(500), nullable=False)  # PDF en attente de traitement
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # queued, running, completed, failed
+    # Propriétaire du document (patient) et auteur de l'upload
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    requested_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    requested_by = db.relationship('User', foreign_keys=[requested_by_id])  # Sert au partage équitable de l'OCR
+    document_id = db.Column(db.Integer)  # Pas de FK : le job survit à la suppression du document
+    batch_id = db.Column(db.String(32), index=True)  # Lot d'import (POST /api/process-pdf/batch)
+    total_pages = db.Column(db.Integer)  # Connu dès l'upload pour les envois unitaires (choix de la file prioritaire)
+    pages_done = db.Column(db.Integer, nullable=False, default=0)
+    pages_failed = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+class ReanalysisJob(db.Model):
+    # Mise à jour des analyses d'un document après la correction d'une page (PUT
+    # /api/documents/<id>/pages/<n>), exécutée en arrière-plan (modules/reanalysis_queue.py)
+    id = db.Column(db.Integer, primary_key=True)
+    document_id = db.Column(db.Integer, nullable=False, index=True)  # Pas de FK : échoue si le document est supprimé
+    page_number = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # queued, running, completed, failed
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    requested_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    result = db.Column(db.Text)  # JSON : lignes inchangées/modifiées/ajoutées/supprimées par analyse
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
 
 class PrescriptionAnalysis(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    document_id = db.Column(db.Integer, db.ForeignKey('document.id'))
+    document_id = db.Column(db.Integer, db.ForeignKey('document.id', ondelete='CASCADE'), index=True)
     analysis_date = db.Column(db.DateTime, default=datetime.utcnow)
     medications = db.relationship('Medication', backref='prescription', cascade='all, delete-orphan')
 
 class Medication(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    prescription_id = db.Column(db.Integer, db.ForeignKey('prescription_analysis.id'), nullable=False)
+    prescription_id = db.Column(db.Integer, db.ForeignKey('prescription_analysis.id', ondelete='CASCADE'), nullable=False, index=True)
     name = db.Column(db.String(255), nullable=False)
     dosage = db.Column(db.String(255))
     frequency = db.Column(db.String(255))
@@ -83,27 +142,33 @@ class Medication(db.Model):
     end_date = db.Column(db.Date)
     instructions = db.Column(db.Text)
     page_number = db.Column(db.Integer)
+    # Fenêtre de pages dont le médicament a été extrait (ré-extraite si l'une de ces pages est modifiée)
+    source_page_start = db.Column(db.Integer)
+    source_page_end = db.Column(db.Integer)
 
 class DocumentSummary(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    document_id = db.Column(db.Integer, db.ForeignKey('document.id'), nullable=False)
+    document_id = db.Column(db.Integer, db.ForeignKey('document.id', ondelete='CASCADE'), nullable=False, index=True)
     analysis_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     extractions = db.relationship('SummaryExtraction', backref='summary', lazy=True, cascade='all, delete-orphan')
 
 class SummaryExtraction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    summary_id = db.Column(db.Integer, db.ForeignKey('document_summary.id'), nullable=False)
+    summary_id = db.Column(db.Integer, db.ForeignKey('document_summary.id', ondelete='CASCADE'), nullable=False, index=True)
     category = db.Column(db.String(255), nullable=False)
     field = db.Column(db.String(255), nullable=False)
     value = db.Column(db.Text, nullable=False)
     page_number = db.Column(db.Integer)
     associated_date = db.Column(db.Date)
+    # Fenêtre de pages dont la valeur a été extraite (ré-extraite si l'une de ces pages est modifiée)
+    source_page_start = db.Column(db.Integer)
+    source_page_end = db.Column(db.Integer)
     extraction_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
 class Patient(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    doctor_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     date_creation = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relations
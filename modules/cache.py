@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+from modules.mistral_client import MISTRAL_BACKEND
+
+# Persistent caches live on disk so they survive restarts and are shared by all workers
+CACHE_DIR = os.getenv(
+    'CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache')
+)
+# The canned replies of the mock backend must never be served to the real one
+if MISTRAL_BACKEND != 'mistral':
+    CACHE_DIR = os.path.join(CACHE_DIR, MISTRAL_BACKEND)
+EVICTION_CHECK_INTERVAL = 50  # Check the cache size every N writes
+
+def make_key(*parts):
+    """Build a cache key from JSON-serializable parts"""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class DiskCache:
+    """Size-bounded LRU cache of JSON values stored as one file per entry.
+
+    Reads refresh the file modification time, which is used as the LRU clock when
+    evicting. Entries older than `ttl` seconds (if set) are treated as misses.
+    Hit/miss counters are kept per process.
+    """
+
+    def __init__(self, namespace, max_entries=10000, max_bytes=None, ttl=None):
+        self.namespace = namespace
+        self.directory = os.path.join(CACHE_DIR, namespace)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def get(self, key):
+        """Return the cached value for `key`, or None"""
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self._count('misses')
+            return None
+
+        if self.ttl is not None and time.time() - entry.get('created_at', 0) > self.ttl:
+            self._remove(path)
+            self._count('misses')
+            return None
+
+        try:
+            os.utime(path)  # Mark as recently used
+        except OSError:
+            pass
+        self._count('hits')
+        return entry['value']
+
+    def set(self, key, value):
+        """Store a JSON-serializable value"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'created_at': time.time(), 'value': value}, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+        with self._lock:
+            self._writes += 1
+            check = self._writes % EVICTION_CHECK_INTERVAL == 0
+        if check:
+            self.evict()
+
+    def _remove(self, path):
+        try:
+            os.unlink(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _entries(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        """Remove least recently used entries until the cache is within its bounds"""
+        entries = self._entries()
+        count = len(entries)
+        size = sum(entry[1] for entry in entries)
+        if count <= self.max_entries and (self.max_bytes is None or size <= self.max_bytes):
+            return
+
+        # Evict down to 90% of the bounds so we don't evict on every write
+        target_count = int(self.max_entries * 0.9)
+        target_size = int(self.max_bytes * 0.9) if self.max_bytes is not None else None
+        evicted = 0
+        for mtime, entry_size, path in sorted(entries):
+            if count <= target_count and (target_size is None or size <= target_size):
+                break
+            if self._remove(path):
+                evicted += 1
+            count -= 1
+            size -= entry_size
+        self._count('evictions', evicted)
+
+    def clear(self):
+        """Remove every entry"""
+        for _, _, path in self._entries():
+            self._remove(path)
+
+    def stats(self):
+        """Return hit/miss counters and current size"""
+        entries = self._entries()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+            'evictions': self.evictions,
+            'entries': len(entries),
+            'size_bytes': sum(entry[1] for entry in entries),
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes
+        }
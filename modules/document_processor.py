@@ -2,232 +2,366 @@ from flask import jsonify
 import tempfile
 import os
 import fitz  # PyMuPDF
-from PIL import Image
 import base64
-import io
 import time
-from threading import Semaphore
+import hashlib
+import threading
+import multiprocessing
 from mistralai import Mistral
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import random
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from flask_login import current_user
+from modules.image_store import store_image, image_mimetype
+from modules.page_previews import PREVIEW_SIZES, PREVIEW_FORMAT
+from modules.page_render import (
+    VISION_IMAGE, ARCHIVE_IMAGE, iter_page_images, render_pages_in_worker
+)
+from modules.cache import DiskCache, make_key
+from modules.rate_limiter import mistral_limiter
+from modules.ocr_scheduler import ocr_scheduler, NORMAL_LANE
+from modules.persistence import BatchWriter, PERSIST_BATCH_SECONDS, delete_documents
 
-# Rate limiting configuration
-MAX_CONCURRENT_CALLS = 3  # Reduced from 5 to 3
-CALL_DELAY = 1.0  # Increased from 0.5 to 1.0
-MAX_RETRIES = 5
-BASE_DELAY = 2
-JITTER = 0.1
-semaphore = Semaphore(MAX_CONCURRENT_CALLS)
-
-def exponential_backoff(retry_count):
-    """Calculate delay with exponential backoff and jitter"""
-    delay = min(BASE_DELAY * (2 ** retry_count), 60)  # Cap at 60 seconds
-    jitter_amount = delay * JITTER
-    return delay + random.uniform(-jitter_amount, jitter_amount)
-
-def pdf_to_images(pdf_path):
-    """Convert PDF pages to images using PyMuPDF"""
-    pdf_document = fitz.open(pdf_path)
-    images = []
+# Pages queued for OCR per document; the OCR scheduler shares its threads between documents
+# and the shared limiter decides how many calls actually run
+MAX_CONCURRENT_CALLS = mistral_limiter.max_concurrency
+
+# Rendering and encoding are CPU-bound: they run in a process pool shared by all jobs,
+# RENDER_BATCH_PAGES pages per task (RENDER_WORKERS=0 renders in the calling thread).
+# Each worker costs about 55 MB idle and up to ~135 MB while encoding a batch of scanned
+# 2x-zoom pages, on top of the app, so the default is a single worker whatever the host's
+# core count (os.cpu_count() sees the host, not the container's CPU and memory quota).
+RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', 1))
+RENDER_BATCH_PAGES = int(os.getenv('RENDER_BATCH_PAGES', 4))
+
+# OCR model and result cache (bump OCR_PROMPT_VERSION when the prompt changes)
+OCR_MODEL = "pixtral-large-latest"
+OCR_PROMPT_VERSION = "1"
+ocr_cache = DiskCache(
+    'ocr',
+    max_entries=int(os.getenv('OCR_CACHE_MAX_ENTRIES', 20000)),
+    max_bytes=int(os.getenv('OCR_CACHE_MAX_BYTES', 200 * 1024 * 1024))
+)
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+def get_render_pool():
+    """Return the shared render process pool (created on first use), or None if disabled"""
+    global _render_pool
+    if RENDER_WORKERS <= 0:
+        return None
+    with _render_pool_lock:
+        if _render_pool is None:
+            # Workers are not forked from the (multi-threaded) app process. Their task,
+            # modules.page_render.render_pages_in_worker, only imports the rendering code.
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _render_pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=multiprocessing.get_context(method))
+            print(f"[Document] Started {RENDER_WORKERS} render worker processes ({method})")
+        return _render_pool
+
+def _discard_render_pool(pool):
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is pool:
+            _render_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def render_pages(pdf_path, pdf_document, page_numbers):
+    """Yield iter_page_images results in page order, rendered by the process pool.
+
+    Batches are prefetched (one per render worker) while earlier pages are consumed, so
+    rendering overlaps with OCR. Falls back to rendering in this thread, using the
+    already open `pdf_document`, if the pool is disabled or fails.
+    """
+    pool = get_render_pool()
+    if pool is None:
+        yield from iter_page_images(pdf_document, page_numbers)
+        return
+    
+    batches = deque(
+        page_numbers[i:i + RENDER_BATCH_PAGES]
+        for i in range(0, len(page_numbers), RENDER_BATCH_PAGES)
+    )
+    pending = deque()
+    
+    def prefetch():
+        while batches and len(pending) < RENDER_WORKERS:
+            batch = batches.popleft()
+            pending.append((pool.submit(render_pages_in_worker, pdf_path, batch), batch))
+    
+    try:
+        prefetch()
+    except Exception as e:  # Pool broken or shut down
+        print(f"[Document] Render pool unavailable, rendering in-process: {str(e)}")
+        _discard_render_pool(pool)
+        yield from iter_page_images(pdf_document, page_numbers)
+        return
     
-    for page_num in range(len(pdf_document)):
+    while pending:
+        future, batch = pending.popleft()
         try:
-            page = pdf_document[page_num]
-            zoom = 2
-            mat = fitz.Matrix(zoom, zoom)
-            pix = page.get_pixmap(matrix=mat, alpha=False)
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            
-            if img.size[0] > 0 and img.size[1] > 0:
-                images.append(img)
-            else:
-                print(f"Warning: Invalid image size for page {page_num + 1}")
-                continue
-                
+            results = future.result()
         except Exception as e:
-            print(f"Error converting page {page_num + 1}: {str(e)}")
-            continue
+            print(f"[Document] Render worker failed on pages {batch[0]}-{batch[-1]}, rendering in-process: {str(e)}")
+            _discard_render_pool(pool)
+            remaining = batch + [page for _, other in pending for page in other] + [page for other in batches for page in other]
+            for other_future, _ in pending:
+                other_future.cancel()
+            yield from iter_page_images(pdf_document, remaining)
+            return
+        prefetch()
+        yield from results
+
+def process_page_image_with_throttle(image_bytes, page_num, mistral_client, image_format=VISION_IMAGE.format):
+    """Process a single encoded page image using Mistral's Pixtral model with rate limiting and retry logic"""
+    # Identical page images (re-uploads, shared letters) are only sent once
+    cache_key = make_key(hashlib.sha256(image_bytes).hexdigest(), OCR_MODEL, OCR_PROMPT_VERSION)
+    cached_content = ocr_cache.get(cache_key)
+    if cached_content is not None:
+        print(f"[Page {page_num}] OCR cache hit")
+        return cached_content
     
-    pdf_document.close()
+    base64_image = base64.b64encode(image_bytes).decode('utf-8')
     
-    if not images:
-        raise ValueError("No valid images could be extracted from the PDF")
+    print(f"[Page {page_num}] Starting processing...")
+    start_time = time.time()
     
-    return images
-
-def encode_image(image):
-    """Encode PIL Image to base64"""
     try:
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        img_byte_arr = io.BytesIO()
-        image.save(img_byte_arr, format='PNG', optimize=True, quality=95)
-        img_byte_arr.seek(0)
-        return base64.b64encode(img_byte_arr.getvalue()).decode('utf-8')
-    except Exception as e:
-        raise ValueError(f"Error encoding image: {str(e)}")
-
-def process_page_image_with_throttle(image, page_num, mistral_client):
-    """Process a single page image using Mistral's Pixtral model with rate limiting and retry logic"""
-    with semaphore:
-        print(f"[Page {page_num}] Starting processing...")
-        start_time = time.time()
-        retry_count = 0
-        
-        while retry_count < MAX_RETRIES:
-            try:
-                base64_image = encode_image(image)
-                if not base64_image:
-                    raise ValueError("Failed to encode image to base64")
-                
-                response = mistral_client.chat.complete(
-                    model="pixtral-large-latest",
-                    messages=[
+        # Concurrency, pacing and 429 retries are handled by the shared limiter
+        response = mistral_limiter.call(
+            mistral_client.chat.complete,
+            model=OCR_MODEL,
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
                         {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "text",
-                                    "text": f"Extract all text from this image of page {page_num}. Return only the extracted text, no additional commentary."
-                                },
-                                {
-                                    "type": "image_url",
-                                    "image_url": {
-                                        "url": f"data:image/png;base64,{base64_image}"
-                                    }
-                                }
-                            ]
+                            "type": "text",
+                            "text": f"Extract all text from this image of page {page_num}. Return only the extracted text, no additional commentary."
+                        },
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:{image_mimetype(image_format)};base64,{base64_image}"
+                            }
                         }
-                    ],
-                    temperature=0.1,
-                    top_p=0.1
-                )
-                
-                time.sleep(CALL_DELAY)
-                processing_time = time.time() - start_time
-                print(f"[Page {page_num}] Processing completed in {processing_time:.2f} seconds")
-                return response.choices[0].message.content
-                
-            except Exception as e:
-                retry_count += 1
-                if "429" in str(e) and retry_count < MAX_RETRIES:
-                    delay = exponential_backoff(retry_count)
-                    print(f"[Page {page_num}] Rate limit hit, retrying in {delay:.2f} seconds (attempt {retry_count}/{MAX_RETRIES})")
-                    time.sleep(delay)
-                    continue
-                else:
-                    processing_time = time.time() - start_time
-                    error_msg = f"[Page {page_num}] Error after {processing_time:.2f} seconds: {str(e)}"
-                    if retry_count >= MAX_RETRIES:
-                        error_msg = f"{error_msg} (Max retries reached)"
-                    print(error_msg)
-                    return f"Error processing page {page_num}: {str(e)}"
+                    ]
+                }
+            ],
+            temperature=0.1,
+            top_p=0.1
+        )
+        
+        processing_time = time.time() - start_time
+        print(f"[Page {page_num}] Processing completed in {processing_time:.2f} seconds")
+        content = response.choices[0].message.content
+        if content:
+            ocr_cache.set(cache_key, content)
+        return content
+        
+    except Exception as e:
+        processing_time = time.time() - start_time
+        print(f"[Page {page_num}] Error after {processing_time:.2f} seconds: {str(e)}")
+        raise
 
 def process_pdf_document(file, db, Document, Page, mistral_client, user_id):
-    """Process a PDF document and store results in the database"""
-    temp_file = None
-    start_time = time.time()
-    print(f"\n[Document] Starting processing of '{file.filename}'...")
+    """Process an uploaded PDF synchronously and store results in the database"""
+    temp_file_path = None
     
     try:
         # Create a temporary file to store the PDF
         with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
             file.save(temp_file.name)
             temp_file_path = temp_file.name
-            
-            # Convert PDF to images
-            print("[Document] Converting PDF to images...")
-            images = pdf_to_images(temp_file_path)
-            
-            if not images:
-                raise ValueError("No valid pages could be extracted from the PDF")
-            
-            print(f"[Document] Successfully extracted {len(images)} pages from PDF")
-            
+        
+        return process_pdf_file(temp_file_path, file.filename, db, Document, Page, mistral_client, user_id)
+        
+    finally:
+        # Clean up temporary file
+        if temp_file_path and os.path.exists(temp_file_path):
+            try:
+                os.unlink(temp_file_path)
+                print("[Document] Cleaned up temporary files")
+            except Exception as e:
+                print(f"[Document] Error cleaning up temporary file: {str(e)}")
+
+def process_pdf_file(pdf_path, filename, db, Document, Page, mistral_client, user_id,
+                     document_id=None, on_document_created=None, on_pages_processed=None,
+                     on_heartbeat=None, scheduler_path=None, lane=NORMAL_LANE):
+    """Process a PDF file from disk and store its pages in the database as they are OCRed.
+
+    Completed pages are written in small batches (see modules/persistence.py). When
+    `document_id` is given, pages already stored for that document are skipped, which lets
+    an interrupted job resume where it stopped. `on_document_created(document, total_pages)` and
+    `on_pages_processed(page_numbers, success)` are called from the calling thread to report
+    progress, the latter once per written batch and once per failed page. `on_heartbeat()` is
+    called every PERSIST_BATCH_SECONDS or so while OCR results are awaited, even when none
+    comes (e.g. while the rate limiter backs off).
+    OCR calls go through the global ocr_scheduler in `lane`, queued under `scheduler_path`
+    (see fair_share_path) so its threads are shared fairly between tenants and documents.
+    """
+    start_time = time.time()
+    print(f"\n[Document] Starting processing of '{filename}'...")
+    pdf_document = None
+    
+    try:
+        pdf_document = fitz.open(pdf_path)
+        total_pages = len(pdf_document)
+        
+        if total_pages == 0:
+            raise ValueError("No valid pages could be extracted from the PDF")
+        
+        print(f"[Document] PDF has {total_pages} pages")
+        
+        document = Document.query.get(document_id) if document_id else None
+        created = document is None
+        if created:
             # Create new document in database with user_id
             document = Document(
-                filename=file.filename,
-                total_pages=len(images),
+                filename=filename,
+                total_pages=total_pages,
                 user_id=user_id  # Use the provided user_id
             )
             db.session.add(document)
-            db.session.flush()  # Get the document ID without committing
-            
-            results = []
-            successful_pages = 0
-            
-            print(f"[Document] Starting page-by-page processing with concurrency...")
-
-            # Use a thread pool to process each page in parallel
-            with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_CALLS) as executor:
-                # Submit each page processing task to the pool
-                future_to_page = {
-                    executor.submit(
-                        process_page_image_with_throttle,
-                        image,
-                        page_num,
-                        mistral_client
-                    ): page_num
-                    for page_num, image in enumerate(images, start=1)
+            db.session.commit()
+        
+        if on_document_created:
+            on_document_created(document, total_pages)
+        
+        # Pages persisted by a previous, interrupted run
+        done_pages = {
+            page_number for (page_number,) in
+            db.session.query(Page.page_number).filter_by(document_id=document.id)
+        }
+        
+        results = []
+        successful_pages = len(done_pages)
+        native_pages = 0
+        
+        def record_failure(page_num, error_msg):
+            print(f"[Document] {error_msg}")
+            results.append({
+                'page_number': page_num,
+                'content': error_msg
+            })
+            if on_pages_processed:
+                on_pages_processed([page_num], False)
+        
+        def pages_written(saved, failed):
+            nonlocal successful_pages
+            for row in saved:
+                results.append({
+                    'page_number': row['page_number'],
+                    'content': row['content'],
+                    'content_source': row['content_source']
+                })
+            successful_pages += len(saved)
+            if saved:
+                print(f"[Document] Saved {len(saved)} pages ({successful_pages}/{total_pages})")
+                if on_pages_processed:
+                    on_pages_processed([row['page_number'] for row in saved], True)
+            for row, error in failed:
+                record_failure(row['page_number'], f"Error saving page {row['page_number']}: {str(error)}")
+        
+        page_writer = BatchWriter(db, Page, on_flushed=pages_written)
+        
+        def save_page(page_num, content, images, content_source):
+            try:
+                if not content:
+                    raise ValueError("No content extracted from page")
+
+                # Store the page image and its previews now; the page row is written with the next batch
+                row = {
+                    'page_number': page_num,
+                    'content': content,
+                    'image_ref': store_image(images['archive'], ARCHIVE_IMAGE.format),
+                    'content_source': content_source,
+                    'document_id': document.id
                 }
+                for size in PREVIEW_SIZES:
+                    row[f"{size}_ref"] = store_image(images[size], PREVIEW_FORMAT)
+                page_writer.add(row)
+                print(f"[Document] Processed page {page_num}/{total_pages} ({content_source})")
+            
+            except Exception as e:
+                record_failure(page_num, f"Error processing page {page_num}: {str(e)}")
+        
+        print(f"[Document] Starting page-by-page processing with concurrency...")
+        
+        # Pages are rendered ahead of the OCR stage by the render pool, at most one batch
+        # per render worker; encoded pages then wait for one of the MAX_CONCURRENT_CALLS slots
+        page_images = render_pages(
+            pdf_path,
+            pdf_document,
+            [page_num for page_num in range(1, total_pages + 1) if page_num not in done_pages]
+        )
 
-                # As each thread completes, store the results
-                for future in as_completed(future_to_page):
-                    page_num = future_to_page[future]
+        in_flight = {}
+        scheduler_path = scheduler_path or (f"document-{document.id}",)
+        
+        def submit_next_page():
+            nonlocal native_pages
+            for page_num, images, native_text in page_images:
+                if images is None:
+                    record_failure(page_num, f"Error processing page {page_num}: page could not be rendered")
+                    continue
+                if native_text:
+                    # Born-digital page: no OCR call needed
+                    native_pages += 1
+                    save_page(page_num, native_text, images, 'native')
+                    continue
+                future = ocr_scheduler.submit(scheduler_path, process_page_image_with_throttle,
+                                              images['vision'], page_num, mistral_client, lane=lane)
+                in_flight[future] = (page_num, images)
+                return True
+            return False
+        
+        try:
+            while len(in_flight) < MAX_CONCURRENT_CALLS and submit_next_page():
+                pass
+
+            # As each page completes, store it and render the next one. The timeout lets
+            # a partial batch be written while the remaining pages are slow to come.
+            while in_flight:
+                done, _ = wait(in_flight, timeout=PERSIST_BATCH_SECONDS, return_when=FIRST_COMPLETED)
+                page_writer.flush_if_due()
+                if on_heartbeat:
+                    on_heartbeat()
+                for future in done:
+                    page_num, images = in_flight.pop(future)
                     try:
                         processed_content = future.result()
-                        if not processed_content:
-                            raise ValueError("No content extracted from page")
-
-                        # Encode image to base64
-                        base64_image = encode_image(images[page_num - 1])
-
-                        # Save page to database
-                        page = Page(
-                            page_number=page_num,
-                            content=processed_content,
-                            image_data=base64_image,
-                            document=document
-                        )
-                        db.session.add(page)
-                        db.session.commit()
-
-                        results.append({
-                            'page_number': page_num,
-                            'content': processed_content,
-                            'image_data': base64_image
-                        })
-                        
-                        successful_pages += 1
-                        print(f"[Document] Successfully processed and saved page {page_num}/{len(images)}")
-                    
                     except Exception as e:
-                        db.session.rollback()
-                        error_msg = f"Error processing page {page_num}: {str(e)}"
-                        print(f"[Document] {error_msg}")
-                        results.append({
-                            'page_number': page_num,
-                            'content': error_msg,
-                            'image_data': None
-                        })
-
-            if successful_pages == 0:
-                raise ValueError("Failed to process any pages successfully")
-            
-            total_time = time.time() - start_time
-            print(f"\n[Document] Completed processing '{file.filename}'")
-            print(f"[Document] Total processing time: {total_time:.2f} seconds")
-            print(f"[Document] Successfully processed {successful_pages}/{len(images)} pages")
-            
-            return {
-                'status': 'success',
-                'document_id': document.id,
-                'total_pages': len(images),
-                'successful_pages': successful_pages,
-                'results': results
-            }
+                        record_failure(page_num, f"Error processing page {page_num}: {str(e)}")
+                    else:
+                        save_page(page_num, processed_content, images, 'vision')
+                    del images
+                    
+                    submit_next_page()
+        finally:
+            # Don't leave queued OCR calls behind if we stop early, and keep the pages done so far
+            for future in in_flight:
+                future.cancel()
+            page_writer.flush()
+
+        if successful_pages == 0:
+            if created:
+                delete_documents(db, [document.id])
+                db.session.commit()
+            raise ValueError("Failed to process any pages successfully")
+        
+        total_time = time.time() - start_time
+        print(f"\n[Document] Completed processing '{filename}'")
+        print(f"[Document] Total processing time: {total_time:.2f} seconds")
+        print(f"[Document] Successfully processed {successful_pages}/{total_pages} pages ({native_pages} from the PDF text layer)")
+        
+        return {
+            'status': 'success',
+            'document_id': document.id,
+            'total_pages': total_pages,
+            'successful_pages': successful_pages,
+            'results': sorted(results, key=lambda result: result['page_number'])
+        }
 
     except Exception as e:
         total_time = time.time() - start_time
@@ -239,12 +373,7 @@ def process_pdf_document(file, db, Document, Page, mistral_client, user_id):
             'status': 'error',
             'error': error_message
         }
-        
+    
     finally:
-        # Clean up temporary file
-        if temp_file and os.path.exists(temp_file_path):
-            try:
-                os.unlink(temp_file_path)
-                print("[Document] Cleaned up temporary files")
-            except Exception as e:
-                print(f"[Document] Error cleaning up temporary file: {str(e)}") 
\ No newline at end of file
+        if pdf_document is not None:
+            pdf_document.close()
@@ -0,0 +1,37 @@
+from flask import request, jsonify, send_file, current_app
+
+# HTTP caching of read-only responses. Responses are private (they hold patient data):
+# browsers may keep them, shared proxies may not.
+IMAGE_MAX_AGE = 365 * 24 * 3600  # Versioned image URLs never change
+
+def cached_json(payload):
+    """JSON response with a strong ETag of its body.
+
+    The client revalidates on every use and gets an empty 304 when nothing changed.
+    """
+    response = jsonify(payload)
+    response.add_etag()
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+def cached_image(etag, versioned, **send_file_options):
+    """Image response with a strong ETag (e.g. the content hash of the image).
+
+    `versioned` URLs carry the image version (`?v=<hash>`) and are cached as immutable;
+    other URLs are revalidated on every use. A matching If-None-Match is answered with a
+    304 without opening the file. `send_file_options` are passed to send_file.
+    """
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = send_file(etag=False, conditional=False, **send_file_options)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    if versioned:
+        response.cache_control.no_cache = None  # Set by send_file
+        response.cache_control.max_age = IMAGE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
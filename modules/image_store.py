@@ -0,0 +1,161 @@
+import os
+import re
+import time
+import uuid
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import func
+
+# Content-addressed storage of page images on disk.
+# A reference is "<sha256 of the bytes>.<extension>", so identical images are stored once
+# and a stored file never changes.
+IMAGE_STORE_DIR = os.getenv(
+    'IMAGE_STORE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'page_images')
+)
+REF_PATTERN = re.compile(r'^[0-9a-f]{64}\.[a-z0-9]+$')
+MIMETYPES = {
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'webp': 'image/webp'
+}
+
+# Page columns holding image references (full image and previews)
+PAGE_IMAGE_REF_COLUMNS = ('image_ref', 'screen_ref', 'thumb_ref')
+
+def image_path(ref):
+    """Return the file path of a stored image reference"""
+    if not REF_PATTERN.match(ref or ''):
+        raise ValueError(f"Invalid image reference: {ref}")
+    return os.path.join(IMAGE_STORE_DIR, ref[:2], ref)
+
+def image_mimetype(ref):
+    """Return the mimetype of a stored image reference"""
+    return MIMETYPES.get(ref.rsplit('.', 1)[-1], 'application/octet-stream')
+
+def store_image(image_bytes, extension='png'):
+    """Store encoded image bytes and return their reference"""
+    ref = f"{hashlib.sha256(image_bytes).hexdigest()}.{extension.lower()}"
+    path = image_path(ref)
+    try:
+        # Already stored: mark the file as in use again so a pending purge leaves it alone
+        os.utime(path)
+        return ref
+    except FileNotFoundError:
+        pass
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temporary file first so readers never see a partial image
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(image_bytes)
+    os.replace(temp_path, path)
+    return ref
+
+def delete_image(ref):
+    """Remove a stored image if it exists"""
+    try:
+        os.unlink(image_path(ref))
+    except FileNotFoundError:
+        pass
+
+# Images of deleted documents are purged in the background, after a grace period: a stored
+# file may be shared by several pages (identical images), or be reused by an upload whose
+# page row isn't written yet, so a file is only removed once no page references it and it
+# hasn't been stored again for IMAGE_PURGE_GRACE seconds. Pending removals are ImagePurge
+# rows, written in the same transaction as the deletion (see persistence.delete_documents),
+# so they survive restarts and any app process may carry them out.
+IMAGE_PURGE_GRACE = float(os.getenv('IMAGE_PURGE_GRACE', 600))
+IMAGE_PURGE_POLL_INTERVAL = float(os.getenv('IMAGE_PURGE_POLL_INTERVAL', 60))  # Seconds between checks for due removals
+IMAGE_PURGE_BATCH = 500
+
+class ImagePurger:
+    """Background thread removing the queued images that are no longer referenced by any page"""
+
+    def __init__(self, app, db, Page, ImagePurge, grace=IMAGE_PURGE_GRACE,
+                 poll_interval=IMAGE_PURGE_POLL_INTERVAL):
+        self.app = app
+        self.db = db
+        self.Page = Page
+        self.ImagePurge = ImagePurge
+        self.grace = grace
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._thread = None
+        self.purged = 0
+
+    def start(self):
+        """Start the purge thread (idempotent)"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='image-purger', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            processed = 0
+            try:
+                with self.app.app_context():
+                    try:
+                        processed = self.purge_due()
+                    finally:
+                        self.db.session.remove()
+            except Exception as e:
+                print(f"[Images] Purge error: {str(e)}")
+            if processed < IMAGE_PURGE_BATCH:
+                time.sleep(self.poll_interval)
+
+    def purge_due(self):
+        """Purge the queued images whose grace period has passed; returns the number of refs handled"""
+        ImagePurge = self.ImagePurge
+        session = self.db.session
+        now = datetime.utcnow()
+        cutoff = now - timedelta(seconds=self.grace)
+        refs = [
+            ref for (ref,) in
+            session.query(ImagePurge.ref).filter(ImagePurge.queued_at <= cutoff)
+            .group_by(ImagePurge.ref).order_by(func.min(ImagePurge.queued_at)).limit(IMAGE_PURGE_BATCH)
+        ]
+        if not refs:
+            return 0
+
+        deferred = self.purge(refs)
+        done = [ref for ref in refs if ref not in deferred]
+        if done:
+            session.query(ImagePurge).filter(ImagePurge.ref.in_(done)).delete(synchronize_session=False)
+        if deferred:
+            # Stored again meanwhile: check once more after a new grace period
+            session.query(ImagePurge).filter(ImagePurge.ref.in_(deferred)).update(
+                {ImagePurge.queued_at: now}, synchronize_session=False
+            )
+        session.commit()
+        return len(refs)
+
+    def purge(self, refs):
+        """Remove the given images unless a page still references them.
+
+        Images stored again during the grace period are kept and returned, to be checked later.
+        """
+        referenced = set()
+        for name in PAGE_IMAGE_REF_COLUMNS:
+            column = getattr(self.Page, name)
+            referenced.update(ref for (ref,) in self.db.session.query(column).filter(column.in_(refs)).distinct())
+        removed = 0
+        deferred = set()
+        for ref in refs:
+            if ref in referenced:
+                continue
+            try:
+                if time.time() - os.path.getmtime(image_path(ref)) < self.grace:
+                    deferred.add(ref)
+                    continue
+            except (OSError, ValueError):
+                continue  # Already removed, or not a valid reference
+            delete_image(ref)
+            removed += 1
+        self.purged += removed
+        if removed:
+            print(f"[Images] Purged {removed} unreferenced page images")
+        return deferred
@@ -0,0 +1,87 @@
+from typing import List, Dict, Any, Callable, Tuple, Set
+from modules.prompt_utils import chunk_pages, chunks_containing, normalize_value
+
+# Incremental re-analysis: when a page is edited, only the page windows containing it are
+# re-extracted, and the stored rows found on the pages of those windows are patched in place.
+
+def depends_on_page(row, page_number: int) -> bool:
+    """Whether a stored Medication/SummaryExtraction row was extracted from a window containing the page"""
+    if row.source_page_start is None or row.source_page_end is None:
+        # Rows stored before windows were tracked: only their own page is known
+        return row.page_number == page_number
+    return row.source_page_start <= page_number <= row.source_page_end
+
+def reanalysis_scope(rows: list, pages: List[Dict[str, Any]], page_number: int, token_budget: int) -> Tuple[Set[int], Set[int]]:
+    """Pages whose windows are re-extracted after an edit, and the pages those windows cover.
+
+    The edited text can split the document into different windows than the ones stored
+    with the rows, so the windows re-extracted are those containing the edited page or any
+    page of the stored window of a row depending on it: every such row lies on a covered
+    page. Rows on covered pages are reconciled with the findings (see patch_rows); rows on
+    other pages are left as they are.
+    """
+    changed_pages = {page_number}
+    for row in rows:
+        if depends_on_page(row, page_number):
+            if row.source_page_start is None or row.source_page_end is None:
+                changed_pages.add(row.page_number)
+            else:
+                changed_pages.update(range(row.source_page_start, row.source_page_end + 1))
+    chunks = chunks_containing(chunk_pages(pages, token_budget=token_budget), changed_pages)
+    covered_pages = {page['page_number'] for chunk in chunks for page in chunk}
+    return changed_pages, covered_pages
+
+def _key(get: Callable[[str], Any], fields: Tuple[str, ...]) -> tuple:
+    return tuple(normalize_value(get(field)) for field in fields)
+
+def patch_rows(db, stale_rows: list, kept_rows: list, findings: List[Dict[str, Any]],
+               exact_fields: Tuple[str, ...], loose_fields: Tuple[str, ...],
+               create_row: Callable[[Dict[str, Any]], Any]) -> Dict[str, int]:
+    """Reconcile the rows on the re-extracted pages with the findings re-extracted from them.
+
+    `findings` are column values. A finding identical (on `exact_fields`) to a stale row
+    keeps that row; otherwise a stale row matching on `loose_fields` (e.g. the same field
+    with a corrected value) is updated in place. Findings already stored in a row on
+    another page are skipped, remaining findings are added and stale rows
+    that weren't found again are deleted.
+    """
+    counts = {'unchanged': 0, 'updated': 0, 'added': 0, 'removed': 0}
+    kept_keys = {_key(lambda field: getattr(row, field), exact_fields) for row in kept_rows}
+    remaining = list(stale_rows)
+
+    def take(fields, values):
+        key = _key(values.get, fields)
+        for row in remaining:
+            if _key(lambda field: getattr(row, field), fields) == key:
+                remaining.remove(row)
+                return row
+        return None
+
+    def update(row, values):
+        for field, value in values.items():
+            setattr(row, field, value)
+
+    unmatched = []
+    for values in findings:
+        if _key(values.get, exact_fields) in kept_keys:
+            continue
+        row = take(exact_fields, values)
+        if row is None:
+            unmatched.append(values)
+            continue
+        update(row, values)
+        counts['unchanged'] += 1
+
+    for values in unmatched:
+        row = take(loose_fields, values)
+        if row is None:
+            db.session.add(create_row(values))
+            counts['added'] += 1
+        else:
+            update(row, values)
+            counts['updated'] += 1
+
+    for row in remaining:
+        db.session.delete(row)
+        counts['removed'] += 1
+    return counts
@@ -0,0 +1,296 @@
+import os
+import time
+import uuid
+import threading
+from collections import Counter
+import fitz  # PyMuPDF
+from datetime import datetime, timedelta
+from sqlalchemy import update, or_, and_, case, func
+from modules.ocr_scheduler import HIGH_LANE, NORMAL_LANE, fair_share_path
+
+# Worker pool configuration
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+POLL_INTERVAL = 2.0  # Seconds between queue polls when idle
+STALE_JOB_TIMEOUT = 600  # A running job without heartbeat for this long is considered abandoned
+HEARTBEAT_INTERVAL = 30  # Seconds between heartbeats of a job waiting for OCR results
+
+# Priority lane: single uploads of at most HIGH_PRIORITY_MAX_PAGES pages (e.g. a prescription
+# scanned during a consultation) are claimed first and their pages OCRed ahead of bulk work
+HIGH_PRIORITY_MAX_PAGES = int(os.getenv('HIGH_PRIORITY_MAX_PAGES', 5))
+# Extra workers that only run priority jobs, so they never wait behind large documents
+HIGH_PRIORITY_JOB_WORKERS = int(os.getenv('HIGH_PRIORITY_JOB_WORKERS', 1))
+
+COPY_CHUNK_BYTES = 1024 * 1024
+
+def save_upload(file, upload_folder):
+    """Save an uploaded PDF under a unique name so a worker can pick it up later"""
+    os.makedirs(upload_folder, exist_ok=True)
+    file_path = os.path.join(upload_folder, f"{uuid.uuid4().hex}.pdf")
+    file.save(file_path)
+    return file_path
+
+def save_upload_stream(stream, upload_folder, max_bytes=None):
+    """Save a PDF read from a file-like object (e.g. a zip entry) like save_upload.
+
+    Raises ValueError, without leaving a partial file, if the stream holds more than
+    `max_bytes` (zip entries may declare a smaller size than they inflate to).
+    """
+    os.makedirs(upload_folder, exist_ok=True)
+    file_path = os.path.join(upload_folder, f"{uuid.uuid4().hex}.pdf")
+    try:
+        with open(file_path, 'wb') as f:
+            copied = 0
+            while True:
+                chunk = stream.read(COPY_CHUNK_BYTES)
+                if not chunk:
+                    break
+                copied += len(chunk)
+                if max_bytes is not None and copied > max_bytes:
+                    raise ValueError(f"File larger than {max_bytes} bytes")
+                f.write(chunk)
+    except BaseException:
+        os.unlink(file_path)
+        raise
+    return file_path
+
+def count_pdf_pages(file_path):
+    """Number of pages of a saved PDF, or None if it can't be opened (the job will report the error)"""
+    try:
+        with fitz.open(file_path) as pdf_document:
+            return len(pdf_document)
+    except Exception:
+        return None
+
+def is_high_priority(ProcessingJob):
+    """SQL condition selecting the jobs of the priority lane"""
+    return and_(ProcessingJob.batch_id.is_(None), ProcessingJob.total_pages <= HIGH_PRIORITY_MAX_PAGES)
+
+def job_lane(job):
+    """OCR scheduler lane of a job, see is_high_priority"""
+    if job.batch_id is None and job.total_pages is not None and job.total_pages <= HIGH_PRIORITY_MAX_PAGES:
+        return HIGH_LANE
+    return NORMAL_LANE
+
+def serialize_job(job):
+    """Return the progress report of a processing job"""
+    total_pages = job.total_pages
+    return {
+        'job_id': job.id,
+        'batch_id': job.batch_id,
+        'status': job.status,
+        'lane': job_lane(job),
+        'filename': job.filename,
+        'document_id': job.document_id,
+        'total_pages': total_pages,
+        'pages_done': job.pages_done,
+        'pages_failed': job.pages_failed,
+        'pages_remaining': max(total_pages - job.pages_done - job.pages_failed, 0) if total_pages is not None else None,
+        'error': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
+
+def serialize_batch(batch_id, jobs):
+    """Return the progress report of a batch upload and of each of its files"""
+    statuses = [job.status for job in jobs]
+    return {
+        'batch_id': batch_id,
+        'status': 'completed' if all(status in ('completed', 'failed') for status in statuses) else 'processing',
+        'files': len(jobs),
+        'files_by_status': {status: statuses.count(status) for status in ('queued', 'running', 'completed', 'failed')},
+        'pages_done': sum(job.pages_done for job in jobs),
+        'pages_failed': sum(job.pages_failed for job in jobs),
+        'jobs': [serialize_job(job) for job in jobs]
+    }
+
+class JobWorkerPool:
+    """Background threads running queued PDF processing jobs.
+
+    The queue lives in the `ProcessingJob` table: workers claim a job with a conditional
+    UPDATE, so several processes (e.g. gunicorn workers) can share the same queue without
+    a broker. Jobs whose heartbeat went stale (crashed worker) are claimed again and resume
+    from the pages already stored. Priority jobs (see is_high_priority) are claimed first, and
+    `num_priority_workers` extra workers only run those.
+    """
+
+    def __init__(self, app, db, ProcessingJob, Document, Page, process_pdf_file, mistral_client, num_workers=JOB_WORKERS,
+                 num_priority_workers=HIGH_PRIORITY_JOB_WORKERS):
+        self.app = app
+        self.db = db
+        self.ProcessingJob = ProcessingJob
+        self.Document = Document
+        self.Page = Page
+        self.process_pdf_file = process_pdf_file
+        self.mistral_client = mistral_client
+        self.num_workers = num_workers
+        self.num_priority_workers = num_priority_workers
+        self._threads = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def start(self):
+        """Start the worker threads (idempotent)"""
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.num_workers):
+                thread = threading.Thread(target=self._run, name=f"job-worker-{i + 1}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            for i in range(self.num_priority_workers):
+                thread = threading.Thread(target=self._run, args=(True,), name=f"job-worker-priority-{i + 1}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            print(f"[Jobs] Started {self.num_workers} background workers (+{self.num_priority_workers} for priority jobs)")
+
+    def notify(self):
+        """Wake up idle workers after a job has been queued"""
+        self._wakeup.set()
+
+    def stats(self):
+        """Depth of the job queue per lane (needs an app context)"""
+        ProcessingJob = self.ProcessingJob
+        lane = case((is_high_priority(ProcessingJob), HIGH_LANE), else_=NORMAL_LANE)
+        counts = {
+            (status, job_lane_name): count for status, job_lane_name, count in
+            self.db.session.query(ProcessingJob.status, lane, func.count(ProcessingJob.id))
+            .filter(ProcessingJob.status.in_(('queued', 'running')))
+            .group_by(ProcessingJob.status, lane)
+        }
+        return {
+            'workers': self.num_workers,
+            'priority_workers': self.num_priority_workers,
+            **{
+                status: {name: counts.get((status, name), 0) for name in (HIGH_LANE, NORMAL_LANE)}
+                for status in ('queued', 'running')
+            }
+        }
+
+    def _run(self, high_priority_only=False):
+        while True:
+            job_id = None
+            try:
+                with self.app.app_context():
+                    try:
+                        job_id = self._claim_next_job(high_priority_only)
+                        if job_id:
+                            self._run_job(job_id)
+                    finally:
+                        self.db.session.remove()
+            except Exception as e:
+                print(f"[Jobs] Worker error: {str(e)}")
+                time.sleep(POLL_INTERVAL)
+
+            if not job_id:
+                self._wakeup.wait(POLL_INTERVAL)
+                self._wakeup.clear()
+
+    def _claim_next_job(self, high_priority_only=False):
+        """Atomically move a queued (or abandoned) job to 'running', priority jobs first.
+
+        Within a lane, jobs are claimed round-robin across the fair-share tree of their
+        requesters (see fair_share_path): the oldest job of each requester is a candidate,
+        and the one whose centre, then service, then user has the fewest running jobs is
+        claimed first. A requester with a large batch queued thus can't hold every worker
+        while others wait.
+        """
+        ProcessingJob = self.ProcessingJob
+        now = datetime.utcnow()
+        stale_before = now - timedelta(seconds=STALE_JOB_TIMEOUT)
+
+        priority = case((is_high_priority(ProcessingJob), 0), else_=1)
+        claimable = or_(
+            ProcessingJob.status == 'queued',
+            and_(ProcessingJob.status == 'running', ProcessingJob.heartbeat_at < stale_before)
+        )
+        if high_priority_only:
+            claimable = and_(claimable, is_high_priority(ProcessingJob))
+        oldest_per_requester = (
+            self.db.session.query(func.min(ProcessingJob.id))
+            .filter(claimable)
+            .group_by(ProcessingJob.requested_by_id, priority)
+        )
+        candidates = ProcessingJob.query.filter(ProcessingJob.id.in_(oldest_per_requester)).all()
+        if not candidates:
+            return None
+
+        running = Counter()
+        for job in ProcessingJob.query.filter(ProcessingJob.status == 'running', ProcessingJob.heartbeat_at >= stale_before):
+            path = fair_share_path(job.requested_by, None)[:-1]
+            running.update(path[:depth] for depth in range(1, len(path) + 1))
+
+        def claim_order(job):
+            path = fair_share_path(job.requested_by, None)[:-1]
+            load = tuple(running[path[:depth]] for depth in range(1, len(path) + 1))
+            return (0 if job_lane(job) == HIGH_LANE else 1, load, job.id)
+
+        for job in sorted(candidates, key=claim_order)[:5]:
+            # Compare-and-set on the state we read: only one worker wins the job
+            heartbeat_matches = (ProcessingJob.heartbeat_at.is_(None) if job.heartbeat_at is None
+                                 else ProcessingJob.heartbeat_at == job.heartbeat_at)
+            result = self.db.session.execute(
+                update(ProcessingJob)
+                .where(ProcessingJob.id == job.id, ProcessingJob.status == job.status, heartbeat_matches)
+                .values(status='running', started_at=job.started_at or now, heartbeat_at=now)
+            )
+            self.db.session.commit()
+            if result.rowcount == 1:
+                return job.id
+        return None
+
+    def _run_job(self, job_id):
+        db = self.db
+        job = self.ProcessingJob.query.get(job_id)
+        lane = job_lane(job)
+        print(f"[Jobs] Running job {job.id} ('{job.filename}', {lane} priority)")
+
+        def on_document_created(document, total_pages):
+            job.document_id = document.id
+            job.total_pages = total_pages
+            job.pages_done = self.Page.query.filter_by(document_id=document.id).count()
+            job.pages_failed = 0
+            job.heartbeat_at = datetime.utcnow()
+            db.session.commit()
+
+        def on_pages_processed(page_numbers, success):
+            if success:
+                job.pages_done += len(page_numbers)
+            else:
+                job.pages_failed += len(page_numbers)
+            job.heartbeat_at = datetime.utcnow()
+            db.session.commit()
+
+        def on_heartbeat():
+            now = datetime.utcnow()
+            if job.heartbeat_at is None or now - job.heartbeat_at >= timedelta(seconds=HEARTBEAT_INTERVAL):
+                job.heartbeat_at = now
+                db.session.commit()
+
+        try:
+            result = self.process_pdf_file(
+                job.file_path, job.filename, db, self.Document, self.Page, self.mistral_client, job.user_id,
+                document_id=job.document_id,
+                on_document_created=on_document_created,
+                on_pages_processed=on_pages_processed,
+                on_heartbeat=on_heartbeat,
+                scheduler_path=fair_share_path(job.requested_by, f"job-{job.id}"),
+                lane=lane
+            )
+        except Exception as e:
+            db.session.rollback()
+            result = {'status': 'error', 'error': str(e)}
+
+        job.status = 'completed' if result.get('status') == 'success' else 'failed'
+        job.error = result.get('error')
+        if job.status == 'failed' and not self.Document.query.get(job.document_id or 0):
+            job.document_id = None
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        print(f"[Jobs] Job {job.id} {job.status}")
+
+        try:
+            if os.path.exists(job.file_path):
+                os.unlink(job.file_path)
+        except Exception as e:
+            print(f"[Jobs] Error cleaning up uploaded file: {str(e)}")
@@ -0,0 +1,52 @@
+import os
+import json
+from modules.cache import DiskCache, make_key
+from modules.rate_limiter import mistral_limiter
+
+# Cache of chat completions used by the analysis agents. Identical requests (same model,
+# messages and sampling parameters) are answered from disk, e.g. when an analysis is
+# deleted and run again. LLM_CACHE_ENABLED=false disables it.
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'true').lower() != 'false'
+llm_cache = DiskCache(
+    'llm',
+    max_entries=int(os.getenv('LLM_CACHE_MAX_ENTRIES', 20000)),
+    max_bytes=int(os.getenv('LLM_CACHE_MAX_BYTES', 200 * 1024 * 1024)),
+    ttl=int(os.getenv('LLM_CACHE_TTL', 30 * 24 * 3600))
+)
+
+def normalize_messages(messages):
+    """Messages with line endings and surrounding whitespace normalized, for the cache key"""
+    normalized = []
+    for message in messages:
+        content = message.get('content')
+        if isinstance(content, str):
+            content = content.replace('\r\n', '\n').strip()
+        normalized.append({'role': message.get('role'), 'content': content})
+    return normalized
+
+def chat_complete(mistral_client, use_cache=None, **request):
+    """Send a chat completion request through the rate limiter and return the message content.
+
+    Responses are cached unless `use_cache` (default LLM_CACHE_ENABLED) is False. When a
+    JSON response_format is requested, only responses that parse as JSON are cached.
+    """
+    use_cache = LLM_CACHE_ENABLED if use_cache is None else use_cache
+    key = None
+    if use_cache:
+        parameters = {name: value for name, value in request.items() if name != 'messages'}
+        key = make_key('chat', parameters, normalize_messages(request.get('messages', [])))
+        content = llm_cache.get(key)
+        if content is not None:
+            return content
+
+    response = mistral_limiter.call(mistral_client.chat.complete, **request)
+    content = response.choices[0].message.content
+
+    if key is not None and isinstance(content, str):
+        if (request.get('response_format') or {}).get('type') == 'json_object':
+            try:
+                json.loads(content)
+            except ValueError:
+                return content
+        llm_cache.set(key, content)
+    return content
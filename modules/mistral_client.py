@@ -0,0 +1,118 @@
+import os
+import json
+import time
+import random
+import threading
+from types import SimpleNamespace
+
+# Client used for every Mistral call: the real API, or a local stand-in
+# (MISTRAL_BACKEND=mock) to run and benchmark the pipeline without an API key.
+MISTRAL_BACKEND = os.getenv('MISTRAL_BACKEND', 'mistral')
+
+# Mock backend behaviour
+MOCK_LATENCY = float(os.getenv('MOCK_MISTRAL_LATENCY', 0.5))  # Seconds per call
+MOCK_LATENCY_JITTER = float(os.getenv('MOCK_MISTRAL_LATENCY_JITTER', 0.2))  # Fraction of the latency
+MOCK_RATE_LIMIT_RATE = float(os.getenv('MOCK_MISTRAL_RATE_LIMIT_RATE', 0))  # Fraction of calls answered with a 429
+MOCK_RETRY_AFTER = os.getenv('MOCK_MISTRAL_RETRY_AFTER')  # Retry-After header of the 429s, if any
+MOCK_RESPONSES = os.getenv('MOCK_MISTRAL_RESPONSES')  # JSON file overriding the default payloads
+
+DEFAULT_MOCK_RESPONSES = {
+    'ocr': "Compte rendu de consultation\nPatient : Jean Dupont\nTraitement : Doliprane 1g, 3 fois par jour pendant 5 jours",
+    'prescription': {
+        "medications": [{
+            "name": "Doliprane", "dosage": "1g", "frequency": "3 fois par jour", "start_date": "2024-01-15",
+            "duration": "5 days", "duration_raw": "pendant 5 jours", "instructions": None, "page_number": 1
+        }]
+    },
+    'summary': [
+        {"field": "Full Name", "value": "Jean Dupont", "page_number": 1}
+    ]
+}
+
+class MockRateLimitError(Exception):
+    """429 raised by the mock backend, shaped like mistralai's SDKError"""
+
+    def __init__(self, retry_after=None):
+        super().__init__("API error occurred: Status 429")
+        self.status_code = 429
+        headers = {'retry-after': retry_after} if retry_after is not None else {}
+        self.raw_response = SimpleNamespace(headers=headers)
+
+class MockChat:
+    """Stand-in for client.chat answering with canned payloads after a simulated latency"""
+
+    def __init__(self, latency=MOCK_LATENCY, jitter=MOCK_LATENCY_JITTER, rate_limit_rate=MOCK_RATE_LIMIT_RATE,
+                 retry_after=MOCK_RETRY_AFTER, responses=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.responses = responses or DEFAULT_MOCK_RESPONSES
+        self._lock = threading.Lock()
+        self.calls = {'ocr': 0, 'prescription': 0, 'summary': 0}
+        self.rate_limited = 0
+        self.latencies = []
+
+    def _kind(self, messages):
+        if any(isinstance(message.get('content'), list) for message in messages):
+            return 'ocr'
+        if 'medications' in (messages[0].get('content') or ''):
+            return 'prescription'
+        return 'summary'
+
+    def _payload(self, kind, messages):
+        payload = self.responses[kind]
+        if kind == 'summary' and '"extractions"' in messages[-1]['content']:
+            # Packed mode: attach the findings to the first category of the request
+            category = messages[-1]['content'].split('Category: ', 1)[-1].split('\n', 1)[0]
+            payload = {'extractions': [dict(finding, category=category) for finding in payload]}
+        return payload if isinstance(payload, str) else json.dumps(payload)
+
+    def complete(self, **kwargs):
+        start = time.time()
+        messages = kwargs.get('messages', [])
+        kind = self._kind(messages)
+        time.sleep(max(self.latency * (1 + random.uniform(-self.jitter, self.jitter)), 0))
+
+        with self._lock:
+            self.calls[kind] += 1
+            self.latencies.append(time.time() - start)
+            rate_limited = random.random() < self.rate_limit_rate
+            if rate_limited:
+                self.rate_limited += 1
+        if rate_limited:
+            raise MockRateLimitError(self.retry_after)
+
+        message = SimpleNamespace(content=self._payload(kind, messages))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], model=kwargs.get('model'))
+
+    def reset_stats(self):
+        with self._lock:
+            self.calls = {kind: 0 for kind in self.calls}
+            self.rate_limited = 0
+            self.latencies = []
+
+class MockMistral:
+    """Offline replacement of mistralai.Mistral (only chat.complete is used by the app)"""
+
+    def __init__(self, **options):
+        self.chat = MockChat(**options)
+
+def load_mock_responses(path=MOCK_RESPONSES):
+    """Default mock payloads, overridden by the keys of the JSON file at `path`"""
+    responses = dict(DEFAULT_MOCK_RESPONSES)
+    if path:
+        with open(path, 'r', encoding='utf-8') as f:
+            responses.update(json.load(f))
+    return responses
+
+def create_mistral_client(backend=MISTRAL_BACKEND):
+    """Return the Mistral client for the configured backend ('mistral' or 'mock')"""
+    if backend == 'mock':
+        print("[Mistral] Using the mock backend, no API calls will be made")
+        return MockMistral(responses=load_mock_responses())
+    if backend != 'mistral':
+        raise ValueError(f"Unknown MISTRAL_BACKEND: {backend}")
+
+    from mistralai import Mistral
+    return Mistral(api_key=os.getenv('MISTRAL_API_KEY'))
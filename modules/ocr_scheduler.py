@@ -0,0 +1,163 @@
+import os
+import time
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from modules.rate_limiter import mistral_limiter
+
+# OCR threads shared by every document being processed in this process. There is no
+# point in having more than the limiter will ever let through.
+OCR_THREADS = mistral_limiter.max_concurrency
+
+# Lanes: 'high' for small interactive uploads, 'normal' for everything else. When both
+# have work, the high lane gets HIGH_LANE_WEIGHT turns for each turn of the normal lane.
+HIGH_LANE = 'high'
+NORMAL_LANE = 'normal'
+HIGH_LANE_WEIGHT = int(os.getenv('OCR_HIGH_LANE_WEIGHT', 4))
+
+# Organisation accounts whose own id identifies the tenant
+ORGANISATION_ROLES = {
+    'centre_regional': 'region',
+    'centre_hospitalier': 'centre',
+    'service_hospitalier': 'service',
+    'cabinet_medical': 'cabinet'
+}
+
+def fair_share_path(user, leaf):
+    """Scheduling path of a user's work: organisations from the top down, the user, then `leaf`.
+
+    e.g. ('centre-3', 'service-5', 'user-9', 'job-12') for a doctor of a hospital service, or
+    ('user-4', 'job-13') for a patient uploading their own documents. Queues are served
+    round-robin at every level, so each centre gets the same share, then each service within
+    it, each user, and each document.
+    """
+    if user is None:
+        return (leaf,)
+    path = []
+    for prefix, org_id in (('centre', user.centre_id), ('service', user.service_id), ('cabinet', user.cabinet_id)):
+        if org_id:
+            path.append(f"{prefix}-{org_id}")
+    if user.role in ORGANISATION_ROLES:
+        path.append(f"{ORGANISATION_ROLES[user.role]}-{user.id}")
+    else:
+        path.append(f"user-{user.id}")
+    path.append(leaf)
+    return tuple(path)
+
+class _FairQueue:
+    """Hierarchical round-robin queue: tasks are stored under a path of keys"""
+
+    def __init__(self):
+        self.children = OrderedDict()
+        self.tasks = deque()
+        self.size = 0
+
+    def push(self, path, task):
+        self.size += 1
+        if not path:
+            self.tasks.append(task)
+            return
+        self.children.setdefault(path[0], _FairQueue()).push(path[1:], task)
+
+    def pop(self):
+        self.size -= 1
+        if self.tasks:
+            return self.tasks.popleft()
+        # Serve the child at the head of the rotation, then move it to the back
+        key, child = self.children.popitem(last=False)
+        task = child.pop()
+        if child.size:
+            self.children[key] = child
+        return task
+
+    def depth_by_key(self):
+        return {str(key): child.size for key, child in self.children.items()}
+
+class OCRScheduler:
+    """Global pool of OCR threads with fair queuing between tenants and two priority lanes.
+
+    Tasks are submitted with a path (see fair_share_path) and a lane. `submit` returns a
+    concurrent.futures.Future; the shared rate limiter then paces the actual API calls.
+    """
+
+    def __init__(self, num_threads=OCR_THREADS, high_lane_weight=HIGH_LANE_WEIGHT):
+        self.num_threads = num_threads
+        self.high_lane_weight = high_lane_weight
+        self._lanes = {HIGH_LANE: _FairQueue(), NORMAL_LANE: _FairQueue()}
+        self._high_turns = 0  # High lane tasks served in a row while the normal lane waited
+        self._condition = threading.Condition()
+        self._threads = []
+        self._running = 0
+        self.completed = {HIGH_LANE: 0, NORMAL_LANE: 0}
+        self.wait_time = {HIGH_LANE: 0.0, NORMAL_LANE: 0.0}
+
+    def _start(self):
+        # Called with the condition held
+        if self._threads:
+            return
+        for i in range(self.num_threads):
+            thread = threading.Thread(target=self._work, name=f"ocr-{i + 1}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, path, fn, *args, lane=NORMAL_LANE, **kwargs):
+        """Queue `fn(*args, **kwargs)` under `path` (a tuple of keys) in `lane` and return its future"""
+        future = Future()
+        with self._condition:
+            self._start()
+            self._lanes[lane].push(tuple(path), (future, fn, args, kwargs, lane, time.time()))
+            self._condition.notify()
+        return future
+
+    def _next_lane(self):
+        high, normal = self._lanes[HIGH_LANE], self._lanes[NORMAL_LANE]
+        if high.size and (not normal.size or self._high_turns < self.high_lane_weight):
+            self._high_turns = self._high_turns + 1 if normal.size else 0
+            return HIGH_LANE
+        self._high_turns = 0
+        return NORMAL_LANE
+
+    def _next_task(self):
+        with self._condition:
+            while not any(queue.size for queue in self._lanes.values()):
+                self._condition.wait()
+            task = self._lanes[self._next_lane()].pop()
+            self._running += 1
+            return task
+
+    def _work(self):
+        while True:
+            future, fn, args, kwargs, lane, queued_at = self._next_task()
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args, **kwargs))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self._condition:
+                    self._running -= 1
+                    self.completed[lane] += 1
+                    self.wait_time[lane] += time.time() - queued_at
+
+    def stats(self):
+        """Return queue depths (per lane and per top-level tenant) and throughput counters"""
+        with self._condition:
+            return {
+                'threads': self.num_threads,
+                'running': self._running,
+                'queued': sum(queue.size for queue in self._lanes.values()),
+                'lanes': {
+                    lane: {
+                        'queued': queue.size,
+                        'queued_by_tenant': queue.depth_by_key(),
+                        'completed': self.completed[lane],
+                        # Time from submission to completion, cancelled tasks included
+                        'avg_latency_s': round(self.wait_time[lane] / self.completed[lane], 3) if self.completed[lane] else None
+                    }
+                    for lane, queue in self._lanes.items()
+                }
+            }
+
+# Scheduler shared by all processing jobs of this process
+ocr_scheduler = OCRScheduler()
@@ -0,0 +1,41 @@
+import io
+import os
+from PIL import Image
+
+# Downscaled copies of each page image, made once at ingest and served to previews instead
+# of the full rendering (GET /api/documents/<id>/pages/<n>/image?size=thumb|screen).
+# Sizes are maximum widths in pixels; an image that is already narrower is only re-encoded.
+# The full size is the archived page image itself.
+PREVIEW_SIZES = {
+    'screen': int(os.getenv('PREVIEW_SCREEN_WIDTH', 1000)),
+    'thumb': int(os.getenv('PREVIEW_THUMB_WIDTH', 200))
+}
+PREVIEW_FORMAT = 'jpeg'
+PREVIEW_QUALITY = int(os.getenv('PREVIEW_QUALITY', 80))
+IMAGE_SIZES = ('thumb', 'screen', 'full')
+
+def encode_previews(image):
+    """Return {size: JPEG bytes} for each of PREVIEW_SIZES.
+
+    Each size is scaled down from the next larger one (a pyramid), so the full image is
+    only resampled once.
+    """
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    previews = {}
+    for size, width in sorted(PREVIEW_SIZES.items(), key=lambda item: -item[1]):
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS, reducing_gap=2.0)
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=PREVIEW_QUALITY, optimize=True)
+        previews[size] = output.getvalue()
+    return previews
+
+def preview_refs(row):
+    """Page image reference served for each size; sizes without a preview fall back to the full image"""
+    return {
+        size: (getattr(row, f"{size}_ref", None) if size != 'full' else None) or row.image_ref
+        for size in IMAGE_SIZES
+    }
@@ -0,0 +1,151 @@
+import os
+import io
+import fitz  # PyMuPDF
+from PIL import Image
+from collections import namedtuple
+from modules.page_previews import encode_previews
+
+# Page rendering and encoding. This module is all a render worker process imports (see
+# document_processor.get_render_pool), so it must not depend on the app, the database or
+# the API client.
+
+RENDER_ZOOM = 2
+
+# Page images: one copy sent to the vision model, one archived for display. Each page is
+# rendered once per distinct zoom and encoded once per distinct setting, so with identical
+# settings the same bytes serve both. Formats: png, jpeg, webp (quality only applies to
+# jpeg/webp).
+ImageSettings = namedtuple('ImageSettings', ['zoom', 'format', 'quality'])
+IMAGE_FORMATS = {'png': 'PNG', 'jpeg': 'JPEG', 'webp': 'WEBP'}
+VISION_IMAGE = ImageSettings(
+    zoom=float(os.getenv('VISION_IMAGE_ZOOM', RENDER_ZOOM)),
+    format=os.getenv('VISION_IMAGE_FORMAT', 'png').lower(),
+    quality=int(os.getenv('VISION_IMAGE_QUALITY', 90))
+)
+ARCHIVE_IMAGE = ImageSettings(
+    zoom=float(os.getenv('ARCHIVE_IMAGE_ZOOM', RENDER_ZOOM)),
+    format=os.getenv('ARCHIVE_IMAGE_FORMAT', 'png').lower(),
+    quality=int(os.getenv('ARCHIVE_IMAGE_QUALITY', 90))
+)
+PNG_OPTIMIZE = os.getenv('PNG_OPTIMIZE', 'true').lower() != 'false'
+for settings in (VISION_IMAGE, ARCHIVE_IMAGE):
+    if settings.format not in IMAGE_FORMATS:
+        raise ValueError(f"Unsupported page image format: {settings.format}")
+
+# Born-digital pages: use the PDF text layer instead of vision OCR
+NATIVE_TEXT_MIN_CHARS = int(os.getenv('NATIVE_TEXT_MIN_CHARS', 50))
+NATIVE_TEXT_MIN_READABLE_RATIO = 0.9
+# A page mostly covered by images is a scan, even when its text layer holds a line or two
+# (fax or document management headers): it goes through vision OCR
+NATIVE_TEXT_MAX_IMAGE_COVERAGE = float(os.getenv('NATIVE_TEXT_MAX_IMAGE_COVERAGE', 0.5))
+
+def render_page_image(pdf_document, page_index, zoom=RENDER_ZOOM):
+    """Render a single PDF page to a PIL image using PyMuPDF"""
+    page = pdf_document[page_index]
+    mat = fitz.Matrix(zoom, zoom)
+    pix = page.get_pixmap(matrix=mat, alpha=False)
+    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    pix = None  # frombytes copied the samples, release the pixmap right away
+    
+    if img.size[0] <= 0 or img.size[1] <= 0:
+        raise ValueError("Invalid image size")
+    return img
+
+def image_coverage(pdf_page):
+    """Fraction of the page area covered by images (overlapping images are counted twice, capped at 1)"""
+    page_area = pdf_page.rect.get_area()
+    if not page_area:
+        return 0.0
+    covered = 0.0
+    for info in pdf_page.get_image_info():
+        bbox = fitz.Rect(info['bbox']) & pdf_page.rect
+        if not bbox.is_empty:
+            covered += bbox.get_area()
+    return min(covered / page_area, 1.0)
+
+def extract_native_text(pdf_page):
+    """Return the text layer of a born-digital page, or None if the page needs vision OCR.
+
+    A page is considered to have a usable text layer when it holds at least
+    NATIVE_TEXT_MIN_CHARS characters, most of them readable (no encoding garbage), and
+    images cover at most NATIVE_TEXT_MAX_IMAGE_COVERAGE of it.
+    """
+    try:
+        text = pdf_page.get_text("text").strip()
+        if len(text) >= NATIVE_TEXT_MIN_CHARS and image_coverage(pdf_page) > NATIVE_TEXT_MAX_IMAGE_COVERAGE:
+            return None
+    except Exception:
+        return None
+    
+    if len(text) < NATIVE_TEXT_MIN_CHARS:
+        return None
+    
+    readable = sum(1 for c in text if c.isprintable() or c.isspace()) - text.count('\ufffd')
+    if readable / len(text) < NATIVE_TEXT_MIN_READABLE_RATIO:
+        return None
+    return text
+
+def encode_page_images(pdf_document, page_index, vision=True):
+    """Render and encode a page, returning {'archive': bytes, 'vision': bytes} ('vision' only if requested)
+    plus the preview sizes of the archived image ({'screen': bytes, 'thumb': bytes}, see page_previews)"""
+    outputs = {'archive': ARCHIVE_IMAGE}
+    if vision:
+        outputs['vision'] = VISION_IMAGE
+    
+    rendered = {}
+    encoded = {}
+    for settings in outputs.values():
+        if settings in encoded:
+            continue
+        if settings.zoom not in rendered:
+            rendered[settings.zoom] = render_page_image(pdf_document, page_index, settings.zoom)
+        encoded[settings] = encode_image_bytes(rendered[settings.zoom], settings.format, settings.quality)
+    images = {name: encoded[settings] for name, settings in outputs.items()}
+    images.update(encode_previews(rendered[ARCHIVE_IMAGE.zoom]))
+    return images
+
+def iter_page_images(pdf_document, page_numbers):
+    """Lazily render pages one at a time, yielding (page_num, images, native_text).
+
+    images is the result of encode_page_images (no vision copy for pages with a text layer),
+    or None when the page could not be rendered; native_text is None when the page has no
+    usable text layer and must go through vision OCR. Nothing is rendered until the consumer
+    asks for the next page, so only pages in flight are held in memory.
+    """
+    for page_num in page_numbers:
+        native_text = extract_native_text(pdf_document[page_num - 1])
+        try:
+            yield page_num, encode_page_images(pdf_document, page_num - 1, vision=not native_text), native_text
+        except Exception as e:
+            print(f"Error converting page {page_num}: {str(e)}")
+            yield page_num, None, native_text
+
+def encode_image_bytes(image, image_format='png', quality=90):
+    """Encode PIL Image to PNG, JPEG or WebP bytes"""
+    try:
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        
+        img_byte_arr = io.BytesIO()
+        if image_format == 'png':
+            image.save(img_byte_arr, format='PNG', optimize=PNG_OPTIMIZE)
+        else:
+            image.save(img_byte_arr, format=IMAGE_FORMATS[image_format], quality=quality)
+        return img_byte_arr.getvalue()
+    except Exception as e:
+        raise ValueError(f"Error encoding image: {str(e)}")
+
+# Render worker process state: open PDFs by (path, size, mtime)
+RENDER_WORKER_OPEN_DOCUMENTS = 4  # PDFs kept open by each render worker
+_worker_documents = {}
+
+def render_pages_in_worker(pdf_path, page_numbers):
+    """Render pool task: render and encode pages, reusing the worker's open document"""
+    stat = os.stat(pdf_path)
+    key = (pdf_path, stat.st_size, stat.st_mtime)
+    pdf_document = _worker_documents.get(key)
+    if pdf_document is None:
+        while len(_worker_documents) >= RENDER_WORKER_OPEN_DOCUMENTS:
+            _worker_documents.pop(next(iter(_worker_documents))).close()
+        pdf_document = _worker_documents[key] = fitz.open(pdf_path)
+    return list(iter_page_images(pdf_document, page_numbers))
@@ -0,0 +1,124 @@
+import os
+import time
+from sqlalchemy import insert, delete, select
+from models import Document, Page, PrescriptionAnalysis, Medication, DocumentSummary, SummaryExtraction, ImagePurge
+from modules.image_store import PAGE_IMAGE_REF_COLUMNS
+
+# Rows buffered before they are written with one bulk INSERT and one commit, and the
+# longest a row may stay in the buffer. A crash loses at most the buffered rows: an
+# interrupted job redoes those pages when it resumes (their OCR comes from the cache).
+PERSIST_BATCH_ROWS = int(os.getenv('PERSIST_BATCH_ROWS', 50))
+PERSIST_BATCH_SECONDS = float(os.getenv('PERSIST_BATCH_SECONDS', 2.0))
+BULK_INSERT_CHUNK = 500  # Rows per executemany INSERT
+
+def bulk_insert(db, model, rows, chunk_size=BULK_INSERT_CHUNK):
+    """Insert a list of column dicts with executemany INSERTs in the current transaction (no commit)"""
+    for start in range(0, len(rows), chunk_size):
+        db.session.execute(insert(model), rows[start:start + chunk_size])
+
+class BatchWriter:
+    """Buffers rows of a model and writes them in bounded batches, one transaction per batch.
+
+    `on_flushed(saved_rows, failed)` is called after each batch, `failed` being a list of
+    (row, error). If a bulk INSERT fails, the batch is retried row by row so that one bad
+    row (e.g. a page stored meanwhile by another worker) doesn't lose the others.
+    """
+
+    def __init__(self, db, model, max_rows=PERSIST_BATCH_ROWS, max_delay=PERSIST_BATCH_SECONDS, on_flushed=None):
+        self.db = db
+        self.model = model
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.on_flushed = on_flushed
+        self._rows = []
+        self._first_added_at = None
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, row):
+        """Buffer a row (dict of column values), writing the batch if it is full or old enough"""
+        if not self._rows:
+            self._first_added_at = time.time()
+        self._rows.append(row)
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        if self._rows and (len(self._rows) >= self.max_rows or time.time() - self._first_added_at >= self.max_delay):
+            self.flush()
+
+    def flush(self):
+        """Write the buffered rows now"""
+        if not self._rows:
+            return
+        rows, self._rows = self._rows, []
+        db = self.db
+        try:
+            bulk_insert(db, self.model, rows)
+            db.session.commit()
+            saved, failed = rows, []
+        except Exception as e:
+            db.session.rollback()
+            print(f"[Persistence] Bulk insert of {len(rows)} {self.model.__tablename__} rows failed, "
+                  f"retrying row by row: {str(e)}")
+            saved, failed = [], []
+            for row in rows:
+                try:
+                    db.session.execute(insert(self.model), [row])
+                    db.session.commit()
+                    saved.append(row)
+                except Exception as row_error:
+                    db.session.rollback()
+                    failed.append((row, row_error))
+
+        if self.on_flushed:
+            self.on_flushed(saved, failed)
+
+def load_page_texts(db, document_id):
+    """Page numbers and text of a document in page order, without the page images"""
+    return [
+        {'page_number': page_number, 'content': content}
+        for page_number, content in
+        db.session.query(Page.page_number, Page.content).filter_by(document_id=document_id).order_by(Page.page_number)
+    ]
+
+def delete_documents(db, document_ids):
+    """Delete documents with their pages and analyses using set-based DELETEs (no row is loaded).
+
+    Children are deleted explicitly so this also works on databases without ON DELETE
+    CASCADE. The page images are queued in ImagePurge, in the same transaction, and removed
+    in the background by the ImagePurger once no page uses them anymore. The caller commits.
+    Returns the number of deleted documents.
+    """
+    document_ids = list(document_ids)
+    if not document_ids:
+        return 0
+    session = db.session
+    image_refs = {
+        ref
+        for refs in session.execute(
+            select(*(getattr(Page, name) for name in PAGE_IMAGE_REF_COLUMNS)).where(Page.document_id.in_(document_ids))
+        )
+        for ref in refs if ref
+    }
+
+    prescription_ids = select(PrescriptionAnalysis.id).where(PrescriptionAnalysis.document_id.in_(document_ids))
+    summary_ids = select(DocumentSummary.id).where(DocumentSummary.document_id.in_(document_ids))
+    for statement in (
+        delete(Medication).where(Medication.prescription_id.in_(prescription_ids)),
+        delete(PrescriptionAnalysis).where(PrescriptionAnalysis.document_id.in_(document_ids)),
+        delete(SummaryExtraction).where(SummaryExtraction.summary_id.in_(summary_ids)),
+        delete(DocumentSummary).where(DocumentSummary.document_id.in_(document_ids)),
+        delete(Page).where(Page.document_id.in_(document_ids)),
+    ):
+        session.execute(statement, execution_options={'synchronize_session': False})
+    deleted = session.execute(
+        delete(Document).where(Document.id.in_(document_ids)),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+
+    bulk_insert(db, ImagePurge, [{'ref': ref} for ref in sorted(image_refs)])
+
+    # Objects of this session that pointed to the deleted rows are stale now
+    session.expire_all()
+    return deleted
@@ -3,7 +3,16 @@ from datetime import datetime, timedelta
 import json
 import dateutil.parser
 from flask_sqlalchemy import SQLAlchemy
-from typing import Optional
+from typing import Optional, Collection
+from modules.rate_limiter import mistral_limiter
+from modules.llm_cache import chat_complete
+from modules.prompt_utils import CHUNK_TOKEN_BUDGET, chunk_pages, chunks_containing, format_pages_for_prompt, normalize_value, resolve_page_number
+from modules.incremental_analysis import reanalysis_scope, patch_rows
+from modules.persistence import bulk_insert, load_page_texts
+from concurrent.futures import ThreadPoolExecutor
+
+# Maximum number of page windows of a document analyzed concurrently
+MAX_PARALLEL_CHUNKS = mistral_limiter.max_concurrency
 
 def compute_prescription_end_date(start_date: str, duration: str) -> Optional[str]:
     """Compute the end date of a prescription based on start date and duration."""
@@ -33,41 +42,27 @@ def compute_prescription_end_date(start_date: str, duration: str) -> Optional[st
         return None
 
 class PrescriptionAgent:
-    def __init__(self, mistral_client: Mistral):
+    def __init__(self, mistral_client: Mistral, chunk_token_budget: Optional[int] = None):
         self.mistral_client = mistral_client
+        self.chunk_token_budget = chunk_token_budget or CHUNK_TOKEN_BUDGET
         
-    def analyze_prescription(self, text: str, pages_info: list) -> dict:
-        """Analyze prescription text and extract structured information"""
+    def analyze_prescription(self, pages: list, changed_pages: Optional[Collection[int]] = None) -> dict:
+        """Analyze prescription pages and extract structured information.
+
+        Long documents are split into page windows analyzed concurrently; the medications
+        found in each window are then merged and deduplicated. With `changed_pages`, only
+        the windows containing one of those pages are analyzed.
+        """
         try:
-            prompt = f"""For each medication you find, determine which page it appears on from this page information:
-{pages_info}
-
-Prescription text:
-{text}"""
-
-            messages = [
-                {
-                    "role": "system",
-                    "content": "You are a medical prescription analyzer. Extract structured information from prescriptions. Return ONLY a JSON object using this exact structure: {\"medications\": [{\"name\": \"medication name\", \"dosage\": \"dosage information\", \"frequency\": \"how often to take\", \"start_date\": \"YYYY-MM-DD format\", \"duration\": \"duration in format: X days/weeks/months (only 'days', 'weeks', or 'months' allowed, in English)\", \"duration_raw\": \"verbatim duration exactly as written in the prescription\", \"instructions\": \"additional instructions\", \"page_number\": \"page number where this medication was found (integer)\"}]}."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ]
-            
-            response = self.mistral_client.chat.complete(
-                model="mistral-large-latest",
-                messages=messages,
-                temperature=0.1,
-                top_p=0.1,
-                response_format={"type": "json_object"}
-            )
+            chunks = chunk_pages(pages, token_budget=self.chunk_token_budget)
+            if changed_pages is not None:
+                chunks = chunks_containing(chunks, changed_pages)
+            with ThreadPoolExecutor(max_workers=max(min(len(chunks), MAX_PARALLEL_CHUNKS), 1)) as executor:
+                chunk_results = list(executor.map(self._analyze_chunk, chunks))
             
-            initial_data = json.loads(response.choices[0].message.content)
             processed_data = {"medications": []}
             
-            for med in initial_data.get("medications", []):
+            for med in merge_medications(chunk_results):
                 processed_med = med.copy()
                 
                 if med.get("start_date") and med.get("duration"):
@@ -86,6 +81,97 @@ Prescription text:
         except Exception as e:
             return {"error": f"Error analyzing prescription: {str(e)}"}
 
+    def _analyze_chunk(self, pages: list) -> list:
+        """Extract the medications of a window of pages"""
+        prompt = f"""Prescription text (each page is delimited by <START PAGE n> and <END PAGE n> markers):
+{format_pages_for_prompt(pages)}
+
+For each medication you find, use these markers to determine which page it appears on."""
+
+        messages = [
+            {
+                "role": "system",
+                "content": "You are a medical prescription analyzer. Extract structured information from prescriptions. Return ONLY a JSON object using this exact structure: {\"medications\": [{\"name\": \"medication name\", \"dosage\": \"dosage information\", \"frequency\": \"how often to take\", \"start_date\": \"YYYY-MM-DD format\", \"duration\": \"duration in format: X days/weeks/months (only 'days', 'weeks', or 'months' allowed, in English)\", \"duration_raw\": \"verbatim duration exactly as written in the prescription\", \"instructions\": \"additional instructions\", \"page_number\": \"page number where this medication was found (integer)\"}]}."
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+        
+        content = chat_complete(
+            self.mistral_client,
+            model="mistral-large-latest",
+            messages=messages,
+            temperature=0.1,
+            top_p=0.1,
+            response_format={"type": "json_object"}
+        )
+        
+        medications = json.loads(content).get("medications", [])
+        page_numbers = [page['page_number'] for page in pages]
+        for med in medications:
+            med["page_number"] = resolve_page_number(med.get("page_number"), page_numbers)
+            med["source_page_start"] = page_numbers[0]
+            med["source_page_end"] = page_numbers[-1]
+        return medications
+
+def merge_medications(chunk_results: list) -> list:
+    """Merge the medications found in each page window.
+
+    The same medication found in several windows (overlapping pages, or repeated in the
+    document) is kept once, attributed to its first page; missing details are taken from
+    the duplicates.
+    """
+    merged = {}
+    for medications in chunk_results:
+        for med in medications:
+            if not med.get("name"):
+                continue
+            key = tuple(normalize_value(med.get(field)) for field in ("name", "dosage", "frequency", "start_date"))
+            if key not in merged:
+                merged[key] = med.copy()
+                continue
+            existing = merged[key]
+            if med["page_number"] < existing["page_number"]:
+                for field in ("page_number", "source_page_start", "source_page_end"):
+                    existing[field] = med[field]
+            for field, value in med.items():
+                if value and not existing.get(field):
+                    existing[field] = value
+    return sorted(merged.values(), key=lambda med: med["page_number"])
+
+def medication_fields(med_data: dict) -> dict:
+    """Column values of a Medication row for a medication returned by the agent"""
+    # Parse dates safely
+    start_date = None
+    end_date = None
+    try:
+        if med_data.get('start_date'):
+            start_date = dateutil.parser.parse(med_data['start_date']).date()
+    except (ValueError, TypeError):
+        pass
+        
+    try:
+        if med_data.get('end_date'):
+            end_date = dateutil.parser.parse(med_data['end_date']).date()
+    except (ValueError, TypeError):
+        pass
+    
+    return {
+        'name': med_data['name'],
+        'dosage': med_data.get('dosage'),
+        'frequency': med_data.get('frequency'),
+        'start_date': start_date,
+        'duration': med_data.get('duration'),
+        'duration_raw': med_data.get('duration_raw'),
+        'end_date': end_date,
+        'instructions': med_data.get('instructions'),
+        'page_number': med_data.get('page_number'),
+        'source_page_start': med_data.get('source_page_start'),
+        'source_page_end': med_data.get('source_page_end')
+    }
+
 def process_prescription_analysis(document, prescription_agent, db, PrescriptionAnalysis, Medication):
     """Process prescription analysis for a document and save to database"""
     try:
@@ -105,19 +191,11 @@ def process_prescription_analysis(document, prescription_agent, db, Prescription
                 } for med in document.prescription.medications]
             }
 
-        # Prepare pages info for analysis
-        pages_info = [
-            {
-                'page_number': page.page_number,
-                'content': page.content
-            } for page in document.pages
-        ]
-        
-        # Combine all pages content
-        full_text = "\n".join([page.content for page in document.pages])
+        # Prepare pages for analysis
+        pages = load_page_texts(db, document.id)
         
         # Analyze with prescription agent
-        analysis_result = prescription_agent.analyze_prescription(full_text, pages_info)
+        analysis_result = prescription_agent.analyze_prescription(pages)
         
         if 'error' in analysis_result:
             return analysis_result
@@ -125,41 +203,51 @@ def process_prescription_analysis(document, prescription_agent, db, Prescription
         # Create new prescription analysis
         prescription = PrescriptionAnalysis(document=document)
         db.session.add(prescription)
+        db.session.flush()  # Flush to get the prescription ID
         
-        # Add medications
-        for med_data in analysis_result.get('medications', []):
-            # Parse dates safely
-            start_date = None
-            end_date = None
-            try:
-                if med_data.get('start_date'):
-                    start_date = dateutil.parser.parse(med_data['start_date']).date()
-            except (ValueError, TypeError):
-                pass
-                
-            try:
-                if med_data.get('end_date'):
-                    end_date = dateutil.parser.parse(med_data['end_date']).date()
-            except (ValueError, TypeError):
-                pass
-            
-            medication = Medication(
-                prescription=prescription,
-                name=med_data['name'],
-                dosage=med_data.get('dosage'),
-                frequency=med_data.get('frequency'),
-                start_date=start_date,
-                duration=med_data.get('duration'),
-                duration_raw=med_data.get('duration_raw'),
-                end_date=end_date,
-                instructions=med_data.get('instructions'),
-                page_number=med_data.get('page_number')
-            )
-            db.session.add(medication)
+        # Add medications (one bulk INSERT, committed with the analysis)
+        bulk_insert(db, Medication, [
+            dict(medication_fields(med_data), prescription_id=prescription.id)
+            for med_data in analysis_result.get('medications', [])
+        ])
         
         db.session.commit()
         return analysis_result
         
     except Exception as e:
         db.session.rollback()
-        raise Exception(f"Error processing prescription analysis: {str(e)}") 
\ No newline at end of file
+        raise Exception(f"Error processing prescription analysis: {str(e)}")
+
+def reanalyze_prescription_page(document, page_number, prescription_agent, db, Medication):
+    """Re-extract the page windows containing an edited page and patch the stored medications.
+
+    Returns the number of medications unchanged/updated/added/removed, or None if the
+    document has no prescription analysis.
+    """
+    prescription = document.prescription
+    if not prescription:
+        return None
+
+    try:
+        pages = load_page_texts(db, document.id)
+        changed_pages, covered_pages = reanalysis_scope(prescription.medications, pages, page_number,
+                                                        prescription_agent.chunk_token_budget)
+        analysis_result = prescription_agent.analyze_prescription(pages, changed_pages=changed_pages)
+        if 'error' in analysis_result:
+            raise Exception(analysis_result['error'])
+
+        stale = [med for med in prescription.medications if med.page_number in covered_pages]
+        kept = [med for med in prescription.medications if med.page_number not in covered_pages]
+        counts = patch_rows(
+            db, stale, kept,
+            [medication_fields(med_data) for med_data in analysis_result['medications']],
+            exact_fields=('name', 'dosage', 'frequency', 'start_date'),
+            loose_fields=('name',),
+            create_row=lambda values: Medication(prescription=prescription, **values)
+        )
+        db.session.commit()
+        return counts
+
+    except Exception as e:
+        db.session.rollback()
+        raise Exception(f"Error re-analyzing prescription page {page_number}: {str(e)}")
@@ -0,0 +1,60 @@
+import os
+from typing import List, Dict, Any, Collection
+
+# Long documents are analyzed in windows of consecutive pages, one request per window.
+# Consecutive windows share CHUNK_OVERLAP_PAGES pages so findings spanning a page break
+# are seen whole at least once.
+CHUNK_TOKEN_BUDGET = int(os.getenv('PROMPT_CHUNK_TOKEN_BUDGET', 20000))
+CHUNK_OVERLAP_PAGES = int(os.getenv('PROMPT_CHUNK_OVERLAP_PAGES', 1))
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about 4 characters per token)"""
+    return len(text) // 4 + 1
+
+def format_pages_for_prompt(pages: List[Dict[str, Any]]) -> str:
+    """Concatenate page contents with <START PAGE n>/<END PAGE n> markers.
+
+    The markers let the model attribute findings to pages, so the page contents
+    don't need to be sent a second time as separate page information.
+    """
+    return "\n".join([
+        f"<START PAGE {page['page_number']}>\n{page['content']}\n<END PAGE {page['page_number']}>"
+        for page in pages
+    ])
+
+def chunk_pages(pages: List[Dict[str, Any]], token_budget: int = CHUNK_TOKEN_BUDGET,
+                overlap_pages: int = CHUNK_OVERLAP_PAGES) -> List[List[Dict[str, Any]]]:
+    """Split pages into windows of consecutive pages whose tagged text fits the token budget.
+
+    A page larger than the budget gets a window of its own. Each window starts with the
+    last `overlap_pages` pages of the previous one (but always adds at least one new page).
+    """
+    page_tokens = [estimate_tokens(format_pages_for_prompt([page])) for page in pages]
+    chunks = []
+    start = 0
+    while start < len(pages):
+        end, tokens = start, 0
+        while end < len(pages) and (end == start or tokens + page_tokens[end] <= token_budget):
+            tokens += page_tokens[end]
+            end += 1
+        chunks.append(pages[start:end])
+        if end >= len(pages):
+            break
+        start = max(end - overlap_pages, start + 1)
+    return chunks
+
+def chunks_containing(chunks: List[List[Dict[str, Any]]], page_numbers: Collection[int]) -> List[List[Dict[str, Any]]]:
+    """Return the page windows that include any of the given pages"""
+    return [chunk for chunk in chunks if any(page['page_number'] in page_numbers for page in chunk)]
+
+def resolve_page_number(value: Any, page_numbers: List[int]) -> int:
+    """Return the page number given by the model if it belongs to the chunk, else the chunk's first page"""
+    try:
+        page_number = int(value)
+    except (TypeError, ValueError):
+        return page_numbers[0]
+    return page_number if page_number in page_numbers else page_numbers[0]
+
+def normalize_value(value: Any) -> str:
+    """Normalize an extracted value for deduplication"""
+    return ' '.join(str(value or '').lower().split())
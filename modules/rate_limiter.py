@@ -0,0 +1,217 @@
+import os
+import json
+import time
+import random
+import threading
+from contextlib import contextmanager
+from modules.cache import CACHE_DIR
+
+try:
+    import fcntl  # File locks to share the limiter between worker processes
+except ImportError:  # Windows: the limiter is only shared between threads
+    fcntl = None
+
+# Rate limiting configuration (all Mistral calls share the same account quota)
+MISTRAL_MIN_CONCURRENCY = 1
+MISTRAL_INITIAL_CONCURRENCY = 3
+MISTRAL_MAX_CONCURRENCY = int(os.getenv('MISTRAL_MAX_CONCURRENCY', 8))
+MISTRAL_MIN_RATE = 0.2  # Requests per second
+MISTRAL_MAX_RATE = float(os.getenv('MISTRAL_MAX_REQUESTS_PER_SECOND', 5))
+RATE_INCREASE = 0.1  # Requests per second added after each successful call
+MAX_RETRIES = 5
+BASE_DELAY = 2
+JITTER = 0.1
+MAX_WAIT_STEP = 0.5  # Re-check the shared state at least this often while waiting
+
+def exponential_backoff(retry_count):
+    """Calculate delay with exponential backoff and jitter"""
+    delay = min(BASE_DELAY * (2 ** retry_count), 60)  # Cap at 60 seconds
+    jitter_amount = delay * JITTER
+    return delay + random.uniform(-jitter_amount, jitter_amount)
+
+def is_rate_limit_error(error):
+    """Whether an exception raised by the Mistral client is a 429"""
+    if getattr(error, 'status_code', None) == 429:
+        return True
+    return "429" in str(error)
+
+def get_retry_after(error):
+    """Return the Retry-After delay (seconds) of a 429 error, if the API sent one"""
+    response = getattr(error, 'raw_response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+class AdaptiveRateLimiter:
+    """Token bucket + AIMD concurrency limiter shared by all processes on the host.
+
+    The limiter state (concurrency limit, request rate, tokens, slots in use per process)
+    lives in a JSON file guarded by a file lock. Each successful call additively raises
+    the concurrency limit and the request rate; a 429 halves both and pauses every caller
+    for the Retry-After delay (or an exponential backoff).
+    """
+
+    def __init__(self, name, min_concurrency=MISTRAL_MIN_CONCURRENCY, initial_concurrency=MISTRAL_INITIAL_CONCURRENCY,
+                 max_concurrency=MISTRAL_MAX_CONCURRENCY, min_rate=MISTRAL_MIN_RATE, max_rate=MISTRAL_MAX_RATE,
+                 state_dir=CACHE_DIR):
+        self.name = name
+        self.min_concurrency = min_concurrency
+        self.initial_concurrency = min(initial_concurrency, max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.state_path = os.path.join(state_dir, f"rate_limiter_{name}.json")
+        self.lock_path = f"{self.state_path}.lock"
+        self._thread_lock = threading.Lock()
+        # Per-process counters
+        self.calls = 0
+        self.rate_limited = 0
+        self.errors = 0
+
+    def _default_state(self):
+        initial_rate = min(float(self.initial_concurrency), self.max_rate)
+        return {
+            'limit': float(self.initial_concurrency),
+            'rate': initial_rate,
+            'tokens': max(initial_rate, 1.0),
+            'updated_at': time.time(),
+            'blocked_until': 0.0,
+            'leases': {}
+        }
+
+    @contextmanager
+    def _locked_state(self):
+        with self._thread_lock:
+            os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+            with open(self.lock_path, 'a') as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    try:
+                        with open(self.state_path, 'r') as f:
+                            state = json.load(f)
+                    except (FileNotFoundError, ValueError):
+                        state = self._default_state()
+
+                    yield state
+
+                    temp_path = f"{self.state_path}.{os.getpid()}.tmp"
+                    with open(temp_path, 'w') as f:
+                        json.dump(state, f)
+                    os.replace(temp_path, self.state_path)
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _refill(self, state, now):
+        elapsed = max(now - state['updated_at'], 0)
+        # Allow a burst of at most one second worth of requests
+        state['tokens'] = min(state['tokens'] + elapsed * state['rate'], max(state['rate'], 1.0))
+        state['updated_at'] = now
+
+    def _prune_dead_leases(self, state):
+        # Slots held by processes that died without releasing them
+        state['leases'] = {
+            pid: count for pid, count in state['leases'].items()
+            if count > 0 and _pid_alive(int(pid))
+        }
+
+    def acquire(self):
+        """Block until a call slot and a rate token are available"""
+        pid = str(os.getpid())
+        while True:
+            with self._locked_state() as state:
+                now = time.time()
+                self._refill(state, now)
+                self._prune_dead_leases(state)
+                in_flight = sum(state['leases'].values())
+
+                if now < state['blocked_until']:
+                    delay = state['blocked_until'] - now
+                elif in_flight >= int(state['limit']):
+                    delay = MAX_WAIT_STEP
+                elif state['tokens'] < 1:
+                    delay = (1 - state['tokens']) / state['rate']
+                else:
+                    state['tokens'] -= 1
+                    state['leases'][pid] = state['leases'].get(pid, 0) + 1
+                    return
+            time.sleep(min(delay, MAX_WAIT_STEP) * random.uniform(0.8, 1.2))
+
+    def release(self, outcome='success', retry_after=None, retry_count=0):
+        """Release a call slot and adapt the limits to the outcome ('success', 'rate_limited' or 'error')"""
+        pid = str(os.getpid())
+        with self._locked_state() as state:
+            now = time.time()
+            self._refill(state, now)
+            state['leases'][pid] = max(state['leases'].get(pid, 0) - 1, 0)
+
+            if outcome == 'success':
+                # Additive increase: about +1 concurrent call per `limit` successes
+                state['limit'] = min(state['limit'] + 1.0 / state['limit'], float(self.max_concurrency))
+                state['rate'] = min(state['rate'] + RATE_INCREASE, self.max_rate)
+            elif outcome == 'rate_limited':
+                # Multiplicative decrease and a pause for every caller
+                state['limit'] = max(state['limit'] / 2, float(self.min_concurrency))
+                state['rate'] = max(state['rate'] / 2, self.min_rate)
+                state['tokens'] = min(state['tokens'], 0.0)
+                delay = retry_after if retry_after is not None else exponential_backoff(retry_count)
+                state['blocked_until'] = max(state['blocked_until'], now + delay)
+
+        with self._thread_lock:
+            self.calls += 1
+            if outcome == 'rate_limited':
+                self.rate_limited += 1
+            elif outcome == 'error':
+                self.errors += 1
+
+    def call(self, fn, *args, **kwargs):
+        """Call `fn` through the limiter, retrying on 429 up to MAX_RETRIES times"""
+        retry_count = 0
+        while True:
+            self.acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                if not is_rate_limit_error(e):
+                    self.release('error')
+                    raise
+                retry_count += 1
+                retry_after = get_retry_after(e)
+                self.release('rate_limited', retry_after=retry_after, retry_count=retry_count)
+                if retry_count >= MAX_RETRIES:
+                    raise
+                print(f"[RateLimiter] Rate limit hit, backing off (attempt {retry_count}/{MAX_RETRIES})")
+                continue
+            self.release('success')
+            return result
+
+    def stats(self):
+        """Return the shared limiter state and this process' counters"""
+        with self._locked_state() as state:
+            now = time.time()
+            self._refill(state, now)
+            self._prune_dead_leases(state)
+            return {
+                'concurrency_limit': round(state['limit'], 2),
+                'requests_per_second': round(state['rate'], 2),
+                'in_flight': sum(state['leases'].values()),
+                'blocked_for': round(max(state['blocked_until'] - now, 0), 2),
+                'calls': self.calls,
+                'rate_limited': self.rate_limited,
+                'errors': self.errors
+            }
+
+# Limiter shared by every Mistral call in modules/
+mistral_limiter = AdaptiveRateLimiter('mistral')
@@ -0,0 +1,149 @@
+import json
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import update, select, or_, and_
+from modules.job_queue import POLL_INTERVAL, STALE_JOB_TIMEOUT
+from modules.prescription_processor import reanalyze_prescription_page
+from modules.summarizer_processor import reanalyze_summary_page
+
+def queue_reanalysis(db, ReanalysisJob, document, page_number, requested_by_id):
+    """Queue the re-analysis of an edited page.
+
+    A job still queued for the same page is reused: it reads the page when it runs, so it
+    picks up the latest edit.
+    """
+    job = ReanalysisJob.query.filter_by(document_id=document.id, page_number=page_number, status='queued').first()
+    if job is None:
+        job = ReanalysisJob(document_id=document.id, page_number=page_number, user_id=document.user_id,
+                            requested_by_id=requested_by_id)
+        db.session.add(job)
+        db.session.commit()
+    return job
+
+def serialize_reanalysis(job):
+    """Return the progress report of a re-analysis job"""
+    return {
+        'reanalysis_id': job.id,
+        'document_id': job.document_id,
+        'page_number': job.page_number,
+        'status': job.status,
+        'result': json.loads(job.result) if job.result else None,
+        'error': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
+
+class ReanalysisWorker:
+    """Background thread patching the analyses of a document after a page correction.
+
+    Re-extracting the windows of an edited page takes one LLM request per category and
+    window, too long for the PUT request. Jobs live in the `ReanalysisJob` table and are
+    claimed like processing jobs (see JobWorkerPool), oldest first, skipping the documents
+    that already have a job running so two jobs never patch the same rows.
+    """
+
+    def __init__(self, app, db, ReanalysisJob, Document, Medication, SummaryExtraction, prescription_agent, mistral_client):
+        self.app = app
+        self.db = db
+        self.ReanalysisJob = ReanalysisJob
+        self.Document = Document
+        self.Medication = Medication
+        self.SummaryExtraction = SummaryExtraction
+        self.prescription_agent = prescription_agent
+        self.mistral_client = mistral_client
+        self._lock = threading.Lock()
+        self._thread = None
+        self._wakeup = threading.Event()
+
+    def start(self):
+        """Start the worker thread (idempotent)"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='reanalysis-worker', daemon=True)
+                self._thread.start()
+
+    def notify(self):
+        """Wake up the worker after a job has been queued"""
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            job_id = None
+            try:
+                with self.app.app_context():
+                    try:
+                        job_id = self._claim_next_job()
+                        if job_id:
+                            self._run_job(job_id)
+                    finally:
+                        self.db.session.remove()
+            except Exception as e:
+                print(f"[Reanalysis] Worker error: {str(e)}")
+
+            if not job_id:
+                self._wakeup.wait(POLL_INTERVAL)
+                self._wakeup.clear()
+
+    def _claim_next_job(self):
+        """Atomically move the oldest queued (or abandoned) job to 'running'"""
+        ReanalysisJob = self.ReanalysisJob
+        now = datetime.utcnow()
+        stale_before = now - timedelta(seconds=STALE_JOB_TIMEOUT)
+
+        busy_documents = select(ReanalysisJob.document_id).where(
+            ReanalysisJob.status == 'running', ReanalysisJob.heartbeat_at >= stale_before
+        )
+        candidates = ReanalysisJob.query.filter(
+            or_(
+                ReanalysisJob.status == 'queued',
+                and_(ReanalysisJob.status == 'running', ReanalysisJob.heartbeat_at < stale_before)
+            ),
+            ReanalysisJob.document_id.not_in(busy_documents)
+        ).order_by(ReanalysisJob.id).limit(5).all()
+
+        for job in candidates:
+            # Compare-and-set on the state we read: only one worker wins the job
+            heartbeat_matches = (ReanalysisJob.heartbeat_at.is_(None) if job.heartbeat_at is None
+                                 else ReanalysisJob.heartbeat_at == job.heartbeat_at)
+            result = self.db.session.execute(
+                update(ReanalysisJob)
+                .where(ReanalysisJob.id == job.id, ReanalysisJob.status == job.status, heartbeat_matches)
+                .values(status='running', started_at=now, heartbeat_at=now)
+            )
+            self.db.session.commit()
+            if result.rowcount == 1:
+                return job.id
+        return None
+
+    def _run_job(self, job_id):
+        db = self.db
+        job = self.ReanalysisJob.query.get(job_id)
+        print(f"[Reanalysis] Re-analyzing page {job.page_number} of document {job.document_id}")
+
+        result = {}
+        errors = []
+        document = self.Document.query.get(job.document_id)
+        if document is None:
+            errors.append('Document not found')
+        else:
+            steps = (
+                ('prescription', lambda: reanalyze_prescription_page(
+                    document, job.page_number, self.prescription_agent, db, self.Medication)),
+                ('summary', lambda: reanalyze_summary_page(
+                    document, job.page_number, self.mistral_client, db, self.SummaryExtraction))
+            )
+            for name, reanalyze in steps:
+                try:
+                    result[name] = reanalyze()
+                except Exception as e:
+                    errors.append(str(e))
+                job.heartbeat_at = datetime.utcnow()
+                db.session.commit()
+
+        job.status = 'failed' if errors else 'completed'
+        job.result = json.dumps(result)
+        job.error = '; '.join(errors) or None
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        print(f"[Reanalysis] Job {job.id} {job.status}" + (f": {job.error}" if errors else ''))
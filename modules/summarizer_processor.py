@@ -1,40 +1,130 @@
+import os
 import json
 from datetime import datetime
 import dateutil.parser
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Collection
+from concurrent.futures import ThreadPoolExecutor
+from modules.rate_limiter import mistral_limiter
+from modules.llm_cache import chat_complete
+from modules.prompt_utils import CHUNK_TOKEN_BUDGET, chunk_pages, chunks_containing, estimate_tokens, format_pages_for_prompt, normalize_value, resolve_page_number
+from modules.incremental_analysis import reanalysis_scope, patch_rows
+from modules.persistence import load_page_texts
+
+# Maximum number of template categories analyzed concurrently
+MAX_PARALLEL_CATEGORIES = 7
+
+# Extraction modes: one request per category, or several categories packed in one request
+SUMMARY_MODES = ('per_category', 'packed')
+SUMMARY_EXTRACTION_MODE = os.getenv('SUMMARY_EXTRACTION_MODE', 'per_category')
+# Packed mode: maximum estimated tokens of field descriptions in a single request
+PACKED_FIELDS_TOKEN_BUDGET = int(os.getenv('SUMMARY_PACKED_FIELDS_TOKEN_BUDGET', 1000))
+
+def _fields_description(category: Dict[str, Any]) -> str:
+    return "\n".join([
+        f"- {field['Field']}: {field['Description']} (Example: {field['Example']})"
+        for field in category['fields']
+    ])
+
+def partition_categories(categories: List[tuple], token_budget: int = PACKED_FIELDS_TOKEN_BUDGET) -> List[List[tuple]]:
+    """Group consecutive (name, category) pairs so each group's field descriptions fit the token budget"""
+    groups = []
+    current, current_tokens = [], 0
+    for category_name, category in categories:
+        tokens = estimate_tokens(f"Category: {category_name}\n" + _fields_description(category))
+        if current and current_tokens + tokens > token_budget:
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append((category_name, category))
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+    return groups
 
 class SummarizerAgent:
-    def __init__(self, mistral_client):
+    def __init__(self, mistral_client, mode: Optional[str] = None, chunk_token_budget: Optional[int] = None):
         self.mistral_client = mistral_client
+        self.chunk_token_budget = chunk_token_budget or CHUNK_TOKEN_BUDGET
+        self.mode = mode or SUMMARY_EXTRACTION_MODE
+        if self.mode not in SUMMARY_MODES:
+            raise ValueError(f"Unknown summary extraction mode: {self.mode}")
         self.template = self._load_template()
     
     def _load_template(self) -> List[Dict[str, Any]]:
         with open('modules/SeekerTemplate.json', 'r') as f:
             return json.load(f)
     
-    def analyze_document(self, text: str, pages_info: list) -> List[Dict[str, Any]]:
-        """Analyze document text and extract structured information based on template"""
+    def analyze_document(self, pages: List[Dict[str, Any]], changed_pages: Optional[Collection[int]] = None) -> List[Dict[str, Any]]:
+        """Analyze document pages and extract structured information based on template.
+
+        Long documents are split into page windows; every category (or group of categories)
+        is extracted from every window, and the findings are merged and deduplicated. With
+        `changed_pages`, only the windows containing one of those pages are analyzed, and a failed
+        request raises: the caller patches stored rows with the result, and a missing
+        category would be taken for findings that disappeared.
+        """
         print("\n🔍 Starting document analysis...")
-        all_extractions = []
         
-        for category_name, category in self.template.items():
-            # Skip categories that aren't version 1.0
-            if category.get('version') != '1.0':
-                continue
+        # Skip categories that aren't version 1.0
+        categories = [
+            (category_name, category) for category_name, category in self.template.items()
+            if category.get('version') == '1.0'
+        ]
+        
+        # One request per category (or per group of categories in packed mode), sent
+        # concurrently; the shared rate limiter bounds the actual number of calls in flight
+        if self.mode == 'packed':
+            tasks = [(self._analyze_category_group, group) for group in partition_categories(categories)]
+        else:
+            tasks = [(self._analyze_category, *category) for category in categories]
+        
+        chunks = chunk_pages(pages, token_budget=self.chunk_token_budget)
+        if changed_pages is not None:
+            chunks = chunks_containing(chunks, changed_pages)
+        if len(chunks) > 1:
+            print(f"📚 Document split into {len(chunks)} page windows")
+        
+        all_extractions = []
+        failed_requests = 0
+        requests = [(task, chunk) for task in tasks for chunk in chunks]
+        max_workers = min(len(requests), max(MAX_PARALLEL_CATEGORIES, mistral_limiter.max_concurrency))
+        with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+            futures = [
+                (executor.submit(task[0], *task[1:], format_pages_for_prompt(chunk)), chunk)
+                for task, chunk in requests
+            ]
+            # Merge in template order, whatever the completion order
+            for future, chunk in futures:
+                page_numbers = [page['page_number'] for page in chunk]
+                extractions = future.result()
+                if extractions is None:
+                    failed_requests += 1
+                    continue
+                for extraction in extractions:
+                    extraction['page_number'] = resolve_page_number(extraction['page_number'], page_numbers)
+                    extraction['source_page_start'] = page_numbers[0]
+                    extraction['source_page_end'] = page_numbers[-1]
+                    all_extractions.append(extraction)
+        if failed_requests and changed_pages is not None:
+            raise ValueError(f"{failed_requests} of {len(requests)} extraction requests failed")
+        all_extractions = merge_extractions(all_extractions)
                 
-            print(f"\n📑 Processing category: {category_name}")
-            fields_description = "\n".join([
-                f"- {field['Field']}: {field['Description']} (Example: {field['Example']})"
-                for field in category['fields']
-            ])
-            print("\n📋 Fields to extract:")
-            print(fields_description)
-            print(f"🔎 Analyzing {len(category['fields'])} fields in {category_name}")
-            
-            # Create a set of valid fields for this category
-            valid_fields = {field['Field'] for field in category['fields']}
-            
-            prompt = f"""Analyze this medical document and extract information according to these fields:
+        print(f"\n✅ Analysis complete! Extracted {len(all_extractions)} total items across all categories")
+        print(f"📦 Final extractions: {json.dumps(all_extractions, indent=2)}")  # Added debug
+        return all_extractions
+    
+    def _analyze_category(self, category_name: str, category: Dict[str, Any], text: str) -> Optional[List[Dict[str, Any]]]:
+        """Extract the fields of one template category. Errors are logged and return None."""
+        extractions = []
+        print(f"\n📑 Processing category: {category_name}")
+        fields_description = _fields_description(category)
+        print("\n📋 Fields to extract:")
+        print(fields_description)
+        print(f"🔎 Analyzing {len(category['fields'])} fields in {category_name}")
+        
+        # Create a set of valid fields for this category
+        valid_fields = {field['Field'] for field in category['fields']}
+        
+        prompt = f"""Analyze this medical document and extract information according to these fields:
 Only extract information for these specific fields. Do not extract any additional fields or information beyond what is listed here:
 For each field, I will only extract information that matches EXACTLY these field names:
 {fields_description}
@@ -52,11 +142,10 @@ IMPORTANT INSTRUCTIONS:
 - For 'associated_date', only include if you find an actual date in the document related to the exam, procedure, or document creation.
 - If you're unsure about a value, it's better to not include it than to guess.
 
-Document content:
+Document content (each page is delimited by <START PAGE n> and <END PAGE n> markers):
 {text}
 
-For each piece of information you find, determine which page it appears on from this page information:
-{json.dumps(pages_info, indent=2)}
+For each piece of information you find, use these markers to determine which page it appears on.
 
 Return ONLY a JSON array using this structure:
 [
@@ -68,114 +157,215 @@ Return ONLY a JSON array using this structure:
     }}
 ]"""
 
+        try:
+            print(f"🤖 Sending request to Mistral AI for {category_name}...")
+            content = chat_complete(
+                self.mistral_client,
+                model="mistral-large-latest",
+                messages=[
+                    {"role": "system", "content": "You are a medical document analyzer. Extract structured information from medical documents."},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.1,
+                top_p=0.1,
+                response_format={"type": "json_object"}
+            )
+            
+            print(f"✅ Received response for {category_name}")
+            print(f"📝 Raw response: {content[:200]}...")  # Print first 200 chars of response
+            
             try:
-                print(f"🤖 Sending request to Mistral AI for {category_name}...")
-                response = self.mistral_client.chat.complete(
-                    model="mistral-large-latest",
-                    messages=[
-                        {"role": "system", "content": "You are a medical document analyzer. Extract structured information from medical documents."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.1,
-                    top_p=0.1,
-                    response_format={"type": "json_object"}
-                )
-                
-                content = response.choices[0].message.content
-                print(f"✅ Received response for {category_name}")
-                print(f"📝 Raw response: {content[:200]}...")  # Print first 200 chars of response
+                findings = json.loads(content)
+                print(f"✨ Successfully parsed JSON for {category_name}")
+                print(f"🔍 Raw findings structure: {json.dumps(findings, indent=2)}")  # Added debug
                 
-                try:
-                    findings = json.loads(content)
-                    print(f"✨ Successfully parsed JSON for {category_name}")
-                    print(f"🔍 Raw findings structure: {json.dumps(findings, indent=2)}")  # Added debug
+                if not isinstance(findings, list):
+                    print(f"❌ Expected findings to be a list, got {type(findings)}")
+                    return None
                     
-                    if not isinstance(findings, list):
-                        print(f"❌ Expected findings to be a list, got {type(findings)}")
-                        continue
-                        
-                    print(f"📊 Found {len(findings)} findings for {category_name}")
-                    for finding in findings:
-                        print(f"🔎 Processing finding: {json.dumps(finding, indent=2)}")  # Added debug
-                        
-                        if not finding.get('value'):
-                            print(f"⚠️ Skipping finding without value: {finding}")
-                            continue
-                            
-                        # Validate that the field exists in the template for this category
-                        field_name = finding.get('field')
-                        if field_name not in valid_fields:
-                            print(f"⚠️ Skipping invalid field '{field_name}' for category '{category_name}'")
-                            continue
-                            
-                        value = finding['value']
-                        # Handle both string and list/dict values
-                        if isinstance(value, (list, dict)):
-                            processed_value = json.dumps(value)  # Convert lists/dicts to JSON string
-                        else:
-                            processed_value = value.strip() if isinstance(value, str) else str(value)
-                        
-                        print(f"   🏷️  Field: {field_name}")
-                        print(f"   📄 Value: {processed_value}")
-                        print(f"   📃 Page: {finding.get('page_number', 1)}")
-
-                        # Parse and validate dates
-                        associated_date = None
-                        try:
-                            if finding.get('associated_date'):
-                                associated_date = dateutil.parser.parse(finding['associated_date']).strftime("%Y-%m-%d")
-                                print(f"   📅 Date: {associated_date}")
-                        except (ValueError, TypeError) as e:
-                            print(f"   ⚠️  Invalid date format: {finding.get('associated_date')}")
-                            print(f"   ⚠️  Date error details: {str(e)}")
-                            pass
-
-                        extraction = {
-                            'category': category_name,
-                            'field': field_name,
-                            'value': processed_value,
-                            'page_number': finding.get('page_number', 1),
-                            'associated_date': associated_date,
-                            'extraction_date': datetime.utcnow().isoformat()
-                        }
-                        print(f"   ✅ Created extraction: {json.dumps(extraction, indent=2)}")
-                        all_extractions.append(extraction)
-                except json.JSONDecodeError as je:
-                    print(f"❌ Error decoding JSON for category {category_name}: {str(je)}")
-                    print(f"❌ Raw content causing error: {content}")
+                print(f"📊 Found {len(findings)} findings for {category_name}")
+                for finding in findings:
+                    extraction = self._build_extraction(category_name, valid_fields, finding)
+                    if extraction:
+                        extractions.append(extraction)
+            except json.JSONDecodeError as je:
+                print(f"❌ Error decoding JSON for category {category_name}: {str(je)}")
+                print(f"❌ Raw content causing error: {content}")
+                return None
+                    
+        except Exception as e:
+            print(f"❌ Error processing category {category_name}: {str(e)}")
+            print(f"❌ Error type: {type(e).__name__}")
+            print(f"❌ Full error details: {str(e)}")
+            return None
+            
+        return extractions
+
+    def _analyze_category_group(self, group: List[tuple], text: str) -> Optional[List[Dict[str, Any]]]:
+        """Extract the fields of several template categories with a single request (packed mode).
+        Errors are logged and return None."""
+        extractions = []
+        group_names = [category_name for category_name, _ in group]
+        print(f"\n📑 Processing categories (packed): {', '.join(group_names)}")
+        
+        categories_description = "\n\n".join([
+            f"Category: {category_name}\n" + _fields_description(category)
+            for category_name, category in group
+        ])
+        valid_fields = {
+            category_name: {field['Field'] for field in category['fields']}
+            for category_name, category in group
+        }
+        
+        prompt = f"""Analyze this medical document and extract information according to these categories and fields:
+Only extract information for these specific categories and fields. Do not extract any additional fields or information beyond what is listed here:
+{categories_description}
+
+DO NOT create or invent any category or field names that are not in the list above. Only use the exact names provided.
+
+For example, if looking for "Full Name" field, do not output "Patient Name" or "Name" - it must be exactly "Full Name".
+
+The category and field names must match PRECISELY what is specified in the template, including capitalization.
+
+
+IMPORTANT INSTRUCTIONS:
+- Only extract information that is EXPLICITLY present in the document. Do not make assumptions or hallucinate values.
+- It's perfectly acceptable to not find all fields - only return fields you find with high confidence.
+- For 'associated_date', only include if you find an actual date in the document related to the exam, procedure, or document creation.
+- If you're unsure about a value, it's better to not include it than to guess.
+
+Document content (each page is delimited by <START PAGE n> and <END PAGE n> markers):
+{text}
+
+For each piece of information you find, use these markers to determine which page it appears on.
+
+Return ONLY a JSON object using this structure:
+{{
+    "extractions": [
+        {{
+            "category": "category name",
+            "field": "Field Name",
+            "value": "Extracted Value",
+            "page_number": page_number,
+            "associated_date": "YYYY-MM-DD" // only if a relevant date is found in the document
+        }}
+    ]
+}}"""
+
+        try:
+            print(f"🤖 Sending packed request to Mistral AI for {len(group)} categories...")
+            content = chat_complete(
+                self.mistral_client,
+                model="mistral-large-latest",
+                messages=[
+                    {"role": "system", "content": "You are a medical document analyzer. Extract structured information from medical documents."},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.1,
+                top_p=0.1,
+                response_format={"type": "json_object"}
+            )
+            
+            findings = json.loads(content)
+            if isinstance(findings, dict):
+                findings = findings.get('extractions', [])
+            if not isinstance(findings, list):
+                print(f"❌ Expected findings to be a list, got {type(findings)}")
+                return None
+            
+            print(f"📊 Found {len(findings)} findings for {', '.join(group_names)}")
+            for finding in findings:
+                category_name = finding.get('category')
+                if category_name not in valid_fields:
+                    print(f"⚠️ Skipping finding for unexpected category '{category_name}'")
                     continue
-                        
-            except Exception as e:
-                print(f"❌ Error processing category {category_name}: {str(e)}")
-                print(f"❌ Error type: {type(e).__name__}")
-                print(f"❌ Full error details: {str(e)}")
-                continue
-                
-        print(f"\n✅ Analysis complete! Extracted {len(all_extractions)} total items across all categories")
-        print(f"📦 Final extractions: {json.dumps(all_extractions, indent=2)}")  # Added debug
-        return all_extractions
+                extraction = self._build_extraction(category_name, valid_fields[category_name], finding)
+                if extraction:
+                    extractions.append(extraction)
+        
+        except Exception as e:
+            print(f"❌ Error processing categories {', '.join(group_names)}: {str(e)}")
+            print(f"❌ Error type: {type(e).__name__}")
+            return None
+        
+        # Keep template order within the group
+        order = {category_name: index for index, category_name in enumerate(group_names)}
+        return sorted(extractions, key=lambda extraction: order[extraction['category']])
+    
+    def _build_extraction(self, category_name: str, valid_fields: set, finding: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Validate a finding returned by the model and turn it into an extraction"""
+        print(f"🔎 Processing finding: {json.dumps(finding, indent=2)}")  # Added debug
+        
+        if not finding.get('value'):
+            print(f"⚠️ Skipping finding without value: {finding}")
+            return None
+            
+        # Validate that the field exists in the template for this category
+        field_name = finding.get('field')
+        if field_name not in valid_fields:
+            print(f"⚠️ Skipping invalid field '{field_name}' for category '{category_name}'")
+            return None
+            
+        value = finding['value']
+        # Handle both string and list/dict values
+        if isinstance(value, (list, dict)):
+            processed_value = json.dumps(value)  # Convert lists/dicts to JSON string
+        else:
+            processed_value = value.strip() if isinstance(value, str) else str(value)
+        
+        print(f"   🏷️  Field: {field_name}")
+        print(f"   📄 Value: {processed_value}")
+        print(f"   📃 Page: {finding.get('page_number', 1)}")
+
+        # Parse and validate dates
+        associated_date = None
+        try:
+            if finding.get('associated_date'):
+                associated_date = dateutil.parser.parse(finding['associated_date']).strftime("%Y-%m-%d")
+                print(f"   📅 Date: {associated_date}")
+        except (ValueError, TypeError) as e:
+            print(f"   ⚠️  Invalid date format: {finding.get('associated_date')}")
+            print(f"   ⚠️  Date error details: {str(e)}")
+
+        extraction = {
+            'category': category_name,
+            'field': field_name,
+            'value': processed_value,
+            'page_number': finding.get('page_number', 1),
+            'associated_date': associated_date,
+            'extraction_date': datetime.utcnow().isoformat()
+        }
+        print(f"   ✅ Created extraction: {json.dumps(extraction, indent=2)}")
+        return extraction
 
-def process_document_summary(document_pages: List[Dict[str, str]], mistral_client) -> Dict[str, Any]:
+def merge_extractions(extractions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Deduplicate the findings of overlapping page windows.
+
+    Findings with the same category, field and value are kept once, at their first
+    position and with the lowest page number; a missing associated_date is taken from
+    a duplicate.
+    """
+    merged = {}
+    for extraction in extractions:
+        key = (extraction['category'], extraction['field'], normalize_value(extraction['value']))
+        if key not in merged:
+            merged[key] = extraction
+            continue
+        existing = merged[key]
+        if extraction['page_number'] < existing['page_number']:
+            for field in ('page_number', 'source_page_start', 'source_page_end'):
+                existing[field] = extraction[field]
+        if not existing.get('associated_date'):
+            existing['associated_date'] = extraction.get('associated_date')
+    return list(merged.values())
+
+def process_document_summary(document_pages: List[Dict[str, str]], mistral_client, mode: Optional[str] = None) -> Dict[str, Any]:
     """Process a document and extract medical information based on the template."""
     try:
-        agent = SummarizerAgent(mistral_client)
-        
-        # Prepare pages info
-        pages_info = [
-            {
-                'page_number': page['page_number'],
-                'content': page['content']
-            } for page in document_pages
-        ]
-        
-        # Combine all pages content with page markers
-        full_text = "\n".join([
-            f"<START PAGE {page['page_number']}>\n{page['content']}\n<END PAGE {page['page_number']}>"
-            for page in document_pages
-        ])
+        agent = SummarizerAgent(mistral_client, mode=mode)
         
         # Process with summarizer agent
-        extractions = agent.analyze_document(full_text, pages_info)
+        extractions = agent.analyze_document(document_pages)
         
         return {
             'extractions': extractions,
@@ -183,4 +373,58 @@ def process_document_summary(document_pages: List[Dict[str, str]], mistral_clien
         }
         
     except Exception as e:
-        return {'error': f"Error in process_document_summary: {str(e)}"} 
\ No newline at end of file
+        return {'error': f"Error in process_document_summary: {str(e)}"}
+
+def extraction_fields(extraction: Dict[str, Any]) -> Dict[str, Any]:
+    """Column values of a SummaryExtraction row for an extraction returned by the agent"""
+    associated_date = None
+    if extraction.get('associated_date'):
+        try:
+            associated_date = dateutil.parser.parse(extraction['associated_date']).date()
+        except (ValueError, TypeError) as e:
+            print(f"⚠️ Error parsing date: {str(e)}")
+    
+    return {
+        'category': extraction['category'],
+        'field': extraction['field'],
+        'value': extraction['value'],
+        'page_number': extraction['page_number'],
+        'associated_date': associated_date,
+        'extraction_date': dateutil.parser.parse(extraction['extraction_date']),
+        'source_page_start': extraction.get('source_page_start'),
+        'source_page_end': extraction.get('source_page_end')
+    }
+
+def reanalyze_summary_page(document, page_number: int, mistral_client, db, SummaryExtraction, mode: Optional[str] = None) -> Optional[Dict[str, int]]:
+    """Re-extract the page windows containing an edited page and patch the stored summary.
+
+    Returns the number of extractions unchanged/updated/added/removed, or None if the
+    document has no summary.
+    """
+    summary = document.summary
+    if not summary:
+        return None
+    
+    try:
+        print(f"\n🔄 Re-analyzing page {page_number} of document {document.id}")
+        pages = load_page_texts(db, document.id)
+        agent = SummarizerAgent(mistral_client, mode=mode)
+        changed_pages, covered_pages = reanalysis_scope(summary.extractions, pages, page_number, agent.chunk_token_budget)
+        extractions = agent.analyze_document(pages, changed_pages=changed_pages)
+        
+        stale = [ext for ext in summary.extractions if ext.page_number in covered_pages]
+        kept = [ext for ext in summary.extractions if ext.page_number not in covered_pages]
+        counts = patch_rows(
+            db, stale, kept,
+            [extraction_fields(extraction) for extraction in extractions],
+            exact_fields=('category', 'field', 'value'),
+            loose_fields=('category', 'field'),
+            create_row=lambda values: SummaryExtraction(summary_id=summary.id, **values)
+        )
+        db.session.commit()
+        print(f"✅ Summary patched: {counts}")
+        return counts
+        
+    except Exception as e:
+        db.session.rollback()
+        raise Exception(f"Error re-analyzing summary page {page_number}: {str(e)}")
@@ -1,12 +1,39 @@
-from flask import jsonify, request, send_file
+from flask import jsonify, request, url_for
 from io import BytesIO
 import base64
 from datetime import datetime
 import dateutil.parser
+import os
+import uuid
+import zipfile
 from flask_login import current_user
 from models import Patient
+from modules.persistence import delete_documents
+from modules.job_queue import save_upload, save_upload_stream, count_pdf_pages, serialize_job, serialize_batch
+from modules.image_store import image_path, image_mimetype
+from modules.http_cache import cached_json, cached_image
+from modules.page_previews import IMAGE_SIZES, preview_refs
+from modules.reanalysis_queue import queue_reanalysis, serialize_reanalysis
 
-def init_document_routes(app, db, Document, Page, process_pdf_document, mistral_client):
+# Pagination of document pages
+DEFAULT_PAGE_LIMIT = 50
+MAX_PAGE_LIMIT = 200
+PAGE_FIELDS = ('page_number', 'content', 'content_source', 'image_url', 'screen_url', 'thumb_url')
+IMAGE_URL_FIELDS = {'image_url': 'full', 'screen_url': 'screen', 'thumb_url': 'thumb'}
+
+# Batch uploads: number of PDFs, uncompressed size of a PDF taken from a zip archive,
+# and total size of the PDFs of a batch (zip archives can inflate far beyond the upload)
+MAX_BATCH_FILES = int(os.getenv('MAX_BATCH_FILES', 200))
+MAX_BATCH_FILE_BYTES = int(os.getenv('MAX_BATCH_FILE_BYTES', 50 * 1024 * 1024))
+MAX_BATCH_BYTES = int(os.getenv('MAX_BATCH_BYTES', 500 * 1024 * 1024))
+
+def image_url(doc_id, page_number, image_ref, size='full'):
+    """URL of a page image, versioned with its content hash when it is in the image store"""
+    version = image_ref.split('.', 1)[0] if image_ref else None
+    return url_for('get_page_image', doc_id=doc_id, page_number=page_number,
+                   size=size if size != 'full' else None, v=version)
+
+def init_document_routes(app, db, Document, Page, ProcessingJob, job_workers, ReanalysisJob, reanalysis_worker):
     @app.route('/api/documents', methods=['GET'])
     def get_documents():
         """Get all documents with role-based filtering"""
@@ -36,28 +63,99 @@ def init_document_routes(app, db, Document, Page, process_pdf_document, mistral_
 
     @app.route('/api/documents/<int:doc_id>', methods=['GET'])
     def get_document(doc_id):
-        """Get a specific document with its pages"""
+        """Get a specific document with a window of its pages.
+
+        Query parameters:
+        - cursor: return pages after this page number (use `next_cursor` from the previous response)
+        - offset: alternatively, number of pages to skip
+        - limit: number of pages to return (default 50, max 200, 0 for document metadata only)
+        - fields: comma separated page fields among page_number, content, content_source,
+          image_url, screen_url, thumb_url (full image and previews, see get_page_image)
+        """
         document = Document.query.get_or_404(doc_id)
-        return jsonify({
+        
+        try:
+            limit = min(max(int(request.args.get('limit', DEFAULT_PAGE_LIMIT)), 0), MAX_PAGE_LIMIT)
+            offset = max(int(request.args.get('offset', 0)), 0)
+            cursor = request.args.get('cursor', type=int)
+        except ValueError:
+            return jsonify({'error': 'limit and offset must be integers'}), 400
+        
+        fields = set(request.args.get('fields', ','.join(PAGE_FIELDS)).split(','))
+        fields = {field.strip() for field in fields if field.strip()}
+        unknown_fields = fields - set(PAGE_FIELDS)
+        if unknown_fields:
+            return jsonify({'error': f"Unknown fields: {', '.join(sorted(unknown_fields))}"}), 400
+        
+        # Only select the columns we need: never the image payloads
+        columns = [Page.page_number]
+        if 'content' in fields:
+            columns.append(Page.content)
+        if 'content_source' in fields:
+            columns.append(Page.content_source)
+        image_fields = [field for field in IMAGE_URL_FIELDS if field in fields]
+        if image_fields:
+            columns.extend([Page.image_ref, Page.screen_ref, Page.thumb_ref])
+            columns.append((Page.image_ref.isnot(None) | Page.image_data.isnot(None)).label('has_image'))
+        
+        query = db.session.query(*columns).filter(Page.document_id == doc_id)
+        if cursor is not None:
+            query = query.filter(Page.page_number > cursor)
+        rows = query.order_by(Page.page_number).offset(offset).limit(limit + 1).all() if limit else []
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        
+        pages = []
+        for row in rows:
+            page = {}
+            if 'page_number' in fields:
+                page['page_number'] = row.page_number
+            if 'content' in fields:
+                page['content'] = row.content
+            if 'content_source' in fields:
+                page['content_source'] = row.content_source
+            if image_fields:
+                refs = preview_refs(row)
+                for field in image_fields:
+                    size = IMAGE_URL_FIELDS[field]
+                    page[field] = image_url(doc_id, row.page_number, refs[size], size) if row.has_image else None
+            pages.append(page)
+        
+        return cached_json({
             'id': document.id,
             'filename': document.filename,
             'upload_date': document.upload_date.isoformat(),
             'total_pages': document.total_pages,
-            'pages': [{
-                'page_number': page.page_number,
-                'content': page.content,
-                'image_data': page.image_data
-            } for page in document.pages]
+            'pages': pages,
+            'has_more': has_more,
+            'next_cursor': rows[-1].page_number if has_more else None
         })
 
     @app.route('/api/documents/<int:doc_id>', methods=['DELETE'])
     def delete_document(doc_id):
         """Delete a document"""
         document = Document.query.get_or_404(doc_id)
-        db.session.delete(document)
+        # Set-based delete: pages and their images are never loaded
+        delete_documents(db, [document.id])
         db.session.commit()
         return jsonify({'message': 'Document deleted successfully'})
 
+    def resolve_upload_owner():
+        """Return (user_id of the documents' owner, None) or (None, error response) for an upload"""
+        # Vérifier le patient_id pour les médecins
+        if current_user.role == 'medecin':
+            patient_id = request.form.get('patient_id')
+            if not patient_id:
+                return None, (jsonify({'status': 'error', 'error': 'Patient ID is required'}), 400)
+                
+            # Vérifier que le patient appartient bien au médecin
+            patient = Patient.query.filter_by(id=patient_id, doctor_id=current_user.id).first()
+            if not patient:
+                return None, (jsonify({'status': 'error', 'error': 'Invalid patient ID'}), 403)
+                
+            return patient.user_id, None
+        return current_user.id, None
+
     @app.route('/api/process-pdf', methods=['POST'])
     def process_pdf():
         try:
@@ -71,51 +169,221 @@ def init_document_routes(app, db, Document, Page, process_pdf_document, mistral_
             if not file.filename.lower().endswith('.pdf'):
                 return jsonify({'status': 'error', 'error': 'File must be a PDF'}), 400
 
-            # Vérifier le patient_id pour les médecins
-            if current_user.role == 'medecin':
-                patient_id = request.form.get('patient_id')
-                if not patient_id:
-                    return jsonify({'status': 'error', 'error': 'Patient ID is required'}), 400
-                    
-                # Vérifier que le patient appartient bien au médecin
-                patient = Patient.query.filter_by(id=patient_id, doctor_id=current_user.id).first()
-                if not patient:
-                    return jsonify({'status': 'error', 'error': 'Invalid patient ID'}), 403
-                    
-                user_id = patient.user_id
-            else:
-                user_id = current_user.id
+            user_id, error = resolve_upload_owner()
+            if error:
+                return error
 
-            result = process_pdf_document(file, db, Document, Page, mistral_client, user_id)
+            # Queue the OCR run; a background worker processes it page by page. The page
+            # count decides whether the job goes to the priority lane.
+            file_path = save_upload(file, app.config['UPLOAD_FOLDER'])
+            job = ProcessingJob(
+                filename=file.filename,
+                file_path=file_path,
+                user_id=user_id,
+                requested_by_id=current_user.id,
+                total_pages=count_pdf_pages(file_path)
+            )
+            db.session.add(job)
+            db.session.commit()
             
-            if result.get('status') == 'error':
-                return jsonify(result), 500
-                
-            return jsonify(result), 200
+            job_workers.start()
+            job_workers.notify()
+            
+            return jsonify(serialize_job(job)), 202
 
         except Exception as e:
+            db.session.rollback()
             return jsonify({'status': 'error', 'error': str(e)}), 500
 
+    @app.route('/api/process-pdf/batch', methods=['POST'])
+    def process_pdf_batch():
+        """Queue many PDFs (files and/or zip archives of PDFs) for the same patient"""
+        try:
+            files = [file for file in request.files.getlist('files') + request.files.getlist('file') if file.filename]
+            if not files:
+                return jsonify({'status': 'error', 'error': 'No file provided'}), 400
+
+            user_id, error = resolve_upload_owner()
+            if error:
+                return error
+
+            # Every PDF becomes its own job; the jobs share a batch id for progress reporting
+            batch_id = uuid.uuid4().hex
+            jobs = []
+            rejected = []
+            batch_bytes = 0
+
+            def queue_pdf(filename, save):
+                nonlocal batch_bytes
+                if len(jobs) >= MAX_BATCH_FILES:
+                    raise ValueError(f'At most {MAX_BATCH_FILES} PDFs per batch')
+                job = ProcessingJob(
+                    filename=filename,
+                    file_path=save(app.config['UPLOAD_FOLDER']),
+                    user_id=user_id,
+                    requested_by_id=current_user.id,
+                    batch_id=batch_id
+                )
+                db.session.add(job)
+                jobs.append(job)
+                batch_bytes += os.path.getsize(job.file_path)
+                check_batch_size(0)
+
+            def check_batch_size(extra_bytes):
+                if batch_bytes + extra_bytes > MAX_BATCH_BYTES:
+                    raise ValueError(f'At most {MAX_BATCH_BYTES // (1024 * 1024)} MB of PDFs per batch')
+
+            def discard_uploads():
+                db.session.rollback()
+                for job in jobs:
+                    try:
+                        os.unlink(job.file_path)
+                    except OSError:
+                        pass
+
+            try:
+                for file in files:
+                    name = file.filename.lower()
+                    if name.endswith('.pdf'):
+                        queue_pdf(file.filename, lambda folder: save_upload(file, folder))
+                    elif name.endswith('.zip'):
+                        try:
+                            with zipfile.ZipFile(file.stream) as archive:
+                                for entry in archive.infolist():
+                                    entry_name = os.path.basename(entry.filename)
+                                    if entry.is_dir() or entry.filename.startswith('__MACOSX/') or not entry_name:
+                                        continue
+                                    if not entry_name.lower().endswith('.pdf'):
+                                        rejected.append({'filename': entry.filename, 'error': 'File must be a PDF'})
+                                        continue
+                                    if entry.file_size > MAX_BATCH_FILE_BYTES:
+                                        rejected.append({'filename': entry.filename,
+                                                         'error': f'File larger than {MAX_BATCH_FILE_BYTES // (1024 * 1024)} MB'})
+                                        continue
+                                    check_batch_size(entry.file_size)
+                                    # The declared size is enforced while inflating
+                                    with archive.open(entry) as stream:
+                                        queue_pdf(entry_name, lambda folder: save_upload_stream(stream, folder, max_bytes=entry.file_size))
+                        except zipfile.BadZipFile:
+                            rejected.append({'filename': file.filename, 'error': 'Invalid zip archive'})
+                    else:
+                        rejected.append({'filename': file.filename, 'error': 'File must be a PDF or a zip of PDFs'})
+
+                if not jobs:
+                    return jsonify({'status': 'error', 'error': 'No PDF found in the upload', 'rejected': rejected}), 400
+
+                db.session.commit()
+            except ValueError as e:
+                discard_uploads()
+                return jsonify({'status': 'error', 'error': str(e)}), 400
+            except Exception:
+                # Don't leave the PDFs saved so far behind
+                discard_uploads()
+                raise
+
+            print(f"[Jobs] Queued batch {batch_id} ({len(jobs)} PDFs)")
+
+            job_workers.start()
+            job_workers.notify()
+
+            return jsonify(dict(serialize_batch(batch_id, jobs), rejected=rejected)), 202
+
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'status': 'error', 'error': str(e)}), 500
+
+    @app.route('/api/batches/<batch_id>', methods=['GET'])
+    def get_batch(batch_id):
+        """Get the progress of a batch upload and of each of its files"""
+        try:
+            jobs = ProcessingJob.query.filter_by(batch_id=batch_id).order_by(ProcessingJob.id).all()
+            if not jobs:
+                return jsonify({'error': 'Batch not found'}), 404
+            if current_user.id not in (jobs[0].requested_by_id, jobs[0].user_id):
+                return jsonify({'error': 'Access denied'}), 403
+
+            job_workers.start()
+
+            return jsonify(serialize_batch(batch_id, jobs))
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/api/jobs/<int:job_id>', methods=['GET'])
+    def get_job(job_id):
+        """Get the progress of a PDF processing job"""
+        try:
+            job = ProcessingJob.query.get_or_404(job_id)
+            if current_user.id not in (job.requested_by_id, job.user_id):
+                return jsonify({'error': 'Access denied'}), 403
+            
+            # Make sure jobs left in the queue (e.g. after a restart) get picked up
+            job_workers.start()
+            
+            return jsonify(serialize_job(job))
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/api/reanalysis/<int:reanalysis_id>', methods=['GET'])
+    def get_reanalysis(reanalysis_id):
+        """Get the progress of the re-analysis queued by a page correction"""
+        job = ReanalysisJob.query.get_or_404(reanalysis_id)
+        try:
+            if current_user.id not in (job.requested_by_id, job.user_id):
+                return jsonify({'error': 'Access denied'}), 403
+            
+            # Make sure jobs left in the queue (e.g. after a restart) get picked up
+            reanalysis_worker.start()
+            
+            return jsonify(serialize_reanalysis(job))
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
     @app.route('/api/documents/<int:doc_id>/pages/<int:page_number>/image', methods=['GET'])
     def get_page_image(doc_id, page_number):
-        """Get the image data for a specific page of a document"""
+        """Get the image data for a specific page of a document.
+
+        Query parameters:
+        - size: thumb, screen or full (default), served from the previews made at ingest;
+          pages without previews get the full image
+        """
+        size = request.args.get('size', 'full')
+        if size not in IMAGE_SIZES:
+            return jsonify({'error': f"size must be one of {', '.join(IMAGE_SIZES)}"}), 400
+        # 404 as well when the document doesn't exist
+        page = Page.query.filter_by(document_id=doc_id, page_number=page_number).first_or_404()
         try:
-            document = Document.query.get_or_404(doc_id)
-            page = Page.query.filter_by(document_id=doc_id, page_number=page_number).first_or_404()
+            if page.image_ref:
+                # Served straight from the image store, no decoding or copy. Stored images
+                # never change, so the content hash of the reference is the ETag.
+                ref = preview_refs(page)[size]
+                image_hash = ref.split('.', 1)[0]
+                return cached_image(
+                    f"img-{image_hash}",
+                    versioned=request.args.get('v') == image_hash,
+                    path_or_file=image_path(ref),
+                    mimetype=image_mimetype(ref),
+                    as_attachment=False,
+                    download_name=f'page_{page_number}.{ref.rsplit(".", 1)[-1]}'
+                )
             
-            if not page.image_data:
+            # Pages not yet migrated to the image store (see migrate_db.py); their image
+            # is never rewritten, so the page id identifies its version
+            etag = f"legacy-{page.id}"
+            if request.if_none_match.contains(etag):
+                return cached_image(etag, versioned=False)
+            image_data = db.session.query(Page.image_data).filter_by(id=page.id).scalar()
+            if not image_data:
                 return jsonify({'error': 'No image data available for this page'}), 404
-            
-            # Extract the base64 image data (remove the data URL prefix if present)
-            image_data = page.image_data
             if ',' in image_data:
                 image_data = image_data.split(',', 1)[1]
                 
             # Convert base64 to binary
             image_binary = base64.b64decode(image_data)
             
-            return send_file(
-                BytesIO(image_binary),
+            return cached_image(
+                etag,
+                versioned=False,
+                path_or_file=BytesIO(image_binary),
                 mimetype='image/png',  # Adjust mimetype if needed
                 as_attachment=False,
                 download_name=f'page_{page_number}.png'
@@ -151,7 +419,17 @@ def init_document_routes(app, db, Document, Page, process_pdf_document, mistral_
             page.content = content
             db.session.commit()
             
-            return jsonify({'message': 'Page content updated successfully'})
+            # Queue the patch of the existing analyses from the page windows containing the
+            # edited page; progress at GET /api/reanalysis/<reanalysis_id>
+            # (?reanalyze=false to skip, e.g. while correcting several pages in a row)
+            response = {'message': 'Page content updated successfully'}
+            if request.args.get('reanalyze', 'true').lower() != 'false':
+                job = queue_reanalysis(db, ReanalysisJob, document, page_number, current_user.id)
+                reanalysis_worker.start()
+                reanalysis_worker.notify()
+                response['reanalysis'] = serialize_reanalysis(job)
+            
+            return jsonify(response)
             
         except Exception as e:
             db.session.rollback()
@@ -0,0 +1,18 @@
+from flask import jsonify
+from flask_login import login_required
+
+def init_metrics_routes(app, ocr_cache, llm_cache, mistral_limiter, ocr_scheduler, job_workers):
+    @app.route('/api/metrics', methods=['GET'])
+    @login_required
+    def get_metrics():
+        """Get processing metrics (cache hit rates, Mistral rate limiter state, queue depths)"""
+        try:
+            return jsonify({
+                'ocr_cache': ocr_cache.stats(),
+                'llm_cache': llm_cache.stats(),
+                'mistral_rate_limiter': mistral_limiter.stats(),
+                'ocr_scheduler': ocr_scheduler.stats(),
+                'processing_jobs': job_workers.stats()
+            })
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
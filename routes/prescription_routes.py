@@ -1,6 +1,7 @@
 from flask import jsonify, request
 from flask_login import login_required, current_user
 from models import Patient
+from modules.http_cache import cached_json
 
 def init_prescription_routes(app, db, Document, PrescriptionAnalysis, Medication, prescription_agent, process_prescription_analysis, mistral_client):
     @app.route('/api/analyze-prescription/<int:doc_id>', methods=['GET'])
@@ -22,7 +23,7 @@ def init_prescription_routes(app, db, Document, PrescriptionAnalysis, Medication
                 return jsonify({'error': 'Access denied'}), 403
             
             if document.prescription:
-                return jsonify({
+                return cached_json({
                     'medications': [{
                         'name': med.name,
                         'dosage': med.dosage,
@@ -1,7 +1,9 @@
 from flask import jsonify, Blueprint, request, current_app
-import dateutil.parser
 import json
 import os
+from modules.summarizer_processor import extraction_fields
+from modules.persistence import bulk_insert, load_page_texts
+from modules.http_cache import cached_json
 
 # Create the Blueprint
 summary_routes = Blueprint('summary_routes', __name__)
@@ -16,7 +18,7 @@ def init_summary_routes(app, db, Document, DocumentSummary, SummaryExtraction, p
         try:
             document = Document.query.get_or_404(doc_id)
             if document.summary:
-                return jsonify({
+                return cached_json({
                     'extractions': [{
                         'category': ext.category,
                         'field': ext.field,
@@ -52,10 +54,7 @@ def init_summary_routes(app, db, Document, DocumentSummary, SummaryExtraction, p
                 })
             
             # Get document pages
-            pages = [{
-                'page_number': page.page_number,
-                'content': page.content
-            } for page in document.pages]
+            pages = load_page_texts(db, doc_id)
             print(f"📄 Retrieved {len(pages)} pages for processing")
             
             # Process document using summarizer
@@ -77,38 +76,11 @@ def init_summary_routes(app, db, Document, DocumentSummary, SummaryExtraction, p
             db.session.flush()  # Flush to get the summary ID
             print(f"✅ Created summary record with ID: {summary.id}")
             
-            # Add extractions
-            print("📥 Adding extractions to database...")
-            for i, ext in enumerate(extractions, 1):
-                try:
-                    print(f"\n🔄 Processing extraction {i}/{len(extractions)}")
-                    print(f"📝 Extraction data: {json.dumps(ext, indent=2)}")
-                    
-                    # Parse date if present
-                    associated_date = None
-                    if ext.get('associated_date'):
-                        try:
-                            associated_date = dateutil.parser.parse(ext['associated_date']).date()
-                            print(f"📅 Parsed associated_date: {associated_date}")
-                        except Exception as date_error:
-                            print(f"⚠️ Error parsing date: {str(date_error)}")
-                    
-                    extraction = SummaryExtraction(
-                        summary_id=summary.id,
-                        category=ext['category'],
-                        field=ext['field'],
-                        value=ext['value'],
-                        page_number=ext['page_number'],
-                        associated_date=associated_date,
-                        extraction_date=dateutil.parser.parse(ext['extraction_date'])
-                    )
-                    print(f"✅ Created extraction object: {extraction}")
-                    db.session.add(extraction)
-                    print(f"✅ Added extraction {i} to session")
-                except Exception as ext_error:
-                    print(f"❌ Error processing extraction {i}: {str(ext_error)}")
-                    print(f"❌ Problematic extraction data: {json.dumps(ext, indent=2)}")
-                    raise
+            # Add extractions (one bulk INSERT, committed with the summary)
+            print(f"📥 Adding {len(extractions)} extractions to database...")
+            bulk_insert(db, SummaryExtraction, [
+                dict(extraction_fields(ext), summary_id=summary.id) for ext in extractions
+            ])
             
             print("💾 Committing all changes to database...")
             db.session.commit()
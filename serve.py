@@ -0,0 +1,6 @@
+# Entry point of the container. Render worker processes (modules/document_processor.py)
+# re-run the main script when they start, so the app is only imported under the __main__
+# guard: started with `python app.py`, every worker would also load the whole app.
+if __name__ == '__main__':
+    from app import run
+    run()